@@ -0,0 +1,36 @@
+import parallel
+
+
+# Check whether a metric's confidence interval is as tight as requested
+# :acc: RunningStats - Accumulated samples of the metric
+# :precision: float - Target half-width, in the metric's units or as a fraction of the mean if relative
+# :relative: bool - Whether precision is relative to the mean
+def precise_enough(acc, precision: float, relative: bool = False) -> bool:
+    if acc.count < 2:
+        return False
+    target = precision * abs(acc.mean) if relative else precision
+    return acc.half_width() <= target
+
+
+# Keep sampling each threshold in rounds until its waveplate cost is known to the requested precision
+# Each round runs a fresh simulation of sim's class over the thresholds still pending, with the same
+# options as sim, and merges its results into sim.results. Round seeds are derived from sim.seed,
+# so a seeded adaptive run is reproducible, see parallel.round_seed.
+# :sim: Simulation - The simulation being filled, with precision, relative, max_iterations and thresholds set
+# :batch: int - Iterations per threshold per round
+def run_adaptive(sim, batch: int, metric: str = 'waveplates') -> None:
+    root = parallel.seed_sequence(sim.seed)
+    pending = list(sim.thresholds)
+    rounds = 0
+    while pending:
+        seeding = parallel.round_seed(sim, root, rounds, sim.results[pending[0]][metric].count)
+        sub = type(sim)(batch, thresholds=tuple(pending), workers=sim.workers, **seeding, **sim.options())
+        parallel.merge_results(sim.results, dict(sub.results))
+        rounds += 1
+
+        pending = [
+            threshold for threshold in pending
+            if not precise_enough(sim.results[threshold][metric], sim.precision, sim.relative)
+            and (sim.max_iterations is None or sim.results[threshold][metric].count < sim.max_iterations)
+        ]
+    return
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from echo import Echo
+from tacet import TacetField
+import cost_agnostic_sim
+import indiv_cost_sim
+import roster
+import tacet_field_sim
+
+# Stored throughput to compare against, written with --save-baseline
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+# Fraction below the baseline throughput at which a benchmark counts as a regression
+REGRESSION_THRESHOLD = 0.2
+
+SEED = 0
+
+
+def bench_roll_substats() -> tuple:
+    random.seed(SEED)
+    echoes = [Echo() for _ in range(20000)]
+    start = time.perf_counter()
+    for e in echoes:
+        e.roll_substats(3)
+    return len(echoes), time.perf_counter() - start
+
+
+def bench_roll_substats_batch() -> tuple:
+    rng = np.random.default_rng(SEED)
+    start = time.perf_counter()
+    batch = Echo.roll_substats_batch(200000, 3, rng)
+    return len(batch.dbl_crit), time.perf_counter() - start
+
+
+def bench_calculate_costs() -> tuple:
+    random.seed(SEED)
+    echoes = [Echo() for _ in range(20000)]
+    for e in echoes:
+        e.roll_substats(3)
+    start = time.perf_counter()
+    for _ in range(5):
+        for e in echoes:
+            e.calculate_costs()
+    return 5 * len(echoes), time.perf_counter() - start
+
+
+def bench_drop_one() -> tuple:
+    random.seed(SEED)
+    t = TacetField(iterations=0)
+    samplers = t._samplers()
+    start = time.perf_counter()
+    for _ in range(50000):
+        t.drop_one(samplers)
+    return 50000, time.perf_counter() - start
+
+
+def bench_tacet_run() -> tuple:
+    random.seed(SEED)
+    t = TacetField(iterations=0)
+    start = time.perf_counter()
+    for _ in range(10000):
+        t.run()
+    return sum(t.total_echoes_generated.values()), time.perf_counter() - start
+
+
+def bench_drop_block() -> tuple:
+    t = TacetField(iterations=0)
+    rng = np.random.default_rng(SEED)
+    start = time.perf_counter()
+    for _ in range(8):
+        t.drop_block(16384, rng)
+    return sum(t.total_echoes_generated.values()), time.perf_counter() - start
+
+
+# Time a complete simulation, counting trials over every threshold
+def simulation(cls, iterations: int, *args, **kwargs):
+    def bench() -> tuple:
+        start = time.perf_counter()
+        sim = cls(iterations, *args, seed=SEED, **kwargs)
+        elapsed = time.perf_counter() - start
+        return sum(metrics['waveplates'].count for metrics in sim.results.values()), elapsed
+    return bench
+
+
+# name: (function returning (units, seconds), unit)
+BENCHMARKS = {
+    'echo.roll_substats': (bench_roll_substats, 'echoes'),
+    'echo.roll_substats_batch': (bench_roll_substats_batch, 'echoes'),
+    'echo.calculate_costs': (bench_calculate_costs, 'echoes'),
+    'tacet.drop_one': (bench_drop_one, 'echoes'),
+    'tacet.run': (bench_tacet_run, 'echoes'),
+    'tacet.drop_block': (bench_drop_block, 'echoes'),
+    'cost_agnostic.scalar': (simulation(cost_agnostic_sim.Simulation, 100, batched=False), 'trials'),
+    'cost_agnostic.batched': (simulation(cost_agnostic_sim.Simulation, 2000), 'trials'),
+    'cost_agnostic.skip': (simulation(cost_agnostic_sim.Simulation, 20000, skip=True), 'trials'),
+    'cost_agnostic.keyed': (simulation(cost_agnostic_sim.Simulation, 100, keyed=True), 'trials'),
+    'indiv_cost.scalar': (simulation(indiv_cost_sim.BaseSimulation, 100, 3, batched=False), 'trials'),
+    'indiv_cost.batched': (simulation(indiv_cost_sim.BaseSimulation, 2000, 3), 'trials'),
+    'tacet_field.scalar': (simulation(tacet_field_sim.Simulation, 20, batched=False), 'trials'),
+    'tacet_field.batched': (simulation(tacet_field_sim.Simulation, 200), 'trials'),
+    'tacet_field.skip': (simulation(tacet_field_sim.Simulation, 200, skip=True), 'trials'),
+    'tacet_field.keyed': (simulation(tacet_field_sim.Simulation, 20, keyed=True), 'trials'),
+    'roster.planner': (simulation(roster.Planner, 200, [
+        roster.Character("A"), roster.Character("B", set='Incorrect', acceptable={1: ['ATK%'], 3: ['Aero%', 'ATK%']}),
+    ]), 'trials'),
+}
+
+
+# Run the benchmarks and return the best throughput of each in units per second
+# :names: list - Benchmarks to run, all of them if empty
+# :repeat: int - Runs per benchmark, the fastest one is kept
+def run_benchmarks(names: list = None, repeat: int = 3) -> dict:
+    rates = {}
+    for name in names or BENCHMARKS:
+        function, unit = BENCHMARKS[name]
+        best = max(units / seconds for units, seconds in (function() for _ in range(repeat)))
+        rates[name] = {'rate': best, 'unit': unit}
+    return rates
+
+
+def load_baseline(path: str = BASELINE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(rates: dict, path: str = BASELINE_PATH) -> None:
+    with open(path, 'w') as f:
+        json.dump(rates, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return
+
+
+# Print a report against the baseline and return the names of the benchmarks that regressed
+# :threshold: float - Fraction below the baseline rate that counts as a regression
+def compare(rates: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD, stream=sys.stdout) -> list:
+    regressions = []
+    print(f"{'benchmark':<26}{'rate':>16}{'baseline':>16}{'change':>10}", file=stream)
+    for name, result in rates.items():
+        rate, unit = result['rate'], result['unit']
+        line = f"{name:<26}{rate:>12,.0f} {unit[0]}/s"
+        if name in baseline:
+            change = rate / baseline[name]['rate'] - 1
+            line += f"{baseline[name]['rate']:>12,.0f} {unit[0]}/s{change:>+10.1%}"
+            if change < -threshold:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line, file=stream)
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the throughput of the hot paths at fixed seeds.")
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run, default all of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="fraction below the baseline rate that fails the run")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--output', help="also write the report to this file")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    rates = run_benchmarks(args.names, args.repeat)
+    baseline = load_baseline(args.baseline)
+    regressions = compare(rates, baseline, args.threshold)
+    if args.output:
+        with open(args.output, 'w') as f:
+            compare(rates, baseline, args.threshold, stream=f)
+
+    if args.save_baseline:
+        save_baseline({**baseline, **rates}, args.baseline)
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from echo import Echo
+from tacet import TacetField
+import parallel
+
+# Default location and limits of the on-disk cache
+DEFAULT_DIR = '.echo_cache'
+MAX_BYTES = 256 * 1024 ** 2
+MAX_AGE = 30 * 24 * 60 * 60  # seconds
+
+# Directory of the simulation modules, the only ones whose source goes into the code version
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Hash the source of the simulation code, so any edit to it invalidates the cache
+# :cls: type - The simulation class, whose own module and every module it depends on are hashed
+# :options: tuple - Option values of the run, the modules of those defined in CODE_DIR, e.g. a policy, are hashed too
+def code_version(cls: type, *options) -> str:
+    digest = hashlib.sha256()
+    for module in code_modules(cls, *(type(value) for value in options)):
+        with open(inspect.getfile(module), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# The modules of CODE_DIR defining the classes, and every module of CODE_DIR they import, directly or
+# through one another. Found from the modules, classes and functions in each module's namespace, sorted by name
+def code_modules(*classes) -> list:
+    found = {}
+    pending = [sys.modules.get(cls.__module__) for cls in classes]
+    while pending:
+        module = pending.pop()
+        path = getattr(module, '__file__', None)
+        if not path or os.path.dirname(os.path.abspath(path)) != CODE_DIR or module.__name__ in found:
+            continue
+        found[module.__name__] = module
+        for value in vars(module).values():
+            if inspect.isclass(value) or inspect.isfunction(value):
+                value = sys.modules.get(value.__module__)
+            if inspect.ismodule(value):
+                pending.append(value)
+    return [found[name] for name in sorted(found)]
+
+
+# Content address of a scenario: everything that decides its results except the iteration count
+# :cls: type - The simulation class
+# :seed: int - The seed of the run
+# :workers: int - Number of worker processes, part of the key because seeded results depend on it
+# :kwargs: dict - The remaining simulation options, e.g. cost_filter, batched, crn, thresholds
+def scenario_key(cls: type, seed: int, workers: int, kwargs: dict) -> str:
+    scenario = {
+        'simulation': [os.path.basename(inspect.getfile(cls)), cls.__qualname__],
+        'options': {key: list(value) if isinstance(value, tuple) else value for key, value in kwargs.items()},
+        'seed': seed,
+        'workers': workers,
+        'echo': [Echo.possible_substats, Echo.substat_distribution, Echo.xp_thresholds],
+        'tacet': [
+            TacetField.acceptable, TacetField.costs, TacetField.sets,
+            TacetField.mainstats, TacetField.mainstat_probs, TacetField.five_drop_chance,
+        ],
+        'code': code_version(cls, *kwargs.values()),
+    }
+    encoded = json.dumps(scenario, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+# On-disk cache of simulation accumulators, keyed by scenario_key
+# A request for more iterations than are stored only simulates the missing ones
+# :directory: str - Where the cache entries are stored
+# :max_bytes: int - Total size above which the least recently used entries are evicted
+# :max_age: float - Age in seconds after which an unused entry is evicted
+class ResultCache:
+    def __init__(self, directory: str = DEFAULT_DIR, max_bytes: int = MAX_BYTES, max_age: float = MAX_AGE) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+        return
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    # Return the stored results for a key, or None, marking the entry as recently used
+    def load(self, key: str) -> dict:
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                results = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)
+        return results
+
+    # Atomically replace the stored results for a key, then evict old entries
+    def store(self, key: str, results: dict) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path(key))
+        self.evict()
+        return
+
+    # Remove entries past max_age, then the least recently used ones until under max_bytes
+    def evict(self) -> None:
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.directory, name)
+            info = os.stat(path)
+            if now - info.st_mtime > self.max_age:
+                os.remove(path)
+            else:
+                entries.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+        return
+
+    # Run a simulation through the cache
+    # Identical scenarios are served from disk, and only the iterations beyond what is
+    # stored are simulated, with a seed derived from the stored count, then merged in
+    # :cls: type - The simulation class, constructed as cls(iterations, seed=..., workers=..., **kwargs)
+    # :iterations: int - Trials wanted per threshold
+    # Returns the simulation with results filled in; call compute_averages as usual
+    def run(self, cls: type, iterations: int, seed: int = None, workers: int = 1, **kwargs):
+        assert kwargs.get('precision') is None, "adaptive runs are not cached"
+        key = scenario_key(cls, seed, workers, kwargs)
+        sim = cls(0, seed=seed, workers=1, **kwargs)
+
+        cached = self.load(key)
+        if cached is not None:
+            parallel.merge_results(sim.results, cached)
+        done = min((metrics['waveplates'].count for metrics in sim.results.values()), default=0)
+        if cached is not None and done >= iterations:
+            return sim
+
+        # The first run uses the seed as is, so a cold cache matches an uncached run,
+        # and keyed runs carry on with the trials after the stored ones
+        if kwargs.get('keyed'):
+            kwargs = {**kwargs, 'first_trial': done}
+        elif seed is not None and done > 0:
+            seed = np.random.SeedSequence(seed, spawn_key=(done,))
+        extra = cls(iterations - done, seed=seed, workers=workers, **kwargs)
+        parallel.merge_results(sim.results, dict(extra.results))
+        self.store(key, dict(sim.results))
+        return sim
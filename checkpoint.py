@@ -0,0 +1,127 @@
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+import adaptive
+import cache
+import parallel
+import trialstore
+
+# Trials per threshold between snapshots when the simulation does not set checkpoint_every
+CHECKPOINT_EVERY = 25000
+# Layout of the snapshot files, bumped when it changes so older snapshots are refused
+VERSION = 2
+
+
+# Run a simulation in rounds, snapshotting the accumulated results after each one, so a run that
+# is killed can be resumed from its last snapshot instead of from scratch
+# Each round is a fresh simulation of sim's class over the thresholds still pending, with the same
+# options as sim, seeded from the root SeedSequence and the round number as in adaptive.run_adaptive.
+# Between rounds no generator is live, so the root entropy and the round count are the whole RNG
+# state, and a resumed run draws exactly what the uninterrupted one would have. Results depend on
+# the seed, the number of workers and checkpoint_every, which is why the snapshot records them.
+# The rounds draw a different random stream from an uncheckpointed run with the same seed, which
+# draws all its trials from the seed itself; only keyed runs, seeded per trial, give the same trials.
+# With precision set the rounds are the adaptive ones, so resuming gives the same as run_adaptive.
+# With a trial store, every round writes and closes its own parts before the snapshot after it, which
+# lists the parts then in the store; resuming deletes the others, the ones of a round cut short, so
+# the store holds exactly the trials of the results. A snapshot is saved before the first round too.
+# :sim: Simulation - The simulation being filled, with checkpoint, checkpoint_every and resume set
+# :iterations: int - Trials per threshold, or per threshold per round when precision is set
+def run_checkpointed(sim, iterations: int, metric: str = 'waveplates') -> None:
+    every = sim.checkpoint_every or CHECKPOINT_EVERY
+    key = run_key(sim, iterations, every)
+
+    state = load(sim.checkpoint) if sim.resume else None
+    if state is not None:
+        if state['version'] != VERSION or state['key'] != key:
+            raise ValueError(f"checkpoint {sim.checkpoint} was written by a different run, remove it to start over")
+        root = np.random.SeedSequence(state['entropy'], spawn_key=state['spawn_key'])
+        rounds = state['rounds']
+        # Taken over as they are, merging into fresh accumulators would regroup the quantile sketches
+        sim.results.update(state['results'])
+        if sim.trials is not None:
+            trialstore.drop_parts(sim.trials, state['parts'])
+    else:
+        root = parallel.seed_sequence(sim.seed)
+        rounds = 0
+        save(sim.checkpoint, snapshot(sim, key, root, rounds))
+
+    while True:
+        if sim.precision is None:
+            done = {threshold: sim.results[threshold][metric].count for threshold in sim.thresholds}
+            pending = [threshold for threshold in sim.thresholds if done[threshold] < iterations]
+            batch = min((iterations - done[threshold] for threshold in pending), default=0)
+            batch = min(batch, every)
+        else:
+            pending = [
+                threshold for threshold in sim.thresholds
+                if not rounds or (
+                    not adaptive.precise_enough(sim.results[threshold][metric], sim.precision, sim.relative)
+                    and (sim.max_iterations is None or sim.results[threshold][metric].count < sim.max_iterations)
+                )
+            ]
+            batch = iterations
+        if not pending:
+            return
+
+        seeding = parallel.round_seed(sim, root, rounds, sim.results[pending[0]][metric].count)
+        sub = type(sim)(batch, thresholds=tuple(pending), workers=sim.workers, **seeding, **sim.options())
+        parallel.merge_results(sim.results, dict(sub.results))
+        rounds += 1
+        save(sim.checkpoint, snapshot(sim, key, root, rounds))
+
+
+# The state of a run after some rounds, with the trial store parts they wrote and those already there
+def snapshot(sim, key: str, root: np.random.SeedSequence, rounds: int) -> dict:
+    return {
+        'version': VERSION,
+        'key': key,
+        'entropy': root.entropy,
+        'spawn_key': root.spawn_key,
+        'rounds': rounds,
+        'results': dict(sim.results),
+        'parts': [] if sim.trials is None else trialstore.part_names(sim.trials),
+    }
+
+
+# Everything a snapshot must agree on to be resumed by a run, as a cache.scenario_key
+# Where the trials are stored does not change them, so the trial store may move between runs
+def run_key(sim, iterations: int, every: int) -> str:
+    return cache.scenario_key(type(sim), sim.seed, sim.workers, {
+        **{key: value for key, value in sim.options().items() if key != 'trials'},
+        'thresholds': sim.thresholds,
+        'iterations': iterations,
+        'checkpoint_every': every,
+        'precision': sim.precision,
+        'relative': sim.relative,
+        'max_iterations': sim.max_iterations,
+    })
+
+
+# The snapshot at path, or None if there is none yet
+def load(path: str) -> dict:
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Atomically replace the snapshot at path, flushed to disk before it takes the old one's place,
+# so a crash at any point leaves either the previous snapshot or this one
+def save(path: str, state: dict) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return
@@ -0,0 +1,277 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from cache import ResultCache
+import cost_agnostic_sim
+import indiv_cost_sim
+import instrument
+import tacet_field_sim
+import variance
+
+# Simulation class and default iteration count of each scenario, as in the modules' __main__ blocks
+SCENARIOS = {
+    'cost_agnostic': (cost_agnostic_sim.Simulation, 10000),
+    'indiv_cost': (indiv_cost_sim.BaseSimulation, 50000),
+    'tacet_field': (tacet_field_sim.Simulation, 1000),
+}
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run an echo tuning scenario headlessly and export the averages.")
+    parser.add_argument('scenario', choices=SCENARIOS.keys())
+    parser.add_argument('--iterations', type=int, help="trials per threshold (per round with --precision)")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--thresholds', type=int, nargs='+', default=[1, 2, 3, 4, 5], choices=range(1, 6))
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--precision', type=float, help="target 95%% CI half-width of the waveplate cost")
+    parser.add_argument('--relative', action='store_true', help="--precision is a fraction of the mean")
+    parser.add_argument('--max-iterations', type=int)
+    parser.add_argument('--cost-filter', type=int, nargs='+', default=[1, 3], choices=(1, 3),
+                        help="indiv_cost only: the echo costs to farm, one simulation each")
+    parser.add_argument('--crn', action='store_true', help="common random numbers across thresholds")
+    parser.add_argument('--exact', action='store_true', help="cost_agnostic only: solve exactly instead of sampling")
+    parser.add_argument('--estimator', choices=variance.ESTIMATORS,
+                        help="cost_agnostic only: estimate from weighted or stratified echo draws, "
+                             "--iterations and --max-iterations then count echoes")
+    parser.add_argument('--scalar', action='store_true', help="roll one Echo at a time instead of in batches")
+    parser.add_argument('--skip', action='store_true',
+                        help="sample the echoes retried until usable in aggregate instead of rolling each")
+    parser.add_argument('--keyed', action='store_true',
+                        help="roll one Echo at a time, seeding each trial from its own stream so it can be replayed")
+    parser.add_argument('--replay', type=int, nargs=2, metavar=('THRESHOLD', 'TRIAL'),
+                        help="print the drops and rolls of one trial of the keyed run with --seed instead of running it")
+    parser.add_argument('--cache', metavar='DIR', help="serve and extend results from an on-disk cache in DIR")
+    parser.add_argument('--checkpoint', metavar='DIR',
+                        help="snapshot each run's progress to a file in DIR as it goes; checkpointed runs draw a different "
+                             "random stream from uncheckpointed ones with the same --seed, unless --keyed")
+    parser.add_argument('--checkpoint-every', type=int, help="trials per threshold between snapshots")
+    parser.add_argument('--resume', action='store_true', help="continue from the snapshots in --checkpoint")
+    parser.add_argument('--trials', metavar='DIR', help="store every trial's raw outcome in a trial store in DIR")
+    parser.add_argument('--instrument', action='store_true',
+                        help="count RNG draws, rejections and drops and time each phase, reported with the averages")
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--output', default='-', help="file to write the averages to, '-' for stdout")
+    parser.add_argument('--plot', help="save the waveplate cost plot to this image file")
+    parser.add_argument('--table', help="save the results table to this image file")
+    parser.add_argument('--histogram', help="save the per-trial waveplate cost histogram to this image file")
+    args = parser.parse_args(argv)
+
+    if args.exact and args.scenario != 'cost_agnostic':
+        parser.error("--exact is only supported by the cost_agnostic scenario")
+    if args.estimator and args.scenario != 'cost_agnostic':
+        parser.error("--estimator is only supported by the cost_agnostic scenario")
+    if args.skip and (args.scalar or args.crn or args.exact or args.estimator):
+        parser.error("--skip cannot be combined with --scalar, --crn, --exact or --estimator")
+    if args.replay:
+        args.keyed = True
+        if args.seed is None:
+            parser.error("--replay needs the --seed of the run")
+        if args.scenario == 'indiv_cost' and len(args.cost_filter) != 1:
+            parser.error("--replay needs a single --cost-filter")
+    if args.keyed and (args.crn or args.skip or args.exact or args.estimator):
+        parser.error("--keyed cannot be combined with --crn, --skip, --exact or --estimator")
+    if args.estimator and (args.exact or args.crn or args.cache):
+        parser.error("--estimator cannot be combined with --exact, --crn or --cache")
+    if args.cache and args.precision is not None:
+        parser.error("--cache does not support adaptive runs with --precision")
+    if args.checkpoint and (args.cache or args.exact or args.estimator):
+        parser.error("--checkpoint cannot be combined with --cache, --exact or --estimator")
+    if args.trials and (args.cache or args.exact or args.estimator):
+        parser.error("--trials cannot be combined with --cache, --exact or --estimator")
+    if (args.resume or args.checkpoint_every) and not args.checkpoint:
+        parser.error("--resume and --checkpoint-every need --checkpoint")
+    return args
+
+
+# Build and run the simulations for a scenario, one per cost filter for indiv_cost
+# Returns a list of (label, simulation) pairs with averages computed
+def run_scenario(args: argparse.Namespace) -> list:
+    cls, default_iterations = SCENARIOS[args.scenario]
+    iterations = args.iterations or default_iterations
+    kwargs = {
+        'batched': not args.scalar,
+        'workers': args.workers,
+        'seed': args.seed,
+        'thresholds': tuple(args.thresholds),
+        'precision': args.precision,
+        'relative': args.relative,
+        'max_iterations': args.max_iterations,
+    }
+    kwargs['crn'] = args.crn
+    kwargs['skip'] = args.skip
+    kwargs['keyed'] = args.keyed
+    if args.scenario == 'cost_agnostic':
+        kwargs['exact'] = args.exact
+        kwargs['estimator'] = args.estimator
+
+    cache = ResultCache(args.cache) if args.cache else None
+    if cache is not None:
+        for key in ('precision', 'relative', 'max_iterations'):
+            del kwargs[key]
+    if args.scenario == 'indiv_cost':
+        runs = [(cost, {'cost_filter': cost}) for cost in args.cost_filter]
+    else:
+        runs = [(None, {})]
+
+    if args.checkpoint:
+        os.makedirs(args.checkpoint, exist_ok=True)
+
+    sims = []
+    for cost_filter, options in runs:
+        instrument.reset()
+        name = args.scenario if cost_filter is None else f"{args.scenario}_{cost_filter}"
+        if args.trials:
+            # One store per run, the costs of indiv_cost record different columns
+            options = {**options, 'trials': os.path.join(args.trials, name)}
+        if args.checkpoint:
+            options = {
+                **options,
+                'checkpoint': os.path.join(args.checkpoint, f"{name}.ckpt"),
+                'checkpoint_every': args.checkpoint_every,
+                'resume': args.resume,
+            }
+        if cache is not None:
+            sim = cache.run(cls, iterations, **options, **kwargs)
+        else:
+            sim = cls(iterations, **options, **kwargs)
+        sim.compute_averages()
+        if args.instrument:
+            sim.instrumentation = instrument.report(sim)
+        sims.append((cost_filter, sim))
+    return sims
+
+
+# Flatten the averages into one row per (cost filter, threshold), dict-valued metrics become key_subkey
+def to_rows(scenario: str, sims: list) -> list:
+    rows = []
+    for cost_filter, sim in sims:
+        for threshold, data in sorted(sim.averages.items()):
+            row = {'scenario': scenario, 'cost_filter': cost_filter, 'threshold': threshold}
+            for key, value in data.items():
+                if isinstance(value, dict):
+                    for sub, sub_value in value.items():
+                        row[f"{key}_{sub}"] = sub_value
+                else:
+                    row[key] = value
+            rows.append(row)
+    return rows
+
+
+def write_output(args: argparse.Namespace, sims: list, elapsed: float) -> None:
+    stream = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        if args.format == 'json':
+            report = {
+                'scenario': args.scenario,
+                'seed': args.seed,
+                'elapsed_seconds': elapsed,
+                'runs': [
+                    {'cost_filter': cost_filter, 'averages': sim.averages, **instrumentation(sim)}
+                    for cost_filter, sim in sims
+                ],
+            }
+            if args.instrument and (args.plot or args.table or args.histogram):
+                report['render_seconds'] = instrument.timings['render']
+            json.dump(report, stream, indent=2, default=float)
+            stream.write("\n")
+        else:
+            rows = to_rows(args.scenario, sims)
+            fields = list(dict.fromkeys(key for row in rows for key in row))
+            writer = csv.DictWriter(stream, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+            for cost_filter, sim in sims:
+                if args.instrument:
+                    print(json.dumps({'cost_filter': cost_filter, **instrumentation(sim)}), file=sys.stderr)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return
+
+
+# Print one trial of a keyed run as JSON, with every tacet run's drops and every Echo rolled
+def write_replay(args: argparse.Namespace) -> None:
+    cls = SCENARIOS[args.scenario][0]
+    options = {'cost_filter': args.cost_filter[0]} if args.scenario == 'indiv_cost' else {}
+    threshold, trial = args.replay
+    sim = cls(0, seed=args.seed, thresholds=(threshold,), keyed=True, **options)
+    replayed = sim.replay(threshold, trial)
+    replayed['echoes'] = [
+        {'mainstat': e.mainstat, 'cost': e.cost, 'set': e.set, 'substats': e.substats, 'dbl_crit': bool(e.dbl_crit)}
+        for e in replayed['echoes']
+    ]
+    if 'drops' in replayed:
+        replayed['drops'] = [[[e.cost, e.mainstat, e.set] for e in drops] for drops in replayed['drops']]
+    report = {'scenario': args.scenario, 'seed': args.seed, 'threshold': threshold, 'trial': trial, **replayed}
+    json.dump(report, sys.stdout, indent=2, default=str)
+    sys.stdout.write("\n")
+    return
+
+
+def instrumentation(sim) -> dict:
+    report = getattr(sim, 'instrumentation', None)
+    return {'instrumentation': report} if report is not None else {}
+
+
+# Render the requested images with the Agg backend, importing matplotlib only now
+def save_figures(args: argparse.Namespace, sims: list) -> None:
+    if not (args.plot or args.table or args.histogram):
+        return
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    combined = args.scenario == 'indiv_cost' and len(sims) == 2
+    if args.plot:
+        if combined:
+            indiv_cost_sim.plot_combined(sims[0][1], sims[1][1])
+        else:
+            sims[0][1].create_plot()
+        plt.gcf().savefig(args.plot, facecolor=plt.gcf().get_facecolor())
+        plt.close('all')
+    if args.histogram and (args.exact or args.estimator):
+        print("exact and estimated results have no distribution, skipping --histogram", file=sys.stderr)
+    elif args.histogram:
+        if combined:
+            indiv_cost_sim.plot_combined_histogram(sims[0][1], sims[1][1])
+        else:
+            sims[0][1].create_histogram()
+        plt.gcf().savefig(args.histogram, facecolor=plt.gcf().get_facecolor())
+        plt.close('all')
+    if args.table:
+        if combined:
+            indiv_cost_sim.create_combined_table(sims[0][1], sims[1][1])
+        elif args.scenario == 'tacet_field':
+            print("tacet_field has no results table, skipping --table", file=sys.stderr)
+            return
+        else:
+            sims[0][1].create_table()
+        plt.gcf().savefig(args.table, facecolor=plt.gcf().get_facecolor())
+        plt.close('all')
+    return
+
+
+def main(argv: list = None) -> None:
+    args = parse_args(argv)
+    if args.replay:
+        write_replay(args)
+        return
+    if args.instrument:
+        instrument.enable()
+    start_time = time.perf_counter()
+    sims = run_scenario(args)
+    elapsed = time.perf_counter() - start_time
+
+    instrument.reset()
+    save_figures(args, sims)
+    write_output(args, sims, elapsed)
+    instrument.disable()
+    return
+
+
+if __name__ == "__main__":
+    main()
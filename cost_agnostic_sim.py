@@ -1,56 +1,76 @@
-from echo import Echo
-from tacet import TacetField
-import matplotlib.pyplot as plt
-from collections import defaultdict
+from engine import Scenario
+import engine
+import markov
+import parallel
 import time
-
-class Simulation:
-    def __init__(self, iterations: int) -> None:
-        self.results = defaultdict(lambda: {
-            'xp': [], 
-            'tuners': [], 
-            'rolled': [],
-            'xp_waveplates': [],
-            'tuners_waveplates': [],
-            'waveplates': [],
-        })
-        self.averages = {}
-        self.run(iterations)
+import variance
+
+class Simulation(engine.Simulation):
+    # Echoes are rolled one after another with no drops, until 5 are double crit
+    scenario = Scenario({None: 5}, drops=False)
+
+    # :iterations: int - Number of trials per threshold, or per threshold per round when precision is set
+    # :batched: bool - Roll echoes in bulk with Echo.roll_substats_batch instead of one Echo at a time
+    # :exact: bool - Compute the expected results with markov.solve instead of sampling
+    # :crn: bool - Common random numbers, score every threshold against the same echo draws
+    # :estimator: str - Estimate the expected results with variance.estimate, 'importance' or
+    #   'stratified', instead of averaging trials; iterations and max_iterations then count echoes
+    # :workers: int - Number of processes to split the iterations between
+    # :seed: int - Seed for reproducible runs, results depend on both the seed and the number of workers
+    # :thresholds: tuple - The thresholds to simulate
+    # :precision: float - Keep sampling each threshold until the 95% CI half-width of its waveplate cost is this small
+    # :relative: bool - Whether precision is a fraction of the mean waveplate cost rather than waveplates
+    # :max_iterations: int - Upper limit on the iterations per threshold when precision is set
+    # :policy: policy.Policy - Tuning policy to roll with instead of the plain crit threshold rule
+    # :checkpoint: str - File to snapshot the results to as the run goes, see checkpoint.run_checkpointed
+    # :checkpoint_every: int - Trials per threshold between snapshots, checkpoint.CHECKPOINT_EVERY if omitted
+    # :resume: bool - Continue from the snapshot in checkpoint, if there is one, instead of starting over
+    # :skip: bool - Sample the echoes retried until usable in aggregate instead of rolling each
+    # :trials: str - Directory of a trialstore to append every trial to
+    # :keyed: bool - Seed each trial from its own keyed stream, so any trial can be replayed on its own
+    # :first_trial: int - Index of the first trial of each threshold in the keyed streams
+    def __init__(self, iterations: int, batched: bool = True, exact: bool = False, crn: bool = False,
+                 workers: int = 1, seed: int = None, thresholds: tuple = (1, 2, 3, 4, 5),
+                 precision: float = None, relative: bool = False, max_iterations: int = None,
+                 policy=None, estimator: str = None, checkpoint: str = None, checkpoint_every: int = None,
+                 resume: bool = False, skip: bool = False, trials: str = None,
+                 keyed: bool = False, first_trial: int = 0) -> None:
+        assert not (exact and policy is not None), "markov.solve only models the crit threshold rule"
+        assert not (exact and estimator), "exact results need no estimator"
+        assert estimator in (None, *variance.ESTIMATORS), f"estimator must be one of {variance.ESTIMATORS}"
+        self.exact = exact
+        self.estimator = estimator
+        self.expected = {}
+        super().__init__(iterations, batched, crn, workers, seed, thresholds, precision, relative,
+                         max_iterations, policy, checkpoint, checkpoint_every, resume, skip,
+                         trials, keyed, first_trial)
 
     def run(self, iterations: int) -> None:
-        # Roll echoes with every possible threshold for the specified number of iterations
-        for threshold in range(1, 6): 
-            for _ in range(iterations):
-                xp, tuners, rolled, usable = 0, 0, 0, 0
-                while usable < 5:
-                    echo = Echo()
-                    echo.roll_substats(threshold)
-                    if echo.dbl_crit:
-                        usable += 1
-
-                    cost = echo.calculate_costs()
-                    xp += cost[0]
-                    tuners += cost[1]
-                    rolled += 1
-
-                xp_waveplates = 12.4136 * xp
-                tuners_waveplates = 3 * tuners
-                self.results[threshold]['xp'].append(xp)
-                self.results[threshold]['tuners'].append(tuners)
-                self.results[threshold]['rolled'].append(rolled)
-                self.results[threshold]['xp_waveplates'].append(xp_waveplates)
-                self.results[threshold]['tuners_waveplates'].append(tuners_waveplates)
-                self.results[threshold]['waveplates'].append(max(xp_waveplates, tuners_waveplates))
-
-        return
+        if self.exact:
+            for threshold in self.thresholds:
+                self.expected[threshold] = markov.solve(threshold)
+            return
+        if self.estimator:
+            if iterations:
+                rng = parallel.seed_streams(self.seed)
+                for threshold in self.thresholds:
+                    self.expected[threshold] = variance.estimate(
+                        threshold, iterations, self.estimator, rng, self.policy, precision=self.precision,
+                        relative=self.relative, max_echoes=self.max_iterations,
+                    )
+            return
+        super().run(iterations)
 
     def compute_averages(self) -> None:
-        for threshold in sorted(self.results.keys()):
-            metrics = self.results[threshold]
-            self.averages[threshold] = {
-                key: sum(values) / len(values) if values else 0
-                for key, values in metrics.items()
-            }
+        super().compute_averages()
+
+        for threshold in sorted(self.expected.keys()):
+            expected = self.expected[threshold]
+            self.averages[threshold] = {key: expected[key] for key in self.results.default_factory()}
+            # Estimates carry their confidence intervals and effective sample sizes
+            for key in ('half_width', 'echoes', 'ess', 'ess_trials', 'weight_ess'):
+                if key in expected:
+                    self.averages[threshold][key] = expected[key]
 
         for threshold in self.averages:
             avg_xp_waveplates = self.averages[threshold]['xp_waveplates']
@@ -61,7 +81,12 @@ class Simulation:
         return
 
     def create_table(self) -> None:
+        import matplotlib.pyplot as plt
         columns = ["Threshold", "Echoes Rolled", "Gold Tubes Used", "Tuners Used", "Days of Waveplate", "Limiting Factor"]
+        # Exact results have no distribution, sampled ones add the spread of the days needed
+        sampled = all('waveplates_percentiles' in data for data in self.averages.values())
+        if sampled:
+            columns += [f"P{p} Days" for p in (50, 90)]
 
         table_data = []
         for threshold, data in sorted(self.averages.items()):
@@ -79,9 +104,11 @@ class Simulation:
                 f"{days:.2f}",
                 f"{abs(bottleneck):.2f}% {'Tuners' if bottleneck > 0 else 'XP'}"
             ]
+            if sampled:
+                row += [f"{data['waveplates_percentiles'][p] / 240:.2f}" for p in (50, 90)]
             table_data.append(row)
 
-        fig, ax = plt.subplots(figsize=(10, len(table_data) * 0.5 + 1))
+        fig, ax = plt.subplots(figsize=(12 if sampled else 10, len(table_data) * 0.5 + 1))
         plt.title("Costs to Achieve 5x Double Crit by Fodder Threshold", color="white")
         fig.patch.set_facecolor('#303030')
         ax.axis('off')
@@ -102,6 +129,7 @@ class Simulation:
         return
 
     def create_plot(self) -> None:
+        import matplotlib.pyplot as plt
         thresholds = sorted(self.averages.keys())
         avg_xp_waveplates = [self.averages[t]['xp_waveplates'] for t in thresholds]
         avg_tuners_waveplates = [self.averages[t]['tuners_waveplates'] for t in thresholds]
@@ -136,9 +164,15 @@ class Simulation:
                 f"{abs(data['bottleneck']):.2f}% "
                 f"{'tuner' if data['bottleneck'] > 0 else 'xp'} bottleneck"
             )
+            if 'waveplates_percentiles' in data:
+                print("    waveplates " + ", ".join(
+                    f"P{p} {value:.2f}" for p, value in data['waveplates_percentiles'].items()
+                ))
         return
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     start_time = time.perf_counter()
 
     iterations = 10000  # Number of iterations for the simulation
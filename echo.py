@@ -1,4 +1,25 @@
 import random
+import bisect
+from typing import NamedTuple
+import numpy as np
+import sampling
+
+
+# Outcome of rolling a batch of echoes at once, one row per echo
+# :substats: (n, 5) int8 - Substat ids in roll order (index into Echo.possible_substats), -1 past num_substats
+# :tiers: (n, 5) int8 - Tier index of each substat value, -1 past num_substats
+# :num_substats: (n,) int8 - Number of substats the echo was rolled to before being kept or abandoned
+# :dbl_crit: (n,) bool - Whether the echo ended with both crit stats
+# :xp: (n,) float - Gold tubes consumed, as returned by Echo.calculate_costs
+# :tuners: (n,) float - Tuners consumed, as returned by Echo.calculate_costs
+class RollBatch(NamedTuple):
+    substats: np.ndarray
+    tiers: np.ndarray
+    num_substats: np.ndarray
+    dbl_crit: np.ndarray
+    xp: np.ndarray
+    tuners: np.ndarray
+
 
 class Echo:
     possible_substats = {
@@ -41,62 +62,324 @@ class Echo:
             5: [28.52, 50],
     }
 
+    # Substats are stored compactly: `mask` has bit i set when substat id i (its index in
+    # possible_substats) is present, and `packed` holds one byte per rolled substat, in roll
+    # order, with the substat id in the high nibble and the tier index in the low nibble.
+    # Names and values are only decoded when `substats` is read.
+    __slots__ = ('mainstat', 'cost', 'set', 'dbl_crit', 'mask', 'packed', 'num_substats')
+
     # Initialize Echo object
     # :threshold: int - The number of substats by which the echo must have at least one crit stat to proceed
     def __init__(self, mainstat=None, cost=None, set=None) -> None:
         self.mainstat = mainstat
         self.cost = cost
         self.set = set
-        self.substats = []
+        self.mask = 0
+        self.packed = 0
+        self.num_substats = 0
         self.dbl_crit = None
         
         return
+
+    # The rolled substats as (name, value) tuples, in roll order
+    @property
+    def substats(self) -> list:
+        names = self._roll_tables()[0]
+        substats = []
+        for i in range(self.num_substats):
+            slot = (self.packed >> (8 * i)) & 0xFF
+            name = names[slot >> 4]
+            substats.append((name, self.possible_substats[name][slot & 0xF]))
+        return substats
+
+    # Replace the rolled substats, e.g. `echo.substats = []` to reroll the same echo
+    @substats.setter
+    def substats(self, substats: list) -> None:
+        names = self._roll_tables()[0]
+        self.mask = 0
+        self.packed = 0
+        self.num_substats = 0
+        for name, value in substats:
+            self._add_substat(names.index(name), self.possible_substats[name].index(value))
+        return
+
+    def _add_substat(self, substat_id: int, tier: int) -> None:
+        self.mask |= 1 << substat_id
+        self.packed |= (substat_id << 4 | tier) << (8 * self.num_substats)
+        self.num_substats += 1
+        return
     
     # Roll the substats for the Echo object
     # :threshold: int - The number of substats to roll before checking for the presence of a crit stat
-    def roll_substats(self, threshold: int) -> None:
-        while len(self.substats) < threshold:
-            # Randomly select a substat from the available options
-            substat = random.choice(list(self.possible_substats.keys()))
-            if not any(line[0] == substat for line in self.substats):
-                roll = random.randrange(0, 100)
-                # Determine exact substat value based on roll
-                for i in range(len(self.substat_distribution[substat])):
-                    if roll < self.substat_distribution[substat][i]:
-                        self.substats.append((substat, self.possible_substats[substat][i]))
-                        break
+    # :policy: Policy - Tuning policy deciding when to abandon the echo and whether it is usable,
+    #                   the crit threshold rule below if omitted
+    # :table: tuple - The policy's scalar_table for this threshold and mainstat, when the caller has resolved it,
+    #                 e.g. from Policy.scalar_tables; looked up from policy if omitted
+    def roll_substats(self, threshold: int, policy=None, table: tuple = None) -> None:
+        if table is None and policy is not None:
+            table = policy.scalar_table(threshold, self.mainstat)
+        if table is not None:
+            self._roll_policy(table)
+            return
+        names, tier_lookup, crit_mask = self._roll_tables()
+        self._roll_to(threshold, len(names), tier_lookup)
 
-        has_cr = any(line[0] == 'Crit Rate' for line in self.substats)
-        has_cd = any(line[0] == 'Crit Damage' for line in self.substats)
         # If neither crit stat is present by the threshold, mark dbl_crit as False and do not roll further
         # If at least one crit stat is present by the threshold, roll until we have 5 substats
-        if (len(self.substats) < 5):
-            if not (has_cr or has_cd):
-                self.dbl_crit = False
-            else: 
-                self.roll_substats(5)
-        else:
-            # If both crit stats are present at 5 substats, mark dbl_crit as True
-            # If we have at least one crit stat but not both (an echo would not have 
-            # made it here unless it had at least one), mark dbl_crit as False
-            if has_cr and has_cd:
-                self.dbl_crit = True
-            else:
+        if self.num_substats < 5:
+            if not self.mask & crit_mask:
                 self.dbl_crit = False
+                return
+            self._roll_to(5, len(names), tier_lookup)
+
+        # If both crit stats are present at 5 substats, mark dbl_crit as True
+        # If we have at least one crit stat but not both (an echo would not have 
+        # made it here unless it had at least one), mark dbl_crit as False
+        self.dbl_crit = self.mask & crit_mask == crit_mask
         return 
 
+    # Roll one substat at a time, looking up the policy's compiled decision after each one
+    # :table: tuple - (decisions, radix, size) from Policy.scalar_table
+    def _roll_policy(self, table: tuple) -> None:
+        names, tier_lookup, _ = self._roll_tables()
+        decisions, radix, size = table
+        code = 0
+        for i in range(self.num_substats):
+            slot = (self.packed >> (8 * i)) & 0xFF
+            code += radix[slot >> 4] * ((slot & 0xF) + 1)
+
+        while self.num_substats < 5:
+            self._roll_to(self.num_substats + 1, len(names), tier_lookup)
+            slot = (self.packed >> (8 * (self.num_substats - 1))) & 0xFF
+            code += radix[slot >> 4] * ((slot & 0xF) + 1)
+            if self.num_substats < 5 and not decisions[self.num_substats * size + code]:
+                self.dbl_crit = False
+                return
+        self.dbl_crit = decisions[5 * size + code]
+        return
+
+    def _roll_to(self, count: int, num_types: int, tier_lookup: list) -> None:
+        while self.num_substats < count:
+            # Randomly select a substat from the available options, rerolling duplicates
+            substat_id = int(random.random() * num_types)
+            if not self.mask >> substat_id & 1:
+                # Determine exact substat value based on roll
+                self._add_substat(substat_id, tier_lookup[substat_id][int(random.random() * 100)])
+        return
+
     # Calculate the XP and Tuner costs associated with the Echo's substats
     def calculate_costs(self) -> list:
-        if self.dbl_crit:
-            cost = self.xp_thresholds[5]
+        return self.outcome_costs(self.num_substats, self.dbl_crit)
+
+    # Calculate the XP and Tuner costs of an echo that stopped at num_substats substats
+    # Abandoned echoes refund 70% of the XP and 30% of the Tuners spent on them
+    @classmethod
+    def outcome_costs(cls, num_substats: int, dbl_crit: bool) -> list:
+        if dbl_crit:
+            cost = cls.xp_thresholds[5]
         else:
-            cost = [0.3 * self.xp_thresholds[len(self.substats)][0], 0.7 * self.xp_thresholds[len(self.substats)][1]]
+            cost = [0.3 * cls.xp_thresholds[num_substats][0], 0.7 * cls.xp_thresholds[num_substats][1]]
         return cost
     
+    # Roll the substats for n echoes at once with the same abandon rule as roll_substats
+    # :n: int - The number of echoes to roll
+    # :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+    # :rng: np.random.Generator - Source of randomness, a fresh unseeded generator if omitted
+    # :policy: Policy - Tuning policy to apply instead of the crit threshold rule, see score_batch
+    @classmethod
+    def roll_substats_batch(cls, n: int, threshold: int, rng: np.random.Generator = None, policy=None,
+                            mainstat_ids: np.ndarray = None, mainstats: tuple = (None,)) -> RollBatch:
+        substats, tiers = cls.draw_substats_batch(n, rng)
+        return cls.score_batch(substats, tiers, threshold, policy, mainstat_ids, mainstats)
+
+    # Draw all 5 substats and tiers for n echoes, before any abandon rule is applied
+    # The outcome for any threshold is a prefix of this draw, see score_batch
+    # :n: int - The number of echoes to draw
+    # :rng: np.random.Generator - Source of randomness, a fresh unseeded generator if omitted
+    @classmethod
+    def draw_substats_batch(cls, n: int, rng: np.random.Generator = None) -> tuple:
+        if rng is None:
+            rng = np.random.default_rng()
+        tier_lookup = cls._batch_tables()[0]
+        num_types = tier_lookup.shape[0]
+
+        # Drawing with replacement and discarding duplicates is the same as taking
+        # the first 5 entries of a uniformly random permutation of the substat types
+        substats = rng.random((n, num_types)).argsort(axis=1)[:, :5].astype(np.int8)
+        rolls = rng.integers(0, 100, size=(n, 5))
+        tiers = tier_lookup[substats, rolls]
+        return substats, tiers
+
+    # Apply the abandon rule for a threshold to echoes drawn by draw_substats_batch
+    # :substats: (n, 5) array - Substat ids of the full draw
+    # :tiers: (n, 5) array - Tier indices of the full draw
+    # :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+    # :policy: Policy - Tuning policy to apply instead of the crit threshold rule
+    # :mainstat_ids: (n,) array - Index of each echo's mainstat in mainstats, for policies by mainstat
+    # :mainstats: tuple - Mainstat names the ids refer to
+    @classmethod
+    def score_batch(cls, substats: np.ndarray, tiers: np.ndarray, threshold: int, policy=None,
+                    mainstat_ids: np.ndarray = None, mainstats: tuple = (None,)) -> RollBatch:
+        xp_table, tuner_table = cls._batch_tables()[1:]
+
+        if policy is not None:
+            decisions, radix = policy.batch_table(threshold, mainstats)
+            if mainstat_ids is None or decisions.shape[0] == 1:
+                mainstat_ids = np.zeros(len(substats), dtype=np.intp)
+            # codes[:, k] is the table index of the tracked tiers after k + 1 substats
+            codes = np.cumsum(radix[substats] * (tiers.astype(np.int64) + 1), axis=1)
+            decided = decisions[mainstat_ids[:, None], np.arange(1, 6), codes]
+            stops = ~decided[:, :4]
+            num_substats = np.where(stops.any(axis=1), stops.argmax(axis=1) + 1, 5).astype(np.int8)
+            dbl_crit = (num_substats == 5) & decided[:, 4]
+        else:
+            # Crit Rate and Crit Damage are the first two substat ids
+            is_crit = substats < 2
+            has_crit = is_crit[:, :threshold].any(axis=1)
+            dbl_crit = is_crit.sum(axis=1) == 2
+            num_substats = np.where(has_crit, 5, threshold).astype(np.int8)
+            dbl_crit &= has_crit
+
+        unrolled = np.arange(5) >= num_substats[:, None]
+        substats = np.where(unrolled, -1, substats).astype(np.int8)
+        tiers = np.where(unrolled, -1, tiers).astype(np.int8)
+
+        xp = np.where(dbl_crit, xp_table[5], 0.3 * xp_table[num_substats])
+        tuners = np.where(dbl_crit, tuner_table[5], 0.7 * tuner_table[num_substats])
+        return RollBatch(substats, tiers, num_substats, dbl_crit, xp, tuners)
+
+    # Substat names, the tier index of every roll in 0-99 for each substat id, and the crit stat bitmask
+    # Compiled once from the class-level tables and rebuilt if they change
+    @classmethod
+    def _roll_tables(cls) -> tuple:
+        return sampling.compiled(cls, 'roll', cls._build_roll_tables, cls.possible_substats, cls.substat_distribution)
+
+    @staticmethod
+    def _build_roll_tables(possible_substats: dict, substat_distribution: dict) -> tuple:
+        names = tuple(possible_substats.keys())
+        assert len(names) <= 16 and all(len(v) <= 16 for v in possible_substats.values()), \
+            "substat ids and tiers must fit in a nibble"
+        tier_lookup = [
+            [min(bisect.bisect_right(substat_distribution[name], roll), len(possible_substats[name]) - 1)
+             for roll in range(100)]
+            for name in names
+        ]
+        crit_mask = (1 << names.index('Crit Rate')) | (1 << names.index('Crit Damage'))
+        return names, tier_lookup, crit_mask
+
+    # Lookup tables used by roll_substats_batch, compiled from the class-level tables
+    @classmethod
+    def _batch_tables(cls) -> tuple:
+        return sampling.compiled(
+            cls, 'batch', cls._build_batch_tables,
+            cls.possible_substats, cls.substat_distribution, cls.xp_thresholds,
+        )
+
+    @staticmethod
+    def _build_batch_tables(possible_substats: dict, substat_distribution: dict, xp_thresholds: dict) -> tuple:
+        names = list(possible_substats.keys())
+        assert names[:2] == ['Crit Rate', 'Crit Damage'], "crit stats must be the first two substats"
+
+        # tier_lookup[substat id, roll] gives the same tier index as roll_substats
+        tier_lookup = np.empty((len(names), 100), dtype=np.int8)
+        for i, name in enumerate(names):
+            tier_lookup[i] = np.searchsorted(substat_distribution[name], np.arange(100), side='right')
+
+        xp_table = np.zeros(6)
+        tuner_table = np.zeros(6)
+        for k, (xp, tuners) in xp_thresholds.items():
+            xp_table[k] = xp
+            tuner_table[k] = tuners
+        return tier_lookup, xp_table, tuner_table
+
     def __str__(self) -> str:
         rep = f"Set: {self.set}\n" + f"Cost: {self.cost}\n" + f"Mainstat: {self.mainstat}\n" + f"Substats: {self.substats}"
         return rep
-        
+
+
+# Serve pre-rolled echo outcomes one at a time, refilling in bulk from Echo.roll_substats_batch
+# :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+# :rng: np.random.Generator - Source of randomness, a fresh unseeded generator if omitted
+# :size: int - The number of echoes rolled per refill
+# :policy: Policy - Tuning policy to score the echoes with, the crit threshold rule if omitted
+class RollStream:
+    def __init__(self, threshold: int, rng: np.random.Generator = None, size: int = 65536, policy=None) -> None:
+        self.threshold = threshold
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.size = size
+        self.policy = policy
+        self.draw = None
+        self.outcomes = {}
+        self.index = size
+
+        return
+
+    # Return (dbl_crit, xp, tuners) for the next echo in the stream
+    # :mainstat: str - The echo's mainstat, for policies by mainstat
+    def next(self, mainstat: str = None) -> tuple:
+        if self.index == self.size:
+            self.draw = Echo.draw_substats_batch(self.size, self.rng)
+            self.outcomes = {}
+            self.index = 0
+        if self.policy is None or not self.policy.by_mainstat:
+            mainstat = None
+        if mainstat not in self.outcomes:
+            batch = Echo.score_batch(*self.draw, self.threshold, self.policy, None, (mainstat,))
+            self.outcomes[mainstat] = list(zip(batch.dbl_crit.tolist(), batch.xp.tolist(), batch.tuners.tolist()))
+        outcome = self.outcomes[mainstat][self.index]
+        self.index += 1
+        return outcome
+
+
+# Serve pre-drawn echo outcomes one at a time, each scored against several thresholds
+# so that every threshold sees the same substats for the same echo (common random numbers)
+# :thresholds: tuple - The thresholds to score each echo against
+# :rng: np.random.Generator - Source of randomness, a fresh unseeded generator if omitted
+# :size: int - The number of echoes drawn per refill
+# :policy: Policy - Tuning policy to score the echoes with, the crit threshold rule if omitted
+class CommonRollStream:
+    def __init__(self, thresholds: tuple = (1, 2, 3, 4, 5), rng: np.random.Generator = None, size: int = 65536,
+                 policy=None) -> None:
+        self.thresholds = tuple(thresholds)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.size = size
+        self.policy = policy
+        self.draw = None
+        self.outcomes = {}
+        self.index = size
+
+        return
+
+    # Return one (dbl_crit, xp, tuners) tuple per threshold for the next echo in the stream
+    # :mainstat: str - The echo's mainstat, for policies by mainstat
+    def next(self, mainstat: str = None) -> tuple:
+        if self.index == self.size:
+            self.draw = Echo.draw_substats_batch(self.size, self.rng)
+            self.outcomes = {}
+            self.index = 0
+        if self.policy is None or not self.policy.by_mainstat:
+            mainstat = None
+        if mainstat not in self.outcomes:
+            per_threshold = []
+            for threshold in self.thresholds:
+                batch = Echo.score_batch(*self.draw, threshold, self.policy, None, (mainstat,))
+                per_threshold.append(zip(batch.dbl_crit.tolist(), batch.xp.tolist(), batch.tuners.tolist()))
+            self.outcomes[mainstat] = list(zip(*per_threshold))
+        outcome = self.outcomes[mainstat][self.index]
+        self.index += 1
+        return outcome
+
+
+# Roll a single echo, taking the outcome from the stream instead when one is given
+# :policy: Policy - Tuning policy for the roll, a stream applies its own
+# :tables: ScalarTables - The policy's tables for this threshold, from Policy.scalar_tables, instead of policy
+# Returns the dbl_crit flag and the [xp, tuners] cost of the echo
+def roll_echo(e: Echo, threshold: int, stream: RollStream = None, policy=None, tables: dict = None) -> tuple:
+    if stream is not None:
+        dbl_crit, xp, tuners = stream.next(e.mainstat)
+        return dbl_crit, [xp, tuners]
+    e.roll_substats(threshold, policy, None if tables is None else tables[e.mainstat])
+    return e.dbl_crit, e.calculate_costs()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,700 @@
+from echo import Echo, RollStream, CommonRollStream, roll_echo
+from tacet import TacetField
+from collections import defaultdict
+from stats import RunningStats, histogram_series
+import adaptive
+import checkpoint
+import copy
+import markov
+import numpy as np
+import parallel
+import random
+import sampling
+import streams
+import trialstore
+
+# Number of echoes rolled per call to Echo.roll_substats_batch by scenarios without drops
+BATCH_SIZE = 65536
+
+
+# A farming scenario declared as data, from which the engine builds its run loops
+# :targets: dict - Usable double crit echoes needed per echo cost, the trial ends once it has all of them;
+#                  without drops the single key is None
+# :drops: bool - Whether echoes come from tacet field drops, kept when of the correct set and an acceptable
+#                mainstat for a cost still short of its target, or are rolled one after another for free
+# :rerolls: tuple - Mainstats of fixed echoes, like the 4 cost, rerolled after farming until each is usable
+class Scenario:
+    def __init__(self, targets: dict, drops: bool = True, rerolls: tuple = ()) -> None:
+        assert drops or (list(targets) == [None] and not rerolls), "without drops, target only None and reroll nothing"
+        assert not drops or all(cost in TacetField.mainstats for cost in targets), "targets must be echo costs that drop"
+        self.targets = dict(targets)
+        self.drops = drops
+        self.rerolls = tuple(rerolls)
+        # One rolled count per farmed cost, named 'rolled' when a single cost is farmed
+        self.rolled_keys = {
+            cost: 'rolled' if len(self.targets) == 1 else f"rolled_{cost}c" for cost in self.targets
+        }
+        self._kernels = {}
+
+        return
+
+    # A fresh set of accumulators for one threshold
+    def metrics(self) -> dict:
+        metrics = {'xp': RunningStats(), 'tuners': RunningStats()}
+        if self.drops:
+            metrics['total'] = {cost: RunningStats() for cost in TacetField.costs}
+        for key in self.rolled_keys.values():
+            metrics[key] = RunningStats()
+        if self.drops:
+            metrics['echo_waveplates'] = RunningStats()
+        metrics['xp_waveplates'] = RunningStats()
+        metrics['tuners_waveplates'] = RunningStats()
+        metrics['waveplates'] = RunningStats()
+        return metrics
+
+    # The columns of this scenario's per-trial records in a trialstore, with their dtypes
+    def trial_columns(self) -> dict:
+        columns = {'threshold': np.int8, 'xp': np.float64, 'tuners': np.float64}
+        for key in self.rolled_keys.values():
+            columns[key] = np.int32
+        if self.drops:
+            columns['tacet_runs'] = np.int32
+            for cost in TacetField.costs:
+                columns[f"total_{cost}"] = np.int32
+        return columns
+
+    # One or many trials, as passed to Simulation.record_trial(s), keyed by trial_columns
+    def trial_values(self, threshold: int, xp, tuners, rolled: dict, tacet_runs=None, total: dict = None) -> dict:
+        values = {'threshold': threshold, 'xp': xp, 'tuners': tuners}
+        for cost, key in self.rolled_keys.items():
+            values[key] = rolled[cost]
+        if self.drops:
+            values['tacet_runs'] = tacet_runs
+            for cost in TacetField.costs:
+                values[f"total_{cost}"] = total[cost]
+        return values
+
+    # The run loop for a mode, 'scalar', 'keyed', 'batched', 'skip' or 'crn', specialized to this scenario on
+    # first use. Scalar, keyed, batched and skip kernels are called as kernel(sim, threshold, iterations, rng),
+    # crn ones as kernel(sim, iterations, rng) and cover all of sim.thresholds. 'trial' gives the single
+    # trial the scalar and keyed loops share, see _trial_echoes
+    def kernel(self, mode: str):
+        if mode not in self._kernels:
+            source = 'drops' if self.drops else 'echoes'
+            self._kernels[mode] = globals()[f"_{mode}_{source}"](self)
+        return self._kernels[mode]
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, '_kernels': {}}
+
+    def __repr__(self) -> str:
+        return f"Scenario(targets={self.targets!r}, drops={self.drops!r}, rerolls={self.rerolls!r})"
+
+
+# Base class of the simulations: runs its scenario in the requested mode and accumulates the trials
+# Subclasses set `scenario`, as a class attribute or before calling this constructor
+# :iterations: int - Number of trials per threshold, or per threshold per round when precision is set
+# :batched: bool - Generate drops and rolls in blocks instead of one Echo at a time
+# :crn: bool - Common random numbers, score every threshold against the same drops and echo draws
+# :workers: int - Number of processes to split the iterations between
+# :seed: int - Seed for reproducible runs, results depend on both the seed and the number of workers
+# :thresholds: tuple - The thresholds to simulate
+# :precision: float - Keep sampling each threshold until the 95% CI half-width of its waveplate cost is this small
+# :relative: bool - Whether precision is a fraction of the mean waveplate cost rather than waveplates
+# :max_iterations: int - Upper limit on the iterations per threshold when precision is set
+# :policy: policy.Policy - Tuning policy to roll with instead of the plain crit threshold rule
+# :checkpoint: str - File to snapshot the results to as the run goes, see checkpoint.run_checkpointed
+# :checkpoint_every: int - Trials per threshold between snapshots, checkpoint.CHECKPOINT_EVERY if omitted
+# :resume: bool - Continue from the snapshot in checkpoint, if there is one, instead of starting over
+# :skip: bool - Sample the echoes retried until usable in aggregate instead of rolling each, see retry_costs
+# :trials: str - Directory of a trialstore to append every trial to as it is recorded; resuming a checkpointed
+#                run drops the trials of the round cut short by the interruption before running it again
+# :keyed: bool - Roll one Echo at a time, seeding each trial from its own counter-based stream keyed by the seed,
+#                scenario, threshold and trial index, so any trial can be replayed on its own, see replay
+# :first_trial: int - Index of the first trial of each threshold in the keyed streams, set for the chunks and
+#                     rounds of a keyed run so that they carry on from one another
+class Simulation:
+    scenario = None
+
+    def __init__(self, iterations: int, batched: bool = True, crn: bool = False, workers: int = 1,
+                 seed: int = None, thresholds: tuple = (1, 2, 3, 4, 5), precision: float = None,
+                 relative: bool = False, max_iterations: int = None, policy=None, checkpoint: str = None,
+                 checkpoint_every: int = None, resume: bool = False, skip: bool = False,
+                 trials: str = None, keyed: bool = False, first_trial: int = 0) -> None:
+        assert not (skip and crn), "skip-ahead sampling draws each threshold separately, it cannot share draws"
+        assert not (keyed and (skip or crn)), "keyed streams are per trial and threshold, they cannot skip or share draws"
+        # Keyed trials are replayed from the seed, so an unseeded run draws one to keep
+        if keyed and seed is None:
+            assert checkpoint is None, "a keyed run can only be resumed with the seed it was started with"
+            seed = int(np.random.SeedSequence().entropy)
+        self.iterations = iterations
+        self.batched = batched
+        self.skip = skip
+        self.crn = crn
+        self.workers = workers
+        self.seed = seed
+        self.thresholds = tuple(thresholds)
+        self.precision = precision
+        self.relative = relative
+        self.max_iterations = max_iterations
+        self.policy = policy
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
+        self.trials = trials
+        self.keyed = keyed
+        self.first_trial = first_trial
+        sampling.refresh()
+        self.sink = None if trials is None else trialstore.TrialWriter(trials, self.scenario.trial_columns())
+        self.results = defaultdict(self.scenario.metrics)
+        self.averages = {}
+        self.run(iterations)
+        if self.sink is not None:
+            self.sink.close()
+
+    # Options needed to rebuild an equivalent simulation, e.g. in a worker process
+    def options(self) -> dict:
+        return {'batched': self.batched, 'crn': self.crn, 'policy': self.policy, 'skip': self.skip,
+                'trials': self.trials, 'keyed': self.keyed}
+
+    def run(self, iterations: int) -> None:
+        if self.checkpoint is not None:
+            checkpoint.run_checkpointed(self, iterations)
+            return
+
+        if self.precision is not None:
+            adaptive.run_adaptive(self, iterations)
+            return
+
+        if self.workers > 1:
+            partials = parallel.run_chunks(
+                type(self), iterations, self.workers, self.seed, thresholds=self.thresholds,
+                first_trial=self.first_trial, **self.options(),
+            )
+            for partial in partials:
+                parallel.merge_results(self.results, partial)
+            return
+
+        rng = parallel.seed_streams(self.seed)
+        if self.crn:
+            self.scenario.kernel('crn')(self, iterations, rng)
+            return
+
+        mode = 'keyed' if self.keyed else 'skip' if self.skip else 'batched' if self.batched else 'scalar'
+        kernel = self.scenario.kernel(mode)
+        for threshold in self.thresholds:
+            kernel(self, threshold, iterations, rng)
+        return
+
+    # The policy's scalar tables for a threshold, resolved once per trial loop rather than per echo,
+    # None without a policy
+    def scalar_tables(self, threshold: int) -> dict:
+        return None if self.policy is None else self.policy.scalar_tables(threshold)
+
+    # Rerun a single trial of a keyed simulation from its stream, without running the ones before it
+    # The random module is restored afterwards, so replaying does not disturb a run in progress
+    # :threshold: int - The threshold the trial was run for
+    # :trial: int - Index of the trial in the threshold's stream, counting from 0 across chunks and rounds
+    # Returns the trial's xp, tuners, rolled, tacet_runs and total as recorded, with the Echo of every roll
+    # in order under 'echoes' and, for scenarios with drops, the drops of every tacet run under 'drops'
+    def replay(self, threshold: int, trial: int) -> dict:
+        assert self.keyed, "only keyed simulations can replay their trials"
+        state = random.getstate()
+        random.seed(streams.trial_seed(streams.stream_key(self.seed, self.scenario, threshold), trial))
+        log = {'echoes': [], 'drops': []}
+        trial = self.scenario.kernel('trial')
+        try:
+            xp, tuners, rolled, tacet_runs, total = trial(threshold, self.scalar_tables(threshold), log)
+        finally:
+            random.setstate(state)
+        replayed = {'xp': xp, 'tuners': tuners, 'rolled': rolled, 'echoes': log['echoes']}
+        if self.scenario.drops:
+            replayed.update({'tacet_runs': tacet_runs, 'total': dict(total), 'drops': log['drops']})
+        return replayed
+
+    # Append one finished trial to the results for a threshold
+    # :rolled: dict - Echoes rolled per farmed cost
+    # :tacet_runs: int - Tacet runs farmed, None without drops
+    # :total: dict - Echoes dropped per cost, None without drops
+    def record_trial(self, threshold: int, xp: float, tuners: float, rolled: dict, tacet_runs: int = None,
+                     total: dict = None) -> None:
+        metrics = self.results[threshold]
+        xp_waveplates = 12.4136 * xp
+        tuners_waveplates = 3 * tuners
+
+        metrics['xp'].add(xp)
+        metrics['tuners'].add(tuners)
+        if total is not None:
+            for cost, acc in metrics['total'].items():
+                acc.add(total[cost])
+        for cost, key in self.scenario.rolled_keys.items():
+            metrics[key].add(rolled[cost])
+        if tacet_runs is None:
+            waveplates = max(xp_waveplates, tuners_waveplates)
+        else:
+            tacet_waveplates = tacet_runs * 60
+            metrics['echo_waveplates'].add(tacet_waveplates)
+            waveplates = max(xp_waveplates, tuners_waveplates, tacet_waveplates)
+        metrics['xp_waveplates'].add(xp_waveplates)
+        metrics['tuners_waveplates'].add(tuners_waveplates)
+        metrics['waveplates'].add(waveplates)
+        if self.sink is not None:
+            self.sink.append(self.scenario.trial_values(threshold, xp, tuners, rolled, tacet_runs, total))
+        return
+
+    # Append many finished trials to the results for a threshold, as record_trial with arrays
+    def record_trials(self, threshold: int, xp, tuners, rolled: dict, tacet_runs=None, total: dict = None) -> None:
+        metrics = self.results[threshold]
+        xp_waveplates = 12.4136 * np.asarray(xp)
+        tuners_waveplates = 3 * np.asarray(tuners)
+
+        metrics['xp'].extend(xp)
+        metrics['tuners'].extend(tuners)
+        if total is not None:
+            for cost, totals in total.items():
+                metrics['total'][cost].extend(totals)
+        for cost, key in self.scenario.rolled_keys.items():
+            metrics[key].extend(rolled[cost])
+        if tacet_runs is None:
+            waveplates = np.maximum(xp_waveplates, tuners_waveplates)
+        else:
+            tacet_waveplates = 60 * np.asarray(tacet_runs)
+            metrics['echo_waveplates'].extend(tacet_waveplates)
+            waveplates = np.maximum.reduce([xp_waveplates, tuners_waveplates, tacet_waveplates])
+        metrics['xp_waveplates'].extend(xp_waveplates)
+        metrics['tuners_waveplates'].extend(tuners_waveplates)
+        metrics['waveplates'].extend(waveplates)
+        if self.sink is not None:
+            self.sink.append(self.scenario.trial_values(threshold, xp, tuners, rolled, tacet_runs, total))
+        return
+
+    # Mean of every metric per threshold, with the number of trials and the waveplate percentiles
+    def compute_averages(self) -> None:
+        for threshold in sorted(self.results.keys()):
+            metrics = self.results[threshold]
+            self.averages[threshold] = {
+                key: {sub: acc.mean for sub, acc in value.items()} if isinstance(value, dict) else value.mean
+                for key, value in metrics.items()
+            }
+            self.averages[threshold]['iterations'] = metrics['waveplates'].count
+            self.averages[threshold]['waveplates_percentiles'] = metrics['waveplates'].percentiles()
+        return
+
+
+    # Histogram of one metric's per-trial distribution, one line per threshold
+    # :metric: str - Key of self.results, e.g. 'waveplates'
+    # :ax: matplotlib Axes to draw on, a new figure if omitted
+    def create_histogram(self, metric: str = 'waveplates', ax=None) -> None:
+        import matplotlib.pyplot as plt
+        if ax is None:
+            fig, ax = plt.subplots(figsize=(7, 5))
+            fig.patch.set_facecolor('#303030')
+        ax.set_facecolor('#303030')
+
+        for threshold, (edges, fractions) in histogram_series(self.results, metric).items():
+            ax.stairs(fractions, edges, label=f"Threshold {threshold}")
+
+        label = metric.replace('_', ' ').title()
+        ax.set_xscale('log')
+        ax.set_xlabel(label, color="white")
+        ax.set_ylabel("Fraction of Trials", color="white")
+        ax.set_title(self.histogram_title(label), color="white")
+        ax.tick_params(axis='both', colors="white")
+        ax.grid(True, color="white", linestyle=':', linewidth=0.5)
+
+        legend = ax.legend()
+        for text in legend.get_texts():
+            text.set_color("black")
+
+        plt.tight_layout()
+        return
+
+    # Title of create_histogram for a metric's label
+    def histogram_title(self, label: str) -> str:
+        return f"{label} Distribution by Threshold"
+
+# Kernels, one builder per mode and echo source. Each binds the scenario's constants once
+# and returns the loop run for every threshold.
+
+# One trial of fresh echoes rolled one at a time until the target is reached
+# The returned function is called as trial(threshold, tables, log), with tables from Simulation.scalar_tables,
+# and returns the arguments of Simulation.record_trial after the threshold; log, a dict of lists, collects
+# every Echo rolled
+def _trial_echoes(scenario: Scenario):
+    need = scenario.targets[None]
+
+    def trial(threshold: int, tables: dict = None, log: dict = None) -> tuple:
+        xp, tuners, rolled, usable = 0, 0, 0, 0
+        while usable < need:
+            e = Echo()
+            dbl_crit, cost = roll_echo(e, threshold, tables=tables)
+            if log is not None:
+                log['echoes'].append(e)
+            if dbl_crit:
+                usable += 1
+            xp += cost[0]
+            tuners += cost[1]
+            rolled += 1
+        return xp, tuners, {None: rolled}, None, None
+    return trial
+
+
+def _scalar_echoes(scenario: Scenario):
+    return _scalar(scenario)
+
+
+def _keyed_echoes(scenario: Scenario):
+    return _keyed(scenario)
+
+
+# Run the scenario's trials one after another, drawing from the random module as seeded for the run
+def _scalar(scenario: Scenario):
+    trial = scenario.kernel('trial')
+
+    def kernel(sim: Simulation, threshold: int, iterations: int, rng) -> None:
+        tables = sim.scalar_tables(threshold)
+        for _ in range(iterations):
+            sim.record_trial(threshold, *trial(threshold, tables))
+        return
+    return kernel
+
+
+# Run the scenario's trials one after another, reseeding the random module from each trial's own
+# keyed stream first, so that trial sim.first_trial + i draws the same whichever run it is part of
+def _keyed(scenario: Scenario):
+    trial = scenario.kernel('trial')
+
+    def kernel(sim: Simulation, threshold: int, iterations: int, rng) -> None:
+        tables = sim.scalar_tables(threshold)
+        key = streams.stream_key(sim.seed, scenario, threshold)
+        for seed in streams.trial_seeds(key, sim.first_trial, iterations):
+            random.seed(seed)
+            sim.record_trial(threshold, *trial(threshold, tables))
+        return
+    return kernel
+
+
+# Split a stream of batch-rolled echoes into consecutive trials, each ending on its last usable echo
+def _batched_echoes(scenario: Scenario):
+    need = scenario.targets[None]
+
+    def kernel(sim: Simulation, threshold: int, iterations: int, rng) -> None:
+        if rng is None:
+            rng = np.random.default_rng()
+        # Partial trial carried over from the end of the previous batch
+        carry_xp, carry_tuners, carry_rolled, carry_usable = 0, 0, 0, 0
+
+        done = 0
+        while done < iterations:
+            batch = Echo.roll_substats_batch(BATCH_SIZE, threshold, rng, sim.policy)
+            ends = np.flatnonzero(batch.dbl_crit)[need - 1 - carry_usable::need][:iterations - done]
+            if len(ends) == 0:
+                carry_xp += batch.xp.sum()
+                carry_tuners += batch.tuners.sum()
+                carry_rolled += BATCH_SIZE
+                carry_usable += int(batch.dbl_crit.sum())
+                continue
+
+            starts = np.concatenate(([0], ends[:-1] + 1))
+            trial_xp = np.add.reduceat(batch.xp[:ends[-1] + 1], starts)
+            trial_tuners = np.add.reduceat(batch.tuners[:ends[-1] + 1], starts)
+            trial_rolled = ends - starts + 1
+            trial_xp[0] += carry_xp
+            trial_tuners[0] += carry_tuners
+            trial_rolled[0] += carry_rolled
+
+            sim.record_trials(threshold, trial_xp, trial_tuners, {None: trial_rolled})
+            done += len(ends)
+
+            tail = slice(ends[-1] + 1, None)
+            carry_xp = batch.xp[tail].sum()
+            carry_tuners = batch.tuners[tail].sum()
+            carry_rolled = BATCH_SIZE - ends[-1] - 1
+            carry_usable = int(batch.dbl_crit[tail].sum())
+        return
+    return kernel
+
+
+# Sample whole trials from their totals: the echoes rolled before the `need`-th double crit
+# are a negative binomial count, split multinomially between the ways an echo can fail
+def _skip_echoes(scenario: Scenario):
+    need = scenario.targets[None]
+
+    def kernel(sim: Simulation, threshold: int, iterations: int, rng) -> None:
+        if rng is None:
+            rng = np.random.default_rng()
+        outcomes = markov.outcome_probabilities(threshold, sim.policy)
+        for start in range(0, iterations, BATCH_SIZE):
+            xp, tuners, rolled = retry_costs(outcomes, need, min(BATCH_SIZE, iterations - start), rng)
+            sim.record_trials(threshold, xp, tuners, {None: rolled})
+        return
+    return kernel
+
+
+# XP, tuners and echoes rolled of retrying an echo until `need` of them are usable, for n trials at once
+# The failed attempts before the need-th success number NegBin(need, p) and, given their count,
+# split multinomially between the failure outcomes, which is the same distribution as rolling
+# every attempt for two draws per trial
+# :outcomes: dict - {(num_substats, dbl_crit): probability} of one attempt, from markov.outcome_probabilities
+def retry_costs(outcomes: dict, need: int, n: int, rng: np.random.Generator) -> tuple:
+    p = outcomes[(5, True)]
+    assert p > 0, "no echo is ever usable under this threshold and policy"
+    failures = [outcome for outcome, prob in outcomes.items() if not outcome[1] and prob > 0]
+    dbl_xp, dbl_tuners = Echo.outcome_costs(5, True)
+
+    failed = rng.negative_binomial(need, p, n)
+    xp = np.full(n, need * dbl_xp, dtype=float)
+    tuners = np.full(n, need * dbl_tuners, dtype=float)
+    if failures:
+        probs = np.array([outcomes[outcome] for outcome in failures])
+        counts = rng.multinomial(failed, probs / probs.sum())
+        costs = np.array([Echo.outcome_costs(*outcome) for outcome in failures], dtype=float)
+        xp += counts @ costs[:, 0]
+        tuners += counts @ costs[:, 1]
+    return xp, tuners, failed + need
+
+
+# Score every threshold against one shared stream of full 5-substat draws
+# Trial i sees the same sequence of echoes at every threshold and each threshold stops at its own
+# last usable echo. A double crit at one threshold is also a double crit at every higher threshold,
+# so the lowest threshold always stops last and its trials set the boundaries. A policy need not
+# keep that order, so with one each trial ends where its last threshold stops.
+def _crn_echoes(scenario: Scenario):
+    need = scenario.targets[None]
+
+    def kernel(sim: Simulation, iterations: int, rng) -> None:
+        if rng is None:
+            rng = np.random.default_rng()
+        thresholds = sim.thresholds
+        # Draws of the trial left unfinished at the end of the previous batch
+        carry_substats, carry_tiers = np.empty((0, 5), np.int8), np.empty((0, 5), np.int8)
+
+        done = 0
+        while done < iterations:
+            substats, tiers = Echo.draw_substats_batch(BATCH_SIZE, rng)
+            substats = np.concatenate((carry_substats, substats))
+            tiers = np.concatenate((carry_tiers, tiers))
+            scored = {threshold: Echo.score_batch(substats, tiers, threshold, sim.policy) for threshold in thresholds}
+
+            if sim.policy is None:
+                ends = np.flatnonzero(scored[min(thresholds)].dbl_crit)[need - 1::need][:iterations - done]
+            else:
+                ends = trial_ends(scored, iterations - done, need)
+            if len(ends) == 0:
+                carry_substats, carry_tiers = substats, tiers
+                continue
+            starts = np.concatenate(([0], ends[:-1] + 1))
+
+            for threshold, batch in scored.items():
+                usable = np.cumsum(batch.dbl_crit)
+                before = np.concatenate(([0], usable))[starts]
+                stops = np.searchsorted(usable, before + need)
+                # Interleaving starts and stops lets reduceat sum each trial's own prefix
+                bounds = np.empty(2 * len(starts), dtype=np.intp)
+                bounds[0::2] = starts
+                bounds[1::2] = stops + 1
+                xp = np.add.reduceat(np.append(batch.xp, 0), bounds)[0::2]
+                tuners = np.add.reduceat(np.append(batch.tuners, 0), bounds)[0::2]
+                sim.record_trials(threshold, xp, tuners, {None: stops - starts + 1})
+
+            done += len(ends)
+            carry_substats, carry_tiers = substats[ends[-1] + 1:], tiers[ends[-1] + 1:]
+        return
+    return kernel
+
+
+# Last echo of each complete trial in a batch when every threshold must reach `need` double crits
+# :scored: dict - RollBatch per threshold for the same draws
+# :limit: int - Most trials to return
+def trial_ends(scored: dict, limit: int, need: int) -> np.ndarray:
+    usable = {threshold: np.cumsum(batch.dbl_crit) for threshold, batch in scored.items()}
+    ends = []
+    start = 0
+    while len(ends) < limit:
+        stops = [
+            np.searchsorted(counts, (counts[start - 1] if start else 0) + need)
+            for counts in usable.values()
+        ]
+        end = max(stops)
+        if end == len(next(iter(usable.values()))):
+            break
+        ends.append(end)
+        start = end + 1
+    return np.array(ends, dtype=np.intp)
+
+
+# One trial of drop → filter → roll, one tacet run and one Echo at a time, then reroll the fixed echoes
+# Called as the trial of _trial_echoes; log also collects the drops of every tacet run
+def _trial_drops(scenario: Scenario):
+    targets = scenario.targets
+    rerolls = scenario.rerolls
+
+    def trial(threshold: int, tables: dict = None, log: dict = None) -> tuple:
+        t = TacetField(iterations=0)
+        acceptable = t.acceptable
+        usable = {cost: 0 for cost in targets}
+        rolled = {cost: 0 for cost in targets}
+        xp, tuners, tacet_runs = 0, 0, 0
+
+        while any(usable[cost] < need for cost, need in targets.items()):
+            t.run()
+            tacet_runs += 1
+            if log is not None:
+                log['drops'].append(t.drops)
+            for e in t.drops:
+                if (
+                    e.cost in targets
+                    and e.set == 'Correct'
+                    and e.mainstat in acceptable[e.cost]
+                    and usable[e.cost] < targets[e.cost]
+                ):
+                    dbl_crit, cost = roll_echo(e, threshold, tables=tables)
+                    if log is not None:
+                        log['echoes'].append(e)
+                    xp += cost[0]
+                    tuners += cost[1]
+                    rolled[e.cost] += 1
+                    if dbl_crit:
+                        usable[e.cost] += 1
+
+        for mainstat in rerolls:
+            fixed = Echo(mainstat=mainstat, cost=4, set='Correct')
+            dbl_crit = False
+            while not dbl_crit:
+                fixed.substats = []
+                dbl_crit, cost = roll_echo(fixed, threshold, tables=tables)
+                if log is not None:
+                    log['echoes'].append(copy.copy(fixed))
+                xp += cost[0]
+                tuners += cost[1]
+
+        return xp, tuners, rolled, tacet_runs, t.total_echoes_generated
+    return trial
+
+
+def _scalar_drops(scenario: Scenario):
+    return _scalar(scenario)
+
+
+def _keyed_drops(scenario: Scenario):
+    return _keyed(scenario)
+
+
+# Farm all trials from blocks of vectorized tacet drops, then reroll the fixed echoes from a RollStream
+def _batched_drops(scenario: Scenario):
+    targets = scenario.targets
+    rerolls = scenario.rerolls
+
+    def kernel(sim: Simulation, threshold: int, iterations: int, rng) -> None:
+        t = TacetField(iterations=0)
+        trials = t.farm_trials(iterations, targets, threshold, rng, sim.policy)
+        xp = np.asarray(trials['xp'], dtype=float)
+        tuners = np.asarray(trials['tuners'], dtype=float)
+
+        if rerolls:
+            stream = RollStream(threshold, rng, policy=sim.policy)
+            for i in range(iterations):
+                for mainstat in rerolls:
+                    dbl_crit = False
+                    while not dbl_crit:
+                        dbl_crit, echo_xp, echo_tuners = stream.next(mainstat)
+                        xp[i] += echo_xp
+                        tuners[i] += echo_tuners
+
+        sim.record_trials(threshold, xp, tuners, trials['rolled'], trials['tacet_runs'], trials['total'])
+        return
+    return kernel
+
+
+# Farm as _batched_drops, then sample the cost of rerolling each fixed echo in aggregate with retry_costs
+def _skip_drops(scenario: Scenario):
+    targets = scenario.targets
+    rerolls = scenario.rerolls
+
+    def kernel(sim: Simulation, threshold: int, iterations: int, rng) -> None:
+        if rng is None:
+            rng = np.random.default_rng()
+        t = TacetField(iterations=0)
+        trials = t.farm_trials(iterations, targets, threshold, rng, sim.policy)
+        xp = np.asarray(trials['xp'], dtype=float)
+        tuners = np.asarray(trials['tuners'], dtype=float)
+
+        for mainstat in rerolls:
+            outcomes = markov.outcome_probabilities(threshold, sim.policy, mainstat)
+            reroll_xp, reroll_tuners, _ = retry_costs(outcomes, 1, iterations, rng)
+            xp += reroll_xp
+            tuners += reroll_tuners
+
+        sim.record_trials(threshold, xp, tuners, trials['rolled'], trials['tacet_runs'], trials['total'])
+        return
+    return kernel
+
+
+# Run every threshold against the same tacet drops and the same substat draw for each rolled echo
+# Each threshold stops rolling a cost once it has that cost's usable echoes and finishes farming
+# once it has all of them; the trial ends once every threshold has, then the fixed echoes are
+# rerolled from the same stream until each threshold has a usable one
+def _crn_drops(scenario: Scenario):
+    targets = scenario.targets
+    rerolls = scenario.rerolls
+
+    def kernel(sim: Simulation, iterations: int, rng) -> None:
+        thresholds = sim.thresholds
+        stream = CommonRollStream(thresholds, rng, policy=sim.policy)
+        for _ in range(iterations):
+            t = TacetField(iterations=0)
+            acceptable = t.acceptable
+            usable = {threshold: {cost: 0 for cost in targets} for threshold in thresholds}
+            rolled = {threshold: {cost: 0 for cost in targets} for threshold in thresholds}
+            xp = {threshold: 0 for threshold in thresholds}
+            tuners = {threshold: 0 for threshold in thresholds}
+            finished = {}
+            pending = list(thresholds)
+            tacet_runs = 0
+
+            while pending:
+                t.run()
+                tacet_runs += 1
+                for e in t.drops:
+                    if (
+                        pending
+                        and e.cost in targets
+                        and e.set == 'Correct'
+                        and e.mainstat in acceptable[e.cost]
+                        and any(usable[threshold][e.cost] < targets[e.cost] for threshold in pending)
+                    ):
+                        outcomes = stream.next(e.mainstat)
+                        for i, threshold in enumerate(thresholds):
+                            if threshold not in pending or usable[threshold][e.cost] >= targets[e.cost]:
+                                continue
+                            dbl_crit, echo_xp, echo_tuners = outcomes[i]
+                            xp[threshold] += echo_xp
+                            tuners[threshold] += echo_tuners
+                            rolled[threshold][e.cost] += 1
+                            if dbl_crit:
+                                usable[threshold][e.cost] += 1
+                                if all(usable[threshold][cost] >= need for cost, need in targets.items()):
+                                    pending.remove(threshold)
+                                    finished[threshold] = (tacet_runs, dict(t.total_echoes_generated))
+                                    if not rerolls:
+                                        sim.record_trial(threshold, xp[threshold], tuners[threshold],
+                                                         rolled[threshold], *finished[threshold])
+            if not rerolls:
+                continue
+
+            for mainstat in rerolls:
+                pending = list(thresholds)
+                while pending:
+                    outcomes = stream.next(mainstat)
+                    for i, threshold in enumerate(thresholds):
+                        if threshold not in pending:
+                            continue
+                        dbl_crit, echo_xp, echo_tuners = outcomes[i]
+                        xp[threshold] += echo_xp
+                        tuners[threshold] += echo_tuners
+                        if dbl_crit:
+                            pending.remove(threshold)
+            for threshold in thresholds:
+                sim.record_trial(threshold, xp[threshold], tuners[threshold], rolled[threshold], *finished[threshold])
+        return
+    return kernel
@@ -1,88 +1,49 @@
-from echo import Echo
-from tacet import TacetField
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-from collections import defaultdict
+from engine import Scenario
+import engine
 import time
 
-
-class BaseSimulation:
-    def __init__(self, iterations: int, cost_filter: int) -> None:
+# Scenario per farmed cost: 2 usable echoes of that cost from tacet field drops
+SCENARIOS = {cost: Scenario({cost: 2}) for cost in (1, 3)}
+
+
+class BaseSimulation(engine.Simulation):
+    # :iterations: int - Number of trials per threshold, or per threshold per round when precision is set
+    # :cost_filter: int - The echo cost being farmed, 1 or 3
+    # :batched: bool - Generate drops and rolls in blocks with TacetField.farm_trials instead of one Echo at a time
+    # :crn: bool - Common random numbers, score every threshold against the same drops and echo draws
+    # :workers: int - Number of processes to split the iterations between
+    # :seed: int - Seed for reproducible runs, results depend on both the seed and the number of workers
+    # :thresholds: tuple - The thresholds to simulate
+    # :precision: float - Keep sampling each threshold until the 95% CI half-width of its waveplate cost is this small
+    # :relative: bool - Whether precision is a fraction of the mean waveplate cost rather than waveplates
+    # :max_iterations: int - Upper limit on the iterations per threshold when precision is set
+    # :policy: policy.Policy - Tuning policy to roll with instead of the plain crit threshold rule
+    # :checkpoint: str - File to snapshot the results to as the run goes, see checkpoint.run_checkpointed
+    # :checkpoint_every: int - Trials per threshold between snapshots, checkpoint.CHECKPOINT_EVERY if omitted
+    # :resume: bool - Continue from the snapshot in checkpoint, if there is one, instead of starting over
+    # :skip: bool - Sample the echoes retried until usable in aggregate instead of rolling each
+    # :trials: str - Directory of a trialstore to append every trial to
+    # :keyed: bool - Seed each trial from its own keyed stream, so any trial can be replayed on its own
+    # :first_trial: int - Index of the first trial of each threshold in the keyed streams
+    def __init__(self, iterations: int, cost_filter: int, batched: bool = True, crn: bool = False,
+                 workers: int = 1, seed: int = None, thresholds: tuple = (1, 2, 3, 4, 5),
+                 precision: float = None, relative: bool = False, max_iterations: int = None,
+                 policy=None, checkpoint: str = None, checkpoint_every: int = None,
+                 resume: bool = False, skip: bool = False, trials: str = None,
+                 keyed: bool = False, first_trial: int = 0) -> None:
         assert cost_filter in (1, 3), "cost_filter must be 1 or 3"
         self.cost_filter = cost_filter
-        self.iterations = iterations
-        self.results = defaultdict(lambda: {
-            'xp': [],
-            'tuners': [],
-            'total': [],
-            'rolled': [],
-            'echo_waveplates': [],
-            'xp_waveplates': [],
-            'tuners_waveplates': [],
-            'waveplates': [],
-        })
-        self.averages = {}
-        self.run()
-
-    def run(self) -> None:
-        for threshold in range(1, 6):
-            for _ in range(self.iterations):
-                t = TacetField()
-                usable = []
-                xp, tuners, rolled, tacet_runs = 0, 0, 0, 0
-
-                while len(usable) < 2:
-                    t.run()
-                    tacet_runs += 1
-                    for e in t.drops:
-                        if (
-                            e.cost == self.cost_filter
-                            and e.set == 'Correct'
-                            and e.mainstat in t.acceptable[self.cost_filter]
-                            and len(usable) < 2
-                        ):
-                            e.roll_substats(threshold)
-                            cost = e.calculate_costs()
-                            xp += cost[0]
-                            tuners += cost[1]
-                            rolled += 1
-                            if e.dbl_crit:
-                                usable.append(e)
-
-                xp_waveplates = 12.4136 * xp
-                tuners_waveplates = 3 * tuners
-                tacet_waveplates = tacet_runs * 60
-
-                self.results[threshold]['xp'].append(xp)
-                self.results[threshold]['tuners'].append(tuners)
-                self.results[threshold]['total'].append(t.total_echoes_generated)
-                self.results[threshold]['rolled'].append(rolled)
-                self.results[threshold]['echo_waveplates'].append(tacet_waveplates)
-                self.results[threshold]['xp_waveplates'].append(xp_waveplates)
-                self.results[threshold]['tuners_waveplates'].append(tuners_waveplates)
-                self.results[threshold]['waveplates'].append(max(xp_waveplates, tuners_waveplates, tacet_waveplates))
+        self.scenario = SCENARIOS[cost_filter]
+        super().__init__(iterations, batched, crn, workers, seed, thresholds, precision, relative,
+                         max_iterations, policy, checkpoint, checkpoint_every, resume, skip,
+                         trials, keyed, first_trial)
+
+    # Options needed to rebuild an equivalent simulation, e.g. in a worker process
+    def options(self) -> dict:
+        return {'cost_filter': self.cost_filter, **super().options()}
 
     def compute_averages(self) -> None:
-        for threshold in sorted(self.results.keys()):
-            metrics = self.results[threshold]
-            self.averages[threshold] = {}
-
-            for key, values in metrics.items():
-                if not values:
-                    self.averages[threshold][key] = 0
-                else:
-                    if key == 'total':
-                        combined = {1: 0, 3: 0}
-                        for d in values:
-                            combined[1] += d.get(1, 0)
-                            combined[3] += d.get(3, 0)
-                        count = len(values)
-                        self.averages[threshold][key] = {
-                            1: combined[1] / count,
-                            3: combined[3] / count,
-                        }
-                    else:
-                        self.averages[threshold][key] = sum(values) / len(values)
+        super().compute_averages()
 
         for threshold in self.averages:
             avg_echo_waveplates = self.averages[threshold]['echo_waveplates']
@@ -93,6 +54,7 @@ class BaseSimulation:
             self.averages[threshold]['bottleneck'] = round(bottleneck, 2)
 
     def create_plot(self, ax=None) -> None:
+        import matplotlib.pyplot as plt
         thresholds = sorted(self.averages.keys())
 
         xp_wp = [self.averages[t]['xp_waveplates'] for t in thresholds]
@@ -120,7 +82,9 @@ class BaseSimulation:
             text.set_color("black")
 
     def create_table(self, ax=None) -> None:
-        columns = ["Threshold", "Echoes Rolled", "XP Used", "Tuners Used", "Echo Waveplates", "XP Waveplates", "Tuner Waveplates", "Bottleneck %"]
+        import matplotlib.pyplot as plt
+        columns = ["Threshold", "Echoes Rolled", "XP Used", "Tuners Used", "Echo Waveplates", "XP Waveplates", "Tuner Waveplates", "Bottleneck %",
+                   "P50 Waveplates", "P90 Waveplates"]
 
         table_data = []
         for threshold, data in sorted(self.averages.items()):
@@ -133,11 +97,13 @@ class BaseSimulation:
                 f"{data['xp_waveplates']:.2f}",
                 f"{data['tuners_waveplates']:.2f}",
                 f"{data['bottleneck']:.2f}",
+                f"{data['waveplates_percentiles'][50]:.2f}",
+                f"{data['waveplates_percentiles'][90]:.2f}",
             ]
             table_data.append(row)
 
         if ax is None:
-            fig, ax = plt.subplots(figsize=(10, len(table_data) * 0.5 + 1))
+            fig, ax = plt.subplots(figsize=(13, len(table_data) * 0.5 + 1))
             fig.patch.set_facecolor('#303030')
         ax.axis('off')
 
@@ -156,8 +122,14 @@ class BaseSimulation:
                 cell.set_facecolor('#505050')
                 cell.set_text_props(color='white')
 
+    # Histograms are drawn per farmed cost
+    def histogram_title(self, label: str) -> str:
+        return f"{label} Distribution (Cost {self.cost_filter})"
+
 
 def plot_combined(sim1: BaseSimulation, sim3: BaseSimulation) -> None:
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as mticker
     fig, axes = plt.subplots(1, 2, figsize=(14, 6), sharey=True)
     fig.patch.set_facecolor('#303030')
 
@@ -178,6 +150,7 @@ def plot_combined(sim1: BaseSimulation, sim3: BaseSimulation) -> None:
 
 
 def create_combined_table(sim1: BaseSimulation, sim3: BaseSimulation) -> None:
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(2, 1, figsize=(12, 8))
     fig.patch.set_facecolor('#303030')
 
@@ -187,7 +160,20 @@ def create_combined_table(sim1: BaseSimulation, sim3: BaseSimulation) -> None:
     plt.tight_layout()
 
 
+def plot_combined_histogram(sim1: BaseSimulation, sim3: BaseSimulation, metric: str = 'waveplates') -> None:
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+    fig.patch.set_facecolor('#303030')
+
+    sim1.create_histogram(metric, ax=axes[0])
+    sim3.create_histogram(metric, ax=axes[1])
+
+    plt.tight_layout()
+
+
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     start_time = time.perf_counter()
 
     iterations = 50000
@@ -0,0 +1,308 @@
+import contextlib
+import functools
+import random
+import time
+
+from echo import CommonRollStream, Echo, RollStream
+from sampling import AliasSampler
+from stats import RunningStats
+from tacet import TacetField
+import cost_agnostic_sim
+import engine
+import indiv_cost_sim
+import tacet_field_sim
+
+# Opt-in instrumentation of the hot paths. enable() swaps counting and timing wrappers
+# onto the classes and disable() puts the originals back, so nothing is paid while it is off.
+# Counts cover the current process only, runs with workers > 1 count the parent's work.
+
+# Methods timed as each phase, as (owner, attribute name); time is exclusive, a roll
+# inside a drop counts as roll only
+PHASES = {
+    'drop': [(TacetField, 'run'), (TacetField, 'drop_one'), (TacetField, 'drop_block')],
+    'roll': [(Echo, 'roll_substats'), (Echo, 'draw_substats_batch'), (Echo, 'score_batch')],
+    'aggregate': [
+        (TacetField, 'walk_block'), (RunningStats, 'add'), (RunningStats, 'extend'),
+        (engine.Simulation, 'record_trial'), (engine.Simulation, 'record_trials'),
+        (engine.Simulation, 'compute_averages'), (cost_agnostic_sim.Simulation, 'compute_averages'),
+        (indiv_cost_sim.BaseSimulation, 'compute_averages'), (tacet_field_sim.Simulation, 'compute_averages'),
+    ],
+    'render': [
+        (engine.Simulation, 'create_histogram'),
+        (cost_agnostic_sim.Simulation, 'create_plot'), (cost_agnostic_sim.Simulation, 'create_table'),
+        (indiv_cost_sim.BaseSimulation, 'create_plot'), (indiv_cost_sim.BaseSimulation, 'create_table'),
+        (indiv_cost_sim, 'plot_combined'), (indiv_cost_sim, 'create_combined_table'),
+        (indiv_cost_sim, 'plot_combined_histogram'),
+        (tacet_field_sim.Simulation, 'create_plot'),
+    ],
+}
+
+counters = {}
+timings = {}
+_originals = []
+_stack = []
+# One list per call in progress that counts the drops and rolls it uses itself, as batches run past them;
+# blocks drawn meanwhile are kept there, with their run counts, instead of being tallied as they are drawn
+_consumers = []
+_mark = 0.0
+
+
+def reset() -> None:
+    global _mark
+    counters.clear()
+    counters.update({
+        'random_calls': 0,
+        'numpy_calls': 0,
+        'numpy_numbers': 0,
+        'echoes_rolled': 0,
+        'substat_picks': 0,
+        'rejected_duplicates': 0,
+        'max_picks_per_echo': 0,
+        'tacet_runs': 0,
+        'echoes_dropped': 0,
+        'accepted': {},
+        'wrong_set': {},
+        'wrong_mainstat': {},
+    })
+    timings.clear()
+    timings.update({phase: 0.0 for phase in PHASES})
+    _mark = time.perf_counter()
+    return
+
+
+def is_enabled() -> bool:
+    return bool(_originals)
+
+
+# Install the wrappers and start counting from zero
+def enable() -> None:
+    if is_enabled():
+        return
+    reset()
+    _patch(random, 'random', _count_random)
+    _patch(Echo, 'roll_substats', _roll_substats)
+    _patch(Echo, 'draw_substats_batch', _draw_substats_batch)
+    _patch(AliasSampler, 'sample_array', _sample_array)
+    _patch(TacetField, 'run', _tacet_run)
+    _patch(TacetField, 'drop_one', _drop_one)
+    _patch(TacetField, 'drop_block', _drop_block)
+    _patch(TacetField, 'farm_trials', _farm_trials)
+    _patch(RollStream, 'next', _next_echo)
+    _patch(CommonRollStream, 'next', _next_echo)
+    for phase, methods in PHASES.items():
+        for owner, name in methods:
+            _patch(owner, name, _timed(phase))
+    return
+
+
+# Restore the original methods, keeping the counts for report()
+def disable() -> None:
+    while _originals:
+        owner, name, raw = _originals.pop()
+        setattr(owner, name, raw)
+    _stack.clear()
+    _consumers.clear()
+    return
+
+
+@contextlib.contextmanager
+def enabled():
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+
+# The counts and phase timings so far, with per-trial and per-echo rates when a
+# simulation is given
+def report(sim=None) -> dict:
+    result = {key: dict(value) if isinstance(value, dict) else value for key, value in counters.items()}
+    result['phases'] = dict(timings)
+    if counters['echoes_rolled']:
+        result['picks_per_echo'] = counters['substat_picks'] / counters['echoes_rolled']
+    if sim is not None:
+        trials = sum(metrics['waveplates'].count for metrics in sim.results.values())
+        result['trials'] = trials
+        if trials and counters['tacet_runs']:
+            result['tacet_runs_per_trial'] = counters['tacet_runs'] / trials
+    return result
+
+
+# Replace owner.name with make(original), keeping staticmethod and classmethod wrappers
+def _patch(owner, name: str, make) -> None:
+    raw = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+    if isinstance(raw, (staticmethod, classmethod)):
+        patched = type(raw)(make(raw.__func__))
+    else:
+        patched = make(raw)
+    _originals.append((owner, name, raw))
+    setattr(owner, name, patched)
+    return
+
+
+# Exclusive wall time: entering a phase charges the time so far to the enclosing one
+def _timed(phase: str):
+    def make(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            global _mark
+            now = time.perf_counter()
+            if _stack:
+                timings[_stack[-1]] += now - _mark
+            _mark = now
+            _stack.append(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                now = time.perf_counter()
+                timings[_stack.pop()] += now - _mark
+                _mark = now
+        return wrapper
+    return make
+
+
+def _count_random(function):
+    @functools.wraps(function)
+    def wrapper():
+        counters['random_calls'] += 1
+        return function()
+    return wrapper
+
+
+# Every pick draws one uniform, and every accepted pick draws one more for its tier,
+# so the rejected duplicates are the draws left over after two per added substat
+def _roll_substats(function):
+    @functools.wraps(function)
+    def wrapper(self, threshold, policy=None, table=None):
+        calls, rolled = counters['random_calls'], self.num_substats
+        function(self, threshold, policy, table)
+        added = self.num_substats - rolled
+        picks = counters['random_calls'] - calls - added
+        counters['echoes_rolled'] += 1
+        counters['substat_picks'] += picks
+        counters['rejected_duplicates'] += picks - added
+        counters['max_picks_per_echo'] = max(counters['max_picks_per_echo'], picks)
+        return
+    return wrapper
+
+
+# The batch draw takes the first 5 of a permutation, it never rejects a pick
+# Within farm_trials or a roll stream only the random numbers are counted, the echoes once they are used
+def _draw_substats_batch(function):
+    @functools.wraps(function)
+    def wrapper(cls, n, rng=None):
+        substats, tiers = function(cls, n, rng)
+        num_types = cls._batch_tables()[0].shape[0]
+        counters['numpy_calls'] += 2
+        counters['numpy_numbers'] += n * (num_types + 5)
+        if not _consumers:
+            _count_batch_echoes(n)
+        return substats, tiers
+    return wrapper
+
+
+def _count_batch_echoes(n: int) -> None:
+    counters['echoes_rolled'] += n
+    counters['substat_picks'] += 5 * n
+    counters['max_picks_per_echo'] = max(counters['max_picks_per_echo'], 5 if n else 0)
+    return
+
+
+# A roll stream draws echoes in bulk ahead of use, so each one is counted as it is served
+def _next_echo(function):
+    @functools.wraps(function)
+    def wrapper(self, mainstat=None):
+        _consumers.append([])
+        try:
+            return function(self, mainstat)
+        finally:
+            _consumers.pop()
+            _count_batch_echoes(1)
+    return wrapper
+
+
+def _sample_array(function):
+    @functools.wraps(function)
+    def wrapper(self, size, rng):
+        counters['numpy_calls'] += 1
+        counters['numpy_numbers'] += size
+        return function(self, size, rng)
+    return wrapper
+
+
+def _tacet_run(function):
+    @functools.wraps(function)
+    def wrapper(self):
+        counters['tacet_runs'] += 1
+        return function(self)
+    return wrapper
+
+
+def _drop_one(function):
+    @functools.wraps(function)
+    def wrapper(self, samplers=None):
+        e = function(self, samplers)
+        correct_set = e.set == 'Correct'
+        _classify(e.cost, 1, int(not correct_set), int(correct_set and e.mainstat in self.acceptable.get(e.cost, [])))
+        return e
+    return wrapper
+
+
+def _drop_block(function):
+    @functools.wraps(function)
+    def wrapper(self, runs, rng):
+        block = function(self, runs, rng)
+        counters['numpy_calls'] += 1
+        counters['numpy_numbers'] += runs
+        if _consumers:
+            _consumers[-1].append((block, runs))
+        else:
+            _classify_block(self, block)
+        return block
+    return wrapper
+
+
+# Blocks run past the last trial, so the runs, drops and rolls are counted from the trials farmed instead:
+# the trials take the runs of the blocks in order, as many as their tacet runs add up to, and walk_block
+# has summed the echoes each one rolled
+def _farm_trials(function):
+    @functools.wraps(function)
+    def wrapper(self, iterations, targets, threshold, rng, policy=None):
+        _consumers.append([])
+        try:
+            trials = function(self, iterations, targets, threshold, rng, policy)
+        finally:
+            blocks = _consumers.pop()
+        used = int(sum(trials['tacet_runs']))
+        counters['tacet_runs'] += used
+        for block, runs in blocks:
+            if used > 0:
+                _classify_block(self, block[block['run'] < used])
+            used -= runs
+        _count_batch_echoes(int(sum(sum(rolled) for rolled in trials['rolled'].values())))
+        return trials
+    return wrapper
+
+
+# Tally the drops of a block, or of the runs of one that were used, by cost
+def _classify_block(field: TacetField, block) -> None:
+    correct, acceptable = field._accept_lookup()
+    for cost in field.costs:
+        rows = block['cost'] == cost
+        correct_set = block['set'][rows] == correct
+        accepted = correct_set & acceptable[cost][block['mainstat'][rows]]
+        _classify(cost, int(rows.sum()), int((~correct_set).sum()), int(accepted.sum()))
+    return
+
+
+# Tally drops of one cost by the first filter that discards them
+def _classify(cost: int, dropped: int, wrong_set: int, accepted: int) -> None:
+    counters['echoes_dropped'] += dropped
+    counters['accepted'][cost] = counters['accepted'].get(cost, 0) + accepted
+    counters['wrong_set'][cost] = counters['wrong_set'].get(cost, 0) + wrong_set
+    counters['wrong_mainstat'][cost] = counters['wrong_mainstat'].get(cost, 0) + dropped - wrong_set - accepted
+    return
+
+
+reset()
@@ -0,0 +1,264 @@
+from echo import Echo
+import numpy as np
+import math
+import sampling
+import time
+
+# Probability mass below which the tail of the failure count distribution is dropped
+TAIL_TOLERANCE = 1e-12
+
+
+# Exact distribution of how a single echo ends up under the abandon rule in Echo.roll_substats
+# Substats are drawn without replacement, so the chain only needs to track
+# (substats rolled so far, crit stats among them)
+# :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+# :policy: Policy - Tuning policy to roll with instead, see policy_outcome_probabilities
+# :mainstat: str - The echo's mainstat, for policies that depend on it
+# Returns {(num_substats, dbl_crit): probability}, dbl_crit meaning usable under a policy
+def outcome_probabilities(threshold: int, policy=None, mainstat: str = None) -> dict:
+    if policy is not None:
+        return policy_outcome_probabilities(policy, threshold, mainstat)
+    num_types = len(Echo.possible_substats)
+    num_crits = 2
+    states = {0: 1.0}  # crits so far -> probability, at the current number of substats
+
+    def draw(states: dict, rolled: int) -> dict:
+        nxt = {}
+        for crits, prob in states.items():
+            p_crit = (num_crits - crits) / (num_types - rolled)
+            if p_crit > 0:
+                nxt[crits + 1] = nxt.get(crits + 1, 0) + prob * p_crit
+            if p_crit < 1:
+                nxt[crits] = nxt.get(crits, 0) + prob * (1 - p_crit)
+        return nxt
+
+    for rolled in range(threshold):
+        states = draw(states, rolled)
+
+    outcomes = {}
+    if threshold < 5:
+        # No crit by the threshold: the echo is abandoned where it stands
+        outcomes[(threshold, False)] = states.pop(0, 0)
+        for rolled in range(threshold, 5):
+            states = draw(states, rolled)
+
+    outcomes[(5, True)] = states.pop(num_crits, 0)
+    outcomes[(5, False)] = sum(states.values())
+    return outcomes
+
+
+# Exact distribution of how a single echo ends up under a tuning policy
+# The policy's decision table is indexed by the tiers of the tracked substats rolled so far, so the
+# chain tracks that code through each substat drawn; the untracked substats only matter through
+# how many of them are left to draw.
+# Returns {(num_substats, usable): probability}
+def policy_outcome_probabilities(policy, threshold: int, mainstat: str = None) -> dict:
+    decisions, radix = policy.batch_table(threshold, (mainstat,))
+    decisions = decisions[0]
+    tier_lookup = Echo._batch_tables()[0]
+    num_types = tier_lookup.shape[0]
+    codes = np.arange(decisions.shape[1])
+
+    # Per tracked substat: its radix and the probability of each of its tiers
+    tracked = []
+    present = np.zeros(len(codes), dtype=np.int64)
+    for substat_id in np.flatnonzero(radix):
+        tiers = len(Echo.possible_substats[Echo._roll_tables()[0][substat_id]])
+        tier_probs = np.bincount(tier_lookup[substat_id], minlength=tiers) / tier_lookup.shape[1]
+        tracked.append((radix[substat_id], tier_probs, (codes // radix[substat_id]) % (tiers + 1) == 0))
+        present += (codes // radix[substat_id]) % (tiers + 1) > 0
+
+    probs = np.zeros(len(codes))
+    probs[0] = 1.0
+    outcomes = {}
+    for rolled in range(5):
+        remaining = num_types - rolled
+        nxt = probs * (remaining - (len(tracked) - present)) / remaining
+        for step, tier_probs, absent in tracked:
+            for tier, p_tier in enumerate(tier_probs):
+                nxt[codes[absent] + step * (tier + 1)] += probs[absent] * p_tier / remaining
+        if rolled + 1 < 5:
+            # Echoes the policy abandons after this substat
+            stop = ~decisions[rolled + 1]
+            outcomes[(rolled + 1, False)] = float(nxt[stop].sum())
+            nxt[stop] = 0
+        probs = nxt
+
+    outcomes[(5, True)] = float(probs[decisions[5]].sum())
+    outcomes[(5, False)] = float(probs[~decisions[5]].sum())
+    return outcomes
+
+
+# Exact expected results of the cost agnostic simulation for one threshold,
+# i.e. rolling echoes until `usable` of them have double crit
+# :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+# :usable: int - The number of double crit echoes needed
+# Returns a dict with the same metric keys as cost_agnostic_sim.Simulation.averages, plus
+# 'p_dbl_crit', 'outcomes' and the expected 'xp_per_echo' and 'tuners_per_echo'
+def solve(threshold: int, usable: int = 5) -> dict:
+    sampling.refresh()
+    return expectations(outcome_probabilities(threshold), usable)
+
+
+# Expected results of rolling echoes until `usable` of them have double crit, as in solve,
+# from the distribution of how a single echo ends up under any abandon rule
+# :outcomes: dict - {(num_substats, dbl_crit): probability}, summing to 1 with (5, True) among them
+def expectations(outcomes: dict, usable: int = 5) -> dict:
+    p_dbl = outcomes[(5, True)]
+    costs = {outcome: Echo.outcome_costs(*outcome) for outcome in outcomes}
+
+    xp_per_echo = sum(prob * costs[outcome][0] for outcome, prob in outcomes.items())
+    tuners_per_echo = sum(prob * costs[outcome][1] for outcome, prob in outcomes.items())
+
+    # The number of echoes rolled is negative binomial, so by Wald's identity the
+    # expected totals are the expected per-echo costs times the expected echoes rolled
+    rolled = usable / p_dbl
+    xp = xp_per_echo * rolled
+    tuners = tuners_per_echo * rolled
+
+    return {
+        'p_dbl_crit': p_dbl,
+        'outcomes': outcomes,
+        'xp_per_echo': xp_per_echo,
+        'tuners_per_echo': tuners_per_echo,
+        'xp': xp,
+        'tuners': tuners,
+        'rolled': rolled,
+        'xp_waveplates': 12.4136 * xp,
+        'tuners_waveplates': 3 * tuners,
+        'waveplates': expected_waveplates(outcomes, costs, usable),
+    }
+
+
+# Exact E[max(xp waveplates, tuner waveplates)] over one trial
+# The failed echoes of a trial are split between the failure outcomes, so the trial total is
+# determined by the failure count F ~ NegBin(usable, p_dbl) and, with at most two failure
+# outcomes, the count A ~ Binom(F, q) of failures that ended the first way
+def expected_waveplates(outcomes: dict, costs: dict, usable: int) -> float:
+    failures = [(prob, costs[outcome]) for outcome, prob in outcomes.items() if not outcome[1] and prob > 0]
+    p_dbl = outcomes[(5, True)]
+    dbl_xp, dbl_tuners = costs[(5, True)]
+    if not failures:
+        return max(12.4136 * usable * dbl_xp, 3 * usable * dbl_tuners)
+    max_failures = _max_failures(usable, p_dbl)
+    if len(failures) > 2:
+        return _expected_waveplates_grid(failures, (dbl_xp, dbl_tuners), usable, p_dbl, max_failures)
+    if len(failures) == 1:
+        failures.append((0, failures[0][1]))
+    (p_a, (a_xp, a_tuners)), (p_b, (b_xp, b_tuners)) = failures
+    q = p_a / (p_a + p_b)
+
+    f = np.arange(max_failures + 1)
+    log_fact = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, max_failures + usable + 1)))))
+    log_p_f = (log_fact[f + usable - 1] - log_fact[f] - log_fact[usable - 1]
+               + usable * math.log(p_dbl) + f * math.log1p(-p_dbl))
+
+    # Given F, only the counts A within a dozen standard deviations of F * q carry weight
+    band = int(24 * math.sqrt(max_failures * q * (1 - q))) + 25
+    lowest = np.maximum(np.floor(f * q - 12 * np.sqrt(f * q * (1 - q))).astype(int) - 12, 0)
+    F = f[:, None]
+    A = lowest[:, None] + np.arange(min(band, max_failures + 1))
+    valid = A <= F
+    A = np.where(valid, A, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_binom = log_fact[F] - log_fact[A] - log_fact[np.where(valid, F - A, 0)]
+        log_p_a = (np.where(A > 0, A * np.log(q), 0) if q > 0 else np.where(A > 0, -np.inf, 0))
+        log_p_b = (np.where(F > A, (F - A) * np.log1p(-q), 0) if q < 1 else np.where(F > A, -np.inf, 0))
+        weight = np.exp(np.where(valid, log_p_f[:, None] + log_binom + log_p_a + log_p_b, -np.inf))
+
+    xp = A * a_xp + (F - A) * b_xp + usable * dbl_xp
+    tuners = A * a_tuners + (F - A) * b_tuners + usable * dbl_tuners
+    return float((weight * np.maximum(12.4136 * xp, 3 * tuners)).sum())
+
+
+# E[max(xp waveplates, tuner waveplates)] with any number of failure outcomes, as
+# E[tuner waveplates] + E[max(D, 0)] where D is the trial's xp minus tuner waveplates.
+# D is a sum over the trial's echoes, so its distribution after each failure follows from
+# the previous one by a shift per failure outcome. It is tracked on a grid around its mean,
+# each shift split between the two nearest grid points to keep the mean exact; with a step
+# of a small fraction of the spread of one failure's D, the splitting barely widens it.
+def _expected_waveplates_grid(failures: list, dbl_costs: tuple, usable: int, p_dbl: float,
+                              max_failures: int, steps_per_sd: int = 8) -> float:
+    total = sum(prob for prob, _ in failures)
+    q = np.array([prob / total for prob, _ in failures])
+    tuners = np.array([3 * cost[1] for _, cost in failures])
+    z = np.array([12.4136 * cost[0] - 3 * cost[1] for _, cost in failures])
+    mean_z = float(q @ z)
+    sd_z = math.sqrt(float(q @ (z - mean_z) ** 2))
+    start = usable * (12.4136 * dbl_costs[0] - 3 * dbl_costs[1])
+    expected_failures = usable * (1 - p_dbl) / p_dbl
+    tuner_waveplates = usable * 3 * dbl_costs[1] + expected_failures * float(q @ tuners)
+    if sd_z == 0:
+        # Every failure shifts D the same way
+        f = np.arange(max_failures + 1)
+        return tuner_waveplates + float(_neg_binom_pmf(f, usable, p_dbl) @ np.maximum(start + f * mean_z, 0))
+
+    step = sd_z / steps_per_sd
+    half = int(12 * math.sqrt(max_failures) * steps_per_sd + np.abs(z - mean_z).max() / step) + 2
+    grid = (np.arange(2 * half + 1) - half) * step
+    dist = np.zeros(2 * half + 1)
+    dist[half] = 1.0
+    offsets = (z - mean_z) / step
+    lows = np.floor(offsets).astype(int)
+    fracs = offsets - lows
+
+    pmf = _neg_binom_pmf(np.arange(max_failures + 1), usable, p_dbl)
+    excess = 0.0
+    for f in range(max_failures + 1):
+        excess += pmf[f] * float(dist @ np.maximum(grid + start + f * mean_z, 0))
+        shifted = np.zeros_like(dist)
+        for prob, low, frac in zip(q, lows, fracs):
+            for shift, weight in ((low, prob * (1 - frac)), (low + 1, prob * frac)):
+                if shift >= 0:
+                    shifted[shift:] += weight * dist[:len(dist) - shift]
+                else:
+                    shifted[:shift] += weight * dist[-shift:]
+        dist = shifted
+    return tuner_waveplates + excess
+
+
+# Smallest failure count whose upper tail is negligible
+def _max_failures(usable: int, p: float) -> int:
+    mean = usable * (1 - p) / p
+    sd = math.sqrt(usable * (1 - p)) / p
+    max_failures = int(mean + 12 * sd) + usable
+    while _neg_binom_tail(max_failures, usable, p) > TAIL_TOLERANCE:
+        max_failures *= 2
+    return max_failures
+
+
+# P(F = f) for F ~ NegBin(usable, p), the number of failures before the usable-th success
+def _neg_binom_pmf(f: np.ndarray, usable: int, p: float) -> np.ndarray:
+    log_pmf = (np.array([math.lgamma(k + usable) - math.lgamma(k + 1) for k in f]) - math.lgamma(usable)
+               + usable * math.log(p) + f * math.log1p(-p))
+    return np.exp(log_pmf)
+
+
+# P(F > f) for F ~ NegBin(usable, p), the number of failures before the usable-th success
+def _neg_binom_tail(f: int, usable: int, p: float) -> float:
+    # F <= f exactly when there are at least usable successes in the first f + usable trials
+    n = f + usable
+    log_terms = [
+        math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1) + k * math.log(p) + (n - k) * math.log1p(-p)
+        for k in range(usable)
+    ]
+    return sum(math.exp(t) for t in log_terms)
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    print("Exact expected costs to roll 5 double crit echoes:")
+    for threshold in range(1, 6):
+        data = solve(threshold)
+        print(
+            f"Threshold {threshold}: "
+            f"P(double crit) {data['p_dbl_crit']:.4f}, "
+            f"{data['xp']:.2f} tubes, "
+            f"{data['tuners']:.2f} tuners, "
+            f"{data['rolled']:.2f} echoes rolled, "
+            f"{data['waveplates'] / 240:.2f} days of waveplates"
+        )
+
+    end_time = time.perf_counter()
+    print(f"Finished in {end_time - start_time:.6f}s")
@@ -0,0 +1,272 @@
+from echo import Echo
+from policy import Policy
+import markov
+import sampling
+import time
+
+# Stop refining the cost per usable echo once it moves less than this
+TOLERANCE = 1e-12
+
+# Xp weights tried before refining around the best one, see optimal_policy
+WEIGHT_GRID = 20
+
+
+# A policy given as an explicit decision per state, as found by optimal_policy
+# :decisions: dict - {(rolled, tiers): keep rolling}, tiers holds 0 for each absent tracked
+#                    substat and its tier index + 1 otherwise; missing states keep rolling
+# :target: Policy - Decides which finished echoes are usable and which substats are tracked
+class OptimalPolicy(Policy):
+    def __init__(self, decisions: dict, target: Policy = None) -> None:
+        self.target = target or Policy()
+        self.tracked = self.target.tracked
+        self.decisions = dict(decisions)
+
+        return
+
+    def keep_rolling(self, rolled: int, stats: dict, threshold: int, mainstat: str = None) -> bool:
+        return self.decisions.get((rolled, _tiers(self.tracked, stats)), True)
+
+    def usable(self, stats: dict, mainstat: str = None) -> bool:
+        return self.target.usable(stats, mainstat)
+
+    # The states in which the echo is abandoned, as readable (rolled, stats) pairs
+    def abandon_states(self) -> list:
+        states = []
+        for (rolled, tiers), keep in sorted(self.decisions.items()):
+            if not keep:
+                stats = {
+                    name: Echo.possible_substats[name][tier - 1]
+                    for name, tier in zip(self.tracked, tiers) if tier
+                }
+                states.append((rolled, stats))
+        return states
+
+
+# Tuning one echo as a finite decision process: the state is the number of substats rolled
+# and the tiers of the tracked ones, the action after 1 to 4 substats is to continue or
+# abandon, and a finished echo costs its Echo.outcome_costs. Minimizing the expected
+# cost per usable echo is a ratio objective, solved by Dinkelbach's method: for a price
+# lam per usable echo, a backward pass over the memoized states finds the policy that
+# minimizes E[cost] - lam * P(usable), and lam is moved to that policy's cost per usable
+# echo until it stops changing.
+# :xp_weight: float - Waveplates charged per tube, 12.4136 * weight, tuners get the rest
+# :target: Policy - Decides which finished echoes are usable, the double crit rule if omitted
+# Returns (OptimalPolicy, its expected cost per usable echo under the weighting)
+def solve_weighted(xp_weight: float, target: Policy = None, model=None) -> tuple:
+    target = target or Policy()
+    assert not target.by_mainstat, "mainstat dependent targets are not supported"
+    model = model or _Model(target)
+    prices = (12.4136 * xp_weight, 3 * (1 - xp_weight))
+
+    lam = None
+    decisions = {}  # Every state keeps rolling: the first price is that of always rolling to 5
+    while True:
+        outcome = model.evaluate(decisions)
+        cost = prices[0] * outcome['xp'] + prices[1] * outcome['tuners']
+        new_lam = cost / outcome['p_usable']
+        if lam is not None and abs(new_lam - lam) <= TOLERANCE * max(1.0, abs(lam)):
+            return OptimalPolicy(decisions, target), new_lam
+        lam = new_lam
+        decisions = model.reachable(model.best_decisions(prices, lam))
+
+
+# Find the tuning policy minimizing the expected waveplates per usable echo, the larger of
+# the xp and tuner waveplates as in the simulators. The two resources are combined with a
+# weight: each weight gives an exact optimum from solve_weighted, and the weights are
+# scanned and then refined around the best policy found.
+# :target: Policy - Decides which finished echoes are usable, the double crit rule if omitted
+# :usable: int - Usable echoes needed, the totals are for that many, as in markov.solve
+# Returns a dict with the 'policy', its 'xp_weight', 'p_usable', 'rolled' and the expected
+# 'xp', 'tuners', 'xp_waveplates', 'tuners_waveplates' and 'waveplates' for `usable` echoes
+def optimal_policy(target: Policy = None, usable: int = 5) -> dict:
+    target = target or Policy()
+    model = _Model(target)
+    best = None
+    tried = {}
+
+    def consider(weight: float) -> float:
+        policy, _ = solve_weighted(weight, target, model)
+        key = tuple(sorted(policy.decisions.items()))
+        if key not in tried:
+            tried[key] = _summarize(policy, weight, model.evaluate(policy.decisions), usable)
+        nonlocal best
+        if best is None or tried[key]['waveplates'] < best['waveplates']:
+            best = tried[key]
+        return tried[key]['waveplates']
+
+    weights = [i / WEIGHT_GRID for i in range(WEIGHT_GRID + 1)]
+    scores = [consider(weight) for weight in weights]
+    # Golden section search between the neighbours of the best grid weight
+    i = scores.index(min(scores))
+    lo, hi = weights[max(i - 1, 0)], weights[min(i + 1, WEIGHT_GRID)]
+    ratio = (5 ** 0.5 - 1) / 2
+    for _ in range(30):
+        a, b = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+        if consider(a) <= consider(b):
+            hi = b
+        else:
+            lo = a
+    return best
+
+
+def _summarize(policy: OptimalPolicy, weight: float, outcome: dict, usable: int) -> dict:
+    rolled = usable / outcome['p_usable']
+    xp = outcome['xp'] * rolled
+    tuners = outcome['tuners'] * rolled
+    return {
+        'policy': policy,
+        'xp_weight': weight,
+        'p_usable': outcome['p_usable'],
+        'rolled': rolled,
+        'substats_per_echo': outcome['substats'],
+        'xp': xp,
+        'tuners': tuners,
+        'xp_waveplates': 12.4136 * xp,
+        'tuners_waveplates': 3 * tuners,
+        # Long-run cost: the larger of the expected totals, not the expected larger total
+        'waveplates': max(12.4136 * xp, 3 * tuners),
+    }
+
+
+def _tiers(tracked: tuple, stats: dict) -> tuple:
+    return tuple(
+        Echo.possible_substats[name].index(stats[name]) + 1 if name in stats else 0
+        for name in tracked
+    )
+
+
+# Transitions between echo states and the exact expectations of a policy over them
+class _Model:
+    def __init__(self, target: Policy) -> None:
+        sampling.refresh()
+        self.target = target
+        self.tracked = target.tracked
+        names, tier_lookup, _ = Echo._roll_tables()
+        self.num_types = len(names)
+        # Probability of each tier of a tracked substat, from the same 0-99 lookup as the rolls
+        self.tier_probs = []
+        for name in self.tracked:
+            lookup = tier_lookup[names.index(name)]
+            counts = [lookup.count(tier) for tier in range(len(Echo.possible_substats[name]))]
+            self.tier_probs.append([count / 100 for count in counts])
+        self.transitions = {}
+        self.usable_states = {}
+
+        return
+
+    # [(probability, next state)] after rolling one more substat
+    def next_states(self, state: tuple) -> list:
+        if state not in self.transitions:
+            rolled, tiers = state
+            remaining = self.num_types - rolled
+            untracked_left = (self.num_types - len(self.tracked)) - (rolled - sum(1 for tier in tiers if tier))
+            moves = []
+            if untracked_left:
+                moves.append((untracked_left / remaining, (rolled + 1, tiers)))
+            for j, tier in enumerate(tiers):
+                if tier:
+                    continue
+                for t, p in enumerate(self.tier_probs[j]):
+                    if p:
+                        moves.append((p / remaining, (rolled + 1, tiers[:j] + (t + 1,) + tiers[j + 1:])))
+            self.transitions[state] = moves
+        return self.transitions[state]
+
+    def is_usable(self, tiers: tuple) -> bool:
+        if tiers not in self.usable_states:
+            stats = {
+                name: Echo.possible_substats[name][tier - 1]
+                for name, tier in zip(self.tracked, tiers) if tier
+            }
+            self.usable_states[tiers] = bool(self.target.usable(stats))
+        return self.usable_states[tiers]
+
+    # Backward pass over the memoized states for the policy minimizing E[cost] - lam * P(usable)
+    def best_decisions(self, prices: tuple, lam: float) -> dict:
+        values = {}
+        decisions = {}
+
+        def value(state: tuple) -> float:
+            if state in values:
+                return values[state]
+            rolled, tiers = state
+            if rolled == 5:
+                dbl = self.is_usable(tiers)
+                xp, tuners = Echo.outcome_costs(5, dbl)
+                values[state] = prices[0] * xp + prices[1] * tuners - (lam if dbl else 0)
+                return values[state]
+
+            cont = sum(p * value(nxt) for p, nxt in self.next_states(state))
+            if rolled == 0:
+                values[state] = cont
+                return cont
+            xp, tuners = Echo.outcome_costs(rolled, False)
+            abandon = prices[0] * xp + prices[1] * tuners
+            decisions[state] = cont <= abandon
+            values[state] = min(cont, abandon)
+            return values[state]
+
+        value((0, (0,) * len(self.tracked)))
+        return decisions
+
+    # The decisions for the states a policy can actually reach
+    def reachable(self, decisions: dict) -> dict:
+        kept = {}
+        frontier = [(0, (0,) * len(self.tracked))]
+        seen = set(frontier)
+        while frontier:
+            state = frontier.pop()
+            if state in decisions:
+                kept[state] = decisions[state]
+                if not decisions[state]:
+                    continue
+            if state[0] == 5:
+                continue
+            for _, nxt in self.next_states(state):
+                if nxt not in seen:
+                    seen.add(nxt)
+                    frontier.append(nxt)
+        return kept
+
+    # Exact expected xp, tuners, substats rolled and P(usable) of one echo under a policy
+    def evaluate(self, decisions: dict) -> dict:
+        memo = {}
+
+        def expect(state: tuple) -> tuple:
+            if state in memo:
+                return memo[state]
+            rolled, tiers = state
+            if rolled == 5 or (rolled > 0 and not decisions.get(state, True)):
+                dbl = rolled == 5 and self.is_usable(tiers)
+                xp, tuners = Echo.outcome_costs(rolled, dbl)
+                memo[state] = (xp, tuners, rolled, float(dbl))
+                return memo[state]
+            total = [0.0, 0.0, 0.0, 0.0]
+            for p, nxt in self.next_states(state):
+                for i, v in enumerate(expect(nxt)):
+                    total[i] += p * v
+            memo[state] = tuple(total)
+            return memo[state]
+
+        xp, tuners, substats, p_usable = expect((0, (0,) * len(self.tracked)))
+        return {'xp': xp, 'tuners': tuners, 'substats': substats, 'p_usable': p_usable}
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    print("Fixed thresholds, exact expected waveplates for 5 double crit echoes:")
+    for threshold in range(1, 6):
+        data = markov.solve(threshold)
+        print(f"Threshold {threshold}: {max(data['xp_waveplates'], data['tuners_waveplates']):.2f} waveplates")
+
+    data = optimal_policy()
+    print(f"\nOptimal policy (xp weight {data['xp_weight']:.3f}): "
+          f"{data['waveplates']:.2f} waveplates, {data['xp']:.2f} tubes, {data['tuners']:.2f} tuners, "
+          f"{data['rolled']:.2f} echoes rolled")
+    print("Abandon after:")
+    for rolled, stats in data['policy'].abandon_states():
+        print(f"  {rolled} substats with {stats or 'no crit stat'}")
+
+    end_time = time.perf_counter()
+    print(f"Finished in {end_time - start_time:.6f}s")
@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import random
+from stats import merge_metrics
+
+
+# Wrap an int seed in a SeedSequence, passing SeedSequences through unchanged
+def seed_sequence(seed=None) -> np.random.SeedSequence:
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+# Seed the random module and build a numpy generator from independent children of seed
+# With no seed, the random module is left alone and the generator is seeded from the OS
+# :seed: int | np.random.SeedSequence - Root seed for this stream
+def seed_streams(seed=None) -> np.random.Generator:
+    if seed is None:
+        return np.random.default_rng()
+    py_seed, np_seed = seed_sequence(seed).spawn(2)
+    random.seed(int(py_seed.generate_state(1, np.uint64)[0]))
+    return np.random.default_rng(np_seed)
+
+
+# Split iterations into one contiguous chunk per worker, as evenly as possible
+def split_iterations(iterations: int, workers: int) -> list:
+    return [iterations // workers + (i < iterations % workers) for i in range(workers)]
+
+
+# Seed and first trial of one round of a simulation run in rounds, as keyword arguments for the round
+# Keyed rounds keep sim's seed and carry on from the trials done, so they draw the same trials as an
+# unsplit run; other rounds each get their own child of the root seed, numbered by round
+# :sim: Simulation - The simulation being filled
+# :root: np.random.SeedSequence - Root seed of the run
+# :rounds: int - Number of rounds run before this one
+# :done: int - Trials done so far for each threshold of the round
+def round_seed(sim, root: np.random.SeedSequence, rounds: int, done: int) -> dict:
+    if sim.keyed:
+        return {'seed': sim.seed, 'first_trial': sim.first_trial + done}
+    return {'seed': np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + (rounds,))}
+
+
+# Run a simulation class over a process pool, one chunk of iterations per worker
+# Each chunk gets its own child of SeedSequence(seed), so the partial results only
+# depend on the seed and the worker count, not on how the pool schedules them.
+# Keyed chunks instead share the seed and take consecutive trial indices from first_trial,
+# so they draw the same trials with any number of workers
+# :cls: type - Simulation class, constructed as cls(iterations, seed=..., **kwargs)
+# :iterations: int - Total number of iterations to split between the workers
+# :workers: int - Number of worker processes
+# :seed: int | np.random.SeedSequence - Root seed, drawn from the OS if omitted
+# Returns the results of each chunk, in chunk order
+def run_chunks(cls: type, iterations: int, workers: int, seed: int = None, **kwargs) -> list:
+    chunks = split_iterations(iterations, workers)
+    if kwargs.get('keyed'):
+        first = kwargs.pop('first_trial', 0)
+        seeds = [seed] * workers
+        options = [{**kwargs, 'first_trial': first + sum(chunks[:i])} for i in range(workers)]
+    else:
+        seeds = seed_sequence(seed).spawn(workers)
+        options = [kwargs] * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_run_chunk, cls, chunk, child, chunk_kwargs)
+            for chunk, child, chunk_kwargs in zip(chunks, seeds, options) if chunk > 0
+        ]
+        return [future.result() for future in futures]
+
+
+def _run_chunk(cls: type, iterations: int, seed: np.random.SeedSequence, kwargs: dict) -> dict:
+    sim = cls(iterations, seed=seed, **kwargs)
+    return dict(sim.results)
+
+
+# Merge the partial results of one chunk into results, keyed by threshold and metric
+def merge_results(results: dict, partial: dict) -> None:
+    for threshold, metrics in partial.items():
+        merge_metrics(results[threshold], metrics)
+    return
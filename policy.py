@@ -0,0 +1,159 @@
+import itertools
+import numpy as np
+import sampling
+from echo import Echo
+
+# Largest decision table a policy may compile to, per mainstat and threshold
+MAX_TABLE_SIZE = 1 << 20
+
+
+# A tuning policy: when to abandon an echo while rolling and which finished echoes are usable.
+# Rules only see the values of the `tracked` substats, which lets the engine compile them into
+# a flat decision table over (substats rolled, tracked tiers) that the roll loops index directly,
+# so a policy costs a table lookup per substat instead of a Python call.
+# The base policy is the crit threshold rule of Echo.roll_substats.
+class Policy:
+    # Substats whose values the rules look at
+    tracked = ('Crit Rate', 'Crit Damage')
+    # Whether the rules depend on the echo's mainstat, compiling one table per mainstat
+    by_mainstat = False
+
+    # Whether to roll another substat after `rolled` substats, 1 to 4
+    # :stats: dict - Value of each tracked substat present so far
+    # :threshold: int - The threshold being simulated
+    # :mainstat: str - The echo's mainstat, None when it has none
+    def keep_rolling(self, rolled: int, stats: dict, threshold: int, mainstat: str = None) -> bool:
+        return rolled < threshold or 'Crit Rate' in stats or 'Crit Damage' in stats
+
+    # Whether an echo rolled to 5 substats is usable, costing its full XP instead of a refund
+    def usable(self, stats: dict, mainstat: str = None) -> bool:
+        return 'Crit Rate' in stats and 'Crit Damage' in stats
+
+    # The scalar tables of every mainstat at a threshold, for the roll loops to resolve once and index per echo
+    def scalar_tables(self, threshold: int) -> 'ScalarTables':
+        return ScalarTables(self, threshold)
+
+    # Tables are rebuilt whenever Echo.possible_substats or the policy's repr changes
+    # Flat decision list for the scalar roll loop, index rolled * size + code
+    # Returns (decisions, radix per substat id, size); code is the sum of radix[id] * (tier + 1)
+    def scalar_table(self, threshold: int, mainstat: str = None) -> tuple:
+        mainstat = mainstat if self.by_mainstat else None
+        return sampling.compiled(
+            self, f"scalar-{threshold}-{mainstat}", self._build_scalar_table,
+            threshold, mainstat, Echo.possible_substats, repr(self),
+        )
+
+    # Decision array for Echo.score_batch, index [mainstat id, rolled, code]
+    # :mainstats: tuple - Mainstat names the ids refer to
+    # Returns (decisions, radix per substat id)
+    def batch_table(self, threshold: int, mainstats: tuple = (None,)) -> tuple:
+        mainstats = tuple(mainstats) if self.by_mainstat else (None,)
+        return sampling.compiled(
+            self, f"batch-{threshold}-{mainstats}", self._build_batch_table,
+            threshold, mainstats, Echo.possible_substats, repr(self),
+        )
+
+    def _build_scalar_table(self, threshold: int, mainstat: str, possible_substats: dict, _) -> tuple:
+        decisions, radix = self._build_batch_table(threshold, (mainstat,), possible_substats, _)
+        return decisions[0].ravel().tolist(), radix.tolist(), decisions.shape[2]
+
+    def _build_batch_table(self, threshold: int, mainstats: tuple, possible_substats: dict, _) -> tuple:
+        names = list(possible_substats.keys())
+        assert all(name in names for name in self.tracked), "tracked substats must be in Echo.possible_substats"
+
+        # Each tracked substat is one mixed-radix digit: 0 when absent, tier + 1 when present
+        digits = [len(possible_substats[name]) + 1 for name in self.tracked]
+        radix = np.zeros(len(names), dtype=np.int64)
+        size = 1
+        for name, digit in zip(self.tracked, digits):
+            radix[names.index(name)] = size
+            size *= digit
+        assert size <= MAX_TABLE_SIZE, "too many tracked substats to compile a decision table"
+
+        decisions = np.zeros((len(mainstats), 6, size), dtype=bool)
+        for code, tiers in enumerate(itertools.product(*(range(digit) for digit in reversed(digits)))):
+            stats = {
+                name: possible_substats[name][tier - 1]
+                for name, tier in zip(self.tracked, reversed(tiers)) if tier
+            }
+            for m, mainstat in enumerate(mainstats):
+                for rolled in range(max(len(stats), 1), 5):
+                    decisions[m, rolled, code] = self.keep_rolling(rolled, stats, threshold, mainstat)
+                decisions[m, 5, code] = self.usable(stats, mainstat)
+        return decisions, radix
+
+    def __repr__(self) -> str:
+        params = ", ".join(f"{key}={value!r}" for key, value in sorted(vars(self).items()))
+        return f"{type(self).__name__}({params})"
+
+
+# A policy's scalar_table for one threshold by mainstat, each compiled table looked up on first use only
+# :policy: Policy - The policy
+# :threshold: int - The threshold being simulated
+class ScalarTables(dict):
+    def __init__(self, policy: Policy, threshold: int) -> None:
+        super().__init__()
+        self.policy = policy
+        self.threshold = threshold
+
+        return
+
+    def __missing__(self, mainstat: str) -> tuple:
+        table = self[mainstat] = self.policy.scalar_table(self.threshold, mainstat)
+        return table
+
+
+# Also abandon an echo as soon as a crit stat rolls below its minimum value
+# :minimums: dict - Lowest acceptable value per crit stat, e.g. {'Crit Rate': 8.1}
+class MinCritRoll(Policy):
+    def __init__(self, minimums: dict) -> None:
+        self.minimums = dict(minimums)
+
+        return
+
+    def keep_rolling(self, rolled: int, stats: dict, threshold: int, mainstat: str = None) -> bool:
+        if any(stats[name] < minimum for name, minimum in self.minimums.items() if name in stats):
+            return False
+        return super().keep_rolling(rolled, stats, threshold, mainstat)
+
+    def usable(self, stats: dict, mainstat: str = None) -> bool:
+        if any(stats[name] < minimum for name, minimum in self.minimums.items() if name in stats):
+            return False
+        return super().usable(stats, mainstat)
+
+
+# Only count double crit echoes as usable when they also have some other substats
+# :required: tuple - Substats needed besides both crit stats, e.g. ('ATK%',)
+class WithSubstats(Policy):
+    def __init__(self, required: tuple) -> None:
+        self.required = tuple(required)
+        self.tracked = Policy.tracked + self.required
+
+        return
+
+    def usable(self, stats: dict, mainstat: str = None) -> bool:
+        return super().usable(stats, mainstat) and all(name in stats for name in self.required)
+
+
+# Use a different policy depending on the echo's mainstat
+# :rules: dict - Policy per mainstat name
+# :default: Policy - Policy for any other mainstat, including echoes without one
+class PerMainstat(Policy):
+    by_mainstat = True
+
+    def __init__(self, rules: dict, default: Policy = None) -> None:
+        self.rules = dict(rules)
+        self.default = default or Policy()
+        self.tracked = tuple(dict.fromkeys(
+            name for rule in (*self.rules.values(), self.default) for name in rule.tracked
+        ))
+
+        return
+
+    def keep_rolling(self, rolled: int, stats: dict, threshold: int, mainstat: str = None) -> bool:
+        rule = self.rules.get(mainstat, self.default)
+        return rule.keep_rolling(rolled, {k: v for k, v in stats.items() if k in rule.tracked}, threshold, mainstat)
+
+    def usable(self, stats: dict, mainstat: str = None) -> bool:
+        rule = self.rules.get(mainstat, self.default)
+        return rule.usable({k: v for k, v in stats.items() if k in rule.tracked}, mainstat)
@@ -0,0 +1,346 @@
+from echo import Echo, RollStream
+from tacet import TacetField, RUNS_PER_BLOCK
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from stats import RunningStats
+import adaptive
+import numpy as np
+import parallel
+import sampling
+import time
+
+
+# One character's echo requirements
+# :name: str - Label for the per-character results, unique within a roster
+# :set: str - The echo set the character wears, a key of the field's sets
+# :needs: dict - Usable double crit echoes needed per farmed cost, {1: 2, 3: 2} for a 4-3-3-1-1 layout
+# :acceptable: dict - Acceptable mainstats per farmed cost, like TacetField.acceptable
+# :four_cost: str - Mainstat of the 4 cost echo rerolled outside the field, None if the character needs none
+class Character:
+    def __init__(self, name: str, set: str = 'Correct', needs: dict = None, acceptable: dict = None,
+                 four_cost: str = "Crit Rate") -> None:
+        self.name = name
+        self.set = set
+        self.needs = dict(needs if needs is not None else {1: 2, 3: 2})
+        self.acceptable = {cost: list(names) for cost, names in (acceptable or TacetField.acceptable).items()}
+        self.four_cost = four_cost
+        assert all(cost in self.acceptable for cost in self.needs), "every needed cost needs acceptable mainstats"
+
+        return
+
+    def __repr__(self) -> str:
+        return (f"Character({self.name!r}, set={self.set!r}, needs={self.needs!r}, "
+                f"acceptable={self.acceptable!r}, four_cost={self.four_cost!r})")
+
+
+# Plan a whole roster against one shared tacet field: every drop is routed to a character that
+# still needs an echo of its cost, set and mainstat, so one character's off-set drop can be
+# another's keeper, and a trial ends once every character has all of its echoes.
+# A drop several characters could use goes to the one whose need is the rarest to drop,
+# roster order breaking ties. The routing only changes when some character's need for a cost
+# is met, so the drops are rolled in blocks and each trial is walked from one such event to
+# the next with cumulative sums, as in TacetField.walk_block.
+# :iterations: int - Number of trials per threshold, or per threshold per round when precision is set
+# :roster: list - The Characters to plan for
+# :sets: dict - Set probabilities of the field, TacetField.sets if omitted
+# :workers: int - Number of processes to split the iterations between
+# :seed: int - Seed for reproducible runs, results depend on both the seed and the number of workers
+# :thresholds: tuple - The thresholds to simulate
+# :precision: float - Keep sampling each threshold until the 95% CI half-width of its waveplate cost is this small
+# :relative: bool - Whether precision is a fraction of the mean waveplate cost rather than waveplates
+# :max_iterations: int - Upper limit on the iterations per threshold when precision is set
+# :policy: policy.Policy - Tuning policy to roll with instead of the plain crit threshold rule
+class Planner:
+    def __init__(self, iterations: int, roster: list, sets: dict = None, workers: int = 1, seed: int = None,
+                 thresholds: tuple = (1, 2, 3, 4, 5), precision: float = None, relative: bool = False,
+                 max_iterations: int = None, policy=None) -> None:
+        self.roster = list(roster)
+        self.sets = dict(sets or TacetField.sets)
+        self.workers = workers
+        self.seed = seed
+        self.thresholds = tuple(thresholds)
+        self.precision = precision
+        self.relative = relative
+        self.max_iterations = max_iterations
+        self.policy = policy
+        names = [character.name for character in self.roster]
+        assert len(set(names)) == len(names), "character names must be unique"
+        assert all(character.set in self.sets for character in self.roster), "every character's set must drop"
+        assert any(character.needs for character in self.roster), "the roster must farm at least one echo"
+
+        sampling.refresh()
+        self.field = TacetField(iterations=0)
+        self.field.sets = self.sets
+        self.slots, self.routes = self._build_routes()
+        self.results = defaultdict(lambda: {
+            'xp': RunningStats(),
+            'tuners': RunningStats(),
+            'total': {cost: RunningStats() for cost in TacetField.costs},
+            'rolled': {name: RunningStats() for name in names},
+            'done_runs': {name: RunningStats() for name in names},
+            'echo_waveplates': RunningStats(),
+            'xp_waveplates': RunningStats(),
+            'tuners_waveplates': RunningStats(),
+            'waveplates': RunningStats(),
+        })
+        self.averages = {}
+        self.run(iterations)
+
+    # Options needed to rebuild an equivalent planner, e.g. in a worker process
+    def options(self) -> dict:
+        return {'roster': self.roster, 'sets': self.sets, 'policy': self.policy}
+
+    def run(self, iterations: int) -> None:
+        if self.precision is not None:
+            adaptive.run_adaptive(self, iterations)
+            return
+
+        if self.workers > 1:
+            partials = parallel.run_chunks(
+                type(self), iterations, self.workers, self.seed, thresholds=self.thresholds, **self.options(),
+            )
+            for partial in partials:
+                parallel.merge_results(self.results, partial)
+            return
+
+        rng = parallel.seed_streams(self.seed)
+        for threshold in self.thresholds:
+            self.run_threshold(threshold, iterations, rng)
+        return
+
+    # Farm all trials for one threshold, then reroll each character's 4 cost echo from a RollStream
+    def run_threshold(self, threshold: int, iterations: int, rng: np.random.Generator) -> None:
+        trials = self.farm_trials(iterations, threshold, rng)
+        xp = np.asarray(trials['xp'])
+        tuners = np.asarray(trials['tuners'])
+
+        stream = RollStream(threshold, rng, policy=self.policy)
+        four_costs = [character.four_cost for character in self.roster if character.four_cost is not None]
+        for i in range(iterations):
+            for mainstat in four_costs:
+                dbl_crit = False
+                while not dbl_crit:
+                    dbl_crit, echo_xp, echo_tuners = stream.next(mainstat)
+                    xp[i] += echo_xp
+                    tuners[i] += echo_tuners
+
+        xp_waveplates = 12.4136 * xp
+        tuners_waveplates = 3 * tuners
+        tacet_waveplates = 60 * np.asarray(trials['tacet_runs'])
+        results = self.results[threshold]
+        results['xp'].extend(xp)
+        results['tuners'].extend(tuners)
+        for cost, totals in trials['total'].items():
+            results['total'][cost].extend(totals)
+        for character in self.roster:
+            results['rolled'][character.name].extend(trials['rolled'][character.name])
+            results['done_runs'][character.name].extend(trials['done_runs'][character.name])
+        results['echo_waveplates'].extend(tacet_waveplates)
+        results['xp_waveplates'].extend(xp_waveplates)
+        results['tuners_waveplates'].extend(tuners_waveplates)
+        results['waveplates'].extend(np.maximum.reduce([xp_waveplates, tuners_waveplates, tacet_waveplates]))
+        return
+
+    # Run trials of farming the whole roster from blocks of shared drops
+    # Returns per-trial lists: 'xp', 'tuners', 'tacet_runs', 'total' by cost, and by character
+    # name the echoes 'rolled' and the tacet runs until its farmed echoes were 'done_runs'
+    def farm_trials(self, iterations: int, threshold: int, rng: np.random.Generator) -> dict:
+        names = [character.name for character in self.roster]
+        trials = {
+            'xp': [], 'tuners': [], 'tacet_runs': [],
+            'total': {cost: [] for cost in TacetField.costs},
+            'rolled': {name: [] for name in names},
+            'done_runs': {name: [] for name in names},
+        }
+        state = self._new_trial()
+
+        while len(trials['xp']) < iterations:
+            block = self.field.drop_block(RUNS_PER_BLOCK, rng)
+            rolls = self.roll_block(block, threshold, rng)
+            dropped = self.field.dropped_counts(block, RUNS_PER_BLOCK)
+            state = self.walk_block(block, dropped, rolls, state, trials, iterations)
+
+        return trials
+
+    # Roll every drop of a block that some character could use, grouped by routing key
+    # Returns {(cost, set id, mainstat id): (drop indices, indices of the usable ones,
+    # cumulative xp, cumulative tuners)}, as lists since the walk bisects them a few items at a time
+    def roll_block(self, block: np.ndarray, threshold: int, rng: np.random.Generator) -> dict:
+        num_mainstats = {cost: len(names) for cost, names in TacetField.mainstats.items()}
+        rolls = {}
+        for cost in {key[0] for key in self.routes}:
+            wanted = np.zeros(len(self.sets) * num_mainstats[cost], dtype=bool)
+            for key_cost, set_id, mainstat_id in self.routes:
+                if key_cost == cost:
+                    wanted[set_id * num_mainstats[cost] + mainstat_id] = True
+
+            rows = np.flatnonzero(block['cost'] == cost)
+            codes = block['set'][rows].astype(np.int64) * num_mainstats[cost] + block['mainstat'][rows]
+            keep = wanted[codes]
+            rows, codes = rows[keep], codes[keep]
+            batch = Echo.roll_substats_batch(
+                len(rows), threshold, rng, self.policy, block['mainstat'][rows], tuple(TacetField.mainstats[cost]),
+            )
+            for code in np.unique(codes):
+                selected = codes == code
+                positions = rows[selected]
+                rolls[(cost, *divmod(int(code), num_mainstats[cost]))] = (
+                    positions.tolist(),
+                    positions[batch.dbl_crit[selected]].tolist(),
+                    np.concatenate(([0.0], np.cumsum(batch.xp[selected]))).tolist(),
+                    np.concatenate(([0.0], np.cumsum(batch.tuners[selected]))).tolist(),
+                )
+        return rolls
+
+    # Advance trials through one block, from one met need to the next, appending each one that finishes
+    # :dropped: dict - From TacetField.dropped_counts
+    # :rolls: dict - From roll_block
+    # :state: dict - The unfinished trial carried over from the previous block
+    # Returns the unfinished trial to carry into the next block
+    def walk_block(self, block: np.ndarray, dropped: dict, rolls: dict, state: dict, trials: dict,
+                   iterations: int) -> dict:
+        runs = block['run']
+        empty = ([], [], [0.0], [0.0])
+        cursor, first_run = 0, 0
+        while cursor < len(block) and len(trials['xp']) < iterations:
+            # Each key goes to its first slot still missing echoes
+            routed = defaultdict(list)
+            for key, slots in self.routes.items():
+                slot = next((slot for slot in slots if state['missing'][slot]), None)
+                if slot is not None:
+                    routed[slot].append(rolls.get(key, empty))
+
+            # The drop at which the next slot gets its last usable echo, if it does in this block
+            end, finished = len(block) - 1, None
+            for slot, keyed in routed.items():
+                missing = state['missing'][slot]
+                upcoming = []
+                for _, usable, _, _ in keyed:
+                    i = bisect_left(usable, cursor)
+                    upcoming.extend(usable[i:i + missing])
+                upcoming.sort()
+                if len(upcoming) >= missing and upcoming[missing - 1] <= end:
+                    end, finished = upcoming[missing - 1], slot
+
+            for slot, keyed in routed.items():
+                character = self.slots[slot][0]
+                for positions, usable, xp, tuners in keyed:
+                    first, last = bisect_left(positions, cursor), bisect_right(positions, end)
+                    state['xp'] += xp[last] - xp[first]
+                    state['tuners'] += tuners[last] - tuners[first]
+                    state['rolled'][character] += last - first
+                    state['missing'][slot] -= bisect_right(usable, end) - bisect_left(usable, cursor)
+
+            if finished is not None:
+                character = self.slots[finished][0]
+                if not any(state['missing'][slot] for slot, (owner, _) in enumerate(self.slots) if owner == character):
+                    state['done_runs'][character] = state['tacet_runs'] + int(runs[end]) - first_run + 1
+            if any(state['missing']):
+                if finished is None:
+                    # The block ran out first, carry the trial over
+                    state['tacet_runs'] += RUNS_PER_BLOCK - first_run
+                    for cost in dropped:
+                        state['total'][cost] += int(dropped[cost][-1] - dropped[cost][first_run])
+                cursor = end + 1
+                continue
+
+            # The trial ends with the tacet run of its last echo, the rest of that run is discarded
+            last_run = int(runs[end])
+            state['tacet_runs'] += last_run - first_run + 1
+            for cost in dropped:
+                state['total'][cost] += int(dropped[cost][last_run + 1] - dropped[cost][first_run])
+            self._record_trial(state, trials)
+            state = self._new_trial()
+            first_run = last_run + 1
+            cursor = int(np.searchsorted(runs, first_run))
+
+        return state
+
+    def _record_trial(self, state: dict, trials: dict) -> None:
+        trials['xp'].append(state['xp'])
+        trials['tuners'].append(state['tuners'])
+        trials['tacet_runs'].append(state['tacet_runs'])
+        for cost, total in state['total'].items():
+            trials['total'][cost].append(total)
+        for i, character in enumerate(self.roster):
+            trials['rolled'][character.name].append(state['rolled'][i])
+            trials['done_runs'][character.name].append(state['done_runs'][i])
+        return
+
+    def _new_trial(self) -> dict:
+        return {
+            'xp': 0.0, 'tuners': 0.0, 'tacet_runs': 0,
+            'missing': [need for _, need in self.slots],
+            'rolled': [0] * len(self.roster),
+            'done_runs': [0] * len(self.roster),
+            'total': {cost: 0 for cost in TacetField.costs},
+        }
+
+    # The (character index, echoes needed) of every (character, cost) need, rarest drop first,
+    # and for every (cost, set id, mainstat id) some character accepts, the slots it can fill in
+    # the order they get it
+    def _build_routes(self) -> tuple:
+        set_names = list(self.sets)
+        set_total = sum(self.sets.values())
+        cost_total = sum(TacetField.costs.values())
+        needs = []
+        for i, character in enumerate(self.roster):
+            for cost, need in character.needs.items():
+                if need <= 0:
+                    continue
+                probs = TacetField.mainstat_probs[cost]
+                chance = (
+                    TacetField.costs[cost] / cost_total * self.sets[character.set] / set_total
+                    * sum(p for name, p in zip(TacetField.mainstats[cost], probs) if name in character.acceptable[cost])
+                    / sum(probs)
+                )
+                assert chance > 0, f"{character.name} can never get a {cost} cost echo it accepts"
+                needs.append((chance, i, cost, need))
+        needs.sort(key=lambda need: need[:2])
+
+        slots = [(i, need) for _, i, _, need in needs]
+        routes = defaultdict(list)
+        for slot, (_, i, cost, _) in enumerate(needs):
+            character = self.roster[i]
+            for mainstat_id, name in enumerate(TacetField.mainstats[cost]):
+                if name in character.acceptable[cost]:
+                    routes[(cost, set_names.index(character.set), mainstat_id)].append(slot)
+        return slots, dict(routes)
+
+    def compute_averages(self) -> None:
+        for threshold in sorted(self.results.keys()):
+            metrics = self.results[threshold]
+            self.averages[threshold] = {}
+            for key, acc in metrics.items():
+                if isinstance(acc, dict):
+                    self.averages[threshold][key] = {sub: totals.mean for sub, totals in acc.items()}
+                else:
+                    self.averages[threshold][key] = acc.mean
+            self.averages[threshold]['iterations'] = metrics['waveplates'].count
+            self.averages[threshold]['waveplates_percentiles'] = metrics['waveplates'].percentiles()
+        return
+
+    def print_to_console(self) -> None:
+        for threshold, data in sorted(self.averages.items()):
+            print(f"Threshold {threshold}: {data['waveplates']:.2f} waveplates, {data['xp']:.2f} tubes, "
+                  f"{data['tuners']:.2f} tuners, {data['echo_waveplates'] / 60:.2f} tacet runs")
+            for character in self.roster:
+                print(f"  {character.name}: {data['rolled'][character.name]:.2f} echoes rolled, "
+                      f"done after {data['done_runs'][character.name]:.2f} tacet runs")
+        return
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    roster = [
+        Character("Main DPS", set='Correct', acceptable={1: ['ATK%'], 3: ['Aero%']}),
+        Character("Sub DPS", set='Correct', acceptable={1: ['ATK%'], 3: ['Aero%', 'ATK%']}),
+        Character("Healer", set='Incorrect', acceptable={1: ['HP%'], 3: ['HP%', 'Energy Regen%']}, four_cost=None),
+    ]
+    planner = Planner(2000, roster, seed=0)
+    planner.compute_averages()
+    planner.print_to_console()
+
+    end_time = time.perf_counter()
+    print(f"Finished in {end_time - start_time:.6f}s")
@@ -0,0 +1,81 @@
+import copy
+import random
+import numpy as np
+
+# Compiled samplers keyed by (owner class, name), with the generation they were last checked in,
+# the tables they were checked against, the snapshot of the tables they were built from and the artifact
+_compiled = {}
+# Bumped by refresh(), compiled artifacts are checked against their tables once per generation
+_generation = 0
+
+
+# Draw indices from a fixed discrete distribution in O(1) per draw (Vose's alias method)
+# :weights: list - Relative weight of each index, need not sum to 1
+class AliasSampler:
+    def __init__(self, weights: list) -> None:
+        n = len(weights)
+        total = sum(weights)
+        assert n > 0 and total > 0, "weights must contain a positive entry"
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+
+        self.n = n
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1
+            (small if scaled[l] < 1 else large).append(l)
+
+        self.prob_array = np.array(self.prob)
+        self.alias_array = np.array(self.alias)
+        return
+
+    # Draw one index using a single uniform from the random module
+    def sample(self) -> int:
+        u = random.random() * self.n
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+    # Draw `size` indices at once from a numpy generator
+    def sample_array(self, size: int, rng: np.random.Generator) -> np.ndarray:
+        u = rng.random(size) * self.n
+        i = u.astype(np.intp)
+        return np.where(u - i < self.prob_array[i], i, self.alias_array[i])
+
+
+# Return the compiled form of some class-level tables, building it on first use and
+# rebuilding it whenever the tables no longer equal the snapshot it was built from.
+# Within a generation the tables are compared to the ones last checked, which for the very same
+# table objects is an identity check per table; tables replaced by others are compared in full
+# right away, but tables edited in place, such as TacetField.acceptable[3] = [...], are only
+# picked up at the next refresh(), which every simulation and solver calls when it starts
+# :owner: type - The class the tables belong to
+# :name: str - Name of the compiled artifact, unique per owner
+# :build: callable - Builds the compiled artifact from the tables
+# :tables: tuple - The tables the artifact depends on
+def compiled(owner: type, name: str, build, *tables):
+    key = (owner, name)
+    cached = _compiled.get(key)
+    if cached is not None:
+        generation, checked, snapshot, artifact = cached
+        if generation == _generation and checked == tables:
+            return artifact
+        if snapshot == tables:
+            _compiled[key] = (_generation, tables, snapshot, artifact)
+            return artifact
+    artifact = build(*tables)
+    _compiled[key] = (_generation, tables, copy.deepcopy(tables), artifact)
+    return artifact
+
+
+# Have every compiled artifact checked against its tables again on its next lookup,
+# picking up edits made to the tables in place since the last refresh
+def refresh() -> None:
+    global _generation
+    _generation += 1
+    return
@@ -0,0 +1,335 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import ResultCache
+from tacet import TacetField
+import cli
+import variance
+
+# Largest iteration count a request may ask for, per threshold, also the default cap on adaptive runs
+MAX_ITERATIONS = 1_000_000
+
+# Largest request body accepted, in bytes
+MAX_BODY = 64 * 1024
+
+# Computed answers kept in memory, least recently used first out
+CACHE_SIZE = 256
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+# Validate a simulate request and fill in its defaults, so equal requests compare equal
+# :body: dict - Decoded JSON with 'scenario' and optionally 'iterations', 'thresholds', 'cost_filter',
+#               'acceptable', 'seed', 'precision', 'relative', 'max_iterations', 'crn', 'exact', 'estimator',
+#               'skip', 'keyed'
+# Raises ValueError with a message for the client on an invalid request
+def normalize(body: dict) -> dict:
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    unknown = set(body) - {'scenario', 'iterations', 'thresholds', 'cost_filter', 'acceptable', 'seed',
+                           'precision', 'relative', 'max_iterations', 'crn', 'exact', 'estimator', 'skip',
+                           'keyed'}
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    scenario = body.get('scenario')
+    if scenario not in cli.SCENARIOS:
+        raise ValueError(f"scenario must be one of: {', '.join(cli.SCENARIOS)}")
+
+    request = {
+        'scenario': scenario,
+        'iterations': _integer(body, 'iterations', cli.SCENARIOS[scenario][1], 1, MAX_ITERATIONS),
+        'thresholds': sorted(set(_integers(body, 'thresholds', [1, 2, 3, 4, 5], 1, 5))),
+        'seed': _integer(body, 'seed', None, 0, None),
+        'precision': _number(body, 'precision'),
+        'relative': _flag(body, 'relative'),
+        'max_iterations': _integer(body, 'max_iterations', MAX_ITERATIONS, 1, MAX_ITERATIONS),
+        'crn': _flag(body, 'crn'),
+        'exact': _flag(body, 'exact'),
+        'estimator': body.get('estimator'),
+        'skip': _flag(body, 'skip'),
+        'keyed': _flag(body, 'keyed'),
+        'cost_filter': sorted(set(_integers(body, 'cost_filter', [1, 3], 1, 3))),
+        'acceptable': None,
+    }
+    if any(cost not in TacetField.mainstats for cost in request['cost_filter']):
+        raise ValueError(f"cost_filter must only contain: {', '.join(map(str, TacetField.mainstats))}")
+    if request['exact'] and scenario != 'cost_agnostic':
+        raise ValueError("exact is only supported by the cost_agnostic scenario")
+    if request['estimator'] is not None:
+        if request['estimator'] not in variance.ESTIMATORS:
+            raise ValueError(f"estimator must be one of: {', '.join(variance.ESTIMATORS)}")
+        if scenario != 'cost_agnostic':
+            raise ValueError("estimator is only supported by the cost_agnostic scenario")
+        if request['exact'] or request['crn']:
+            raise ValueError("estimator cannot be combined with exact or crn")
+    if request['skip'] and (request['crn'] or request['exact'] or request['estimator'] is not None):
+        raise ValueError("skip cannot be combined with crn, exact or estimator")
+    if request['keyed'] and (request['crn'] or request['exact'] or request['estimator'] is not None or request['skip']):
+        raise ValueError("keyed cannot be combined with crn, exact, estimator or skip")
+    if request['keyed'] and request['seed'] is None:
+        raise ValueError("keyed needs a seed, to replay its trials with")
+    if request['precision'] is None:
+        request['relative'] = False
+        request['max_iterations'] = None
+    if scenario != 'indiv_cost':
+        request['cost_filter'] = None
+
+    acceptable = body.get('acceptable')
+    if acceptable is not None and scenario == 'cost_agnostic':
+        raise ValueError("acceptable is not supported by the cost_agnostic scenario")
+    if acceptable is not None:
+        if not isinstance(acceptable, dict):
+            raise ValueError("acceptable must map echo costs to lists of mainstats")
+        request['acceptable'] = {}
+        for key, names in acceptable.items():
+            cost = int(key) if str(key).isdigit() else None
+            if cost not in TacetField.mainstats:
+                raise ValueError(f"acceptable has an unknown echo cost: {key}")
+            if not isinstance(names, list) or any(name not in TacetField.mainstats[cost] for name in names):
+                raise ValueError(f"acceptable mainstats for cost {cost} must be a list of: "
+                                 f"{', '.join(TacetField.mainstats[cost])}")
+            request['acceptable'][str(cost)] = sorted(set(names))
+    return request
+
+
+# Run a normalized request, in a worker process
+# The acceptable mainstats are class-level tables, set for the duration of the run; a worker only
+# runs one request at a time, and the compiled lookups notice the change
+# :cache_dir: str - Directory of an on-disk ResultCache to serve and extend, None to always simulate
+# Returns the averages in the form of the CLI's JSON report
+def compute(request: dict, cache_dir: str = None) -> dict:
+    cls = cli.SCENARIOS[request['scenario']][0]
+    kwargs = {'seed': request['seed'], 'thresholds': tuple(request['thresholds'])}
+    if request['precision'] is not None:
+        kwargs.update(precision=request['precision'], relative=request['relative'],
+                      max_iterations=request['max_iterations'])
+    kwargs['crn'] = request['crn']
+    kwargs['skip'] = request['skip']
+    kwargs['keyed'] = request['keyed']
+    if request['scenario'] == 'cost_agnostic':
+        kwargs['exact'] = request['exact']
+        kwargs['estimator'] = request['estimator']
+    if request['scenario'] == 'indiv_cost':
+        runs = [(cost, {'cost_filter': cost}) for cost in request['cost_filter']]
+    else:
+        runs = [(None, {})]
+
+    cache = (ResultCache(cache_dir) if cache_dir and request['precision'] is None and request['estimator'] is None
+             else None)
+    previous = TacetField.__dict__['acceptable']
+    if request['acceptable'] is not None:
+        TacetField.acceptable = {int(cost): names for cost, names in request['acceptable'].items()}
+    try:
+        start_time = time.perf_counter()
+        results = []
+        for cost_filter, options in runs:
+            if cache is not None:
+                sim = cache.run(cls, request['iterations'], **options, **kwargs)
+            else:
+                sim = cls(request['iterations'], **options, **kwargs)
+            sim.compute_averages()
+            results.append({'cost_filter': cost_filter, 'averages': sim.averages})
+        elapsed = time.perf_counter() - start_time
+    finally:
+        TacetField.acceptable = previous
+
+    # Round trip through JSON here, so the parent only ever handles plain data
+    return json.loads(json.dumps({'runs': results, 'elapsed_seconds': elapsed}, default=float))
+
+
+# Answers simulate requests from a process pool, running each distinct request once: identical
+# requests in flight share one computation, and finished answers are kept in an LRU cache
+# :workers: int - Worker processes running simulations
+# :cache_size: int - Answers kept in memory
+# :cache_dir: str - Directory of an on-disk ResultCache shared by the workers, None for none
+class Service:
+    def __init__(self, workers: int = None, cache_size: int = CACHE_SIZE, cache_dir: str = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self.pool = None
+        self.answers = collections.OrderedDict()
+        self.inflight = {}
+        self.counts = {'requests': 0, 'computed': 0, 'cache_hits': 0, 'coalesced': 0, 'errors': 0}
+
+        return
+
+    def start(self) -> None:
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        return
+
+    # The answer to a request, from the cache, a computation already in flight or a new one
+    # Returns (answer, how it was served: 'cache', 'coalesced' or 'computed')
+    async def simulate(self, body: dict) -> tuple:
+        request = normalize(body)
+        key = json.dumps(request, sort_keys=True)
+        self.counts['requests'] += 1
+
+        if key in self.answers:
+            self.answers.move_to_end(key)
+            self.counts['cache_hits'] += 1
+            return self.answers[key], 'cache'
+        if key in self.inflight:
+            self.counts['coalesced'] += 1
+            return await asyncio.shield(self.inflight[key]), 'coalesced'
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = asyncio.ensure_future(loop.run_in_executor(self.pool, compute, request, self.cache_dir))
+        self.inflight[key] = future
+        try:
+            answer = await asyncio.shield(future)
+        finally:
+            del self.inflight[key]
+        answer['request'] = request
+        self.answers[key] = answer
+        while len(self.answers) > self.cache_size:
+            self.answers.popitem(last=False)
+        self.counts['computed'] += 1
+        return answer, 'computed'
+
+    # Route one parsed HTTP request, returning (status, JSON-able payload)
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple:
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/scenarios':
+            return 200, {
+                name: {'default_iterations': iterations} for name, (_, iterations) in cli.SCENARIOS.items()
+            }
+        if path == '/stats':
+            return 200, {**self.counts, 'cached': len(self.answers), 'inflight': len(self.inflight),
+                         'workers': self.workers}
+        if path != '/simulate':
+            return 404, {'error': f"no such endpoint: {path}"}
+        if method != 'POST':
+            return 405, {'error': "use POST with a JSON body"}
+
+        try:
+            answer, served = await self.simulate(json.loads(body or b'{}'))
+        except (ValueError, TypeError) as error:
+            self.counts['errors'] += 1
+            return 400, {'error': str(error)}
+        return 200, {**answer, 'served': served}
+
+    # Read one HTTP/1.1 request off a connection, answer it and close the connection
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = request_line.split(' ', 2)
+            headers = {}
+            for line in header_lines:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                status, payload = 413, {'error': f"request body is limited to {MAX_BODY} bytes"}
+            else:
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.dispatch(method.upper(), target.split('?', 1)[0], body)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            status, payload = 400, {'error': "malformed HTTP request"}
+        except Exception as error:
+            self.counts['errors'] += 1
+            status, payload = 500, {'error': f"{type(error).__name__}: {error}"}
+
+        data = json.dumps(payload, default=float).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Access-Control-Allow-Origin: *\r\n"
+            f"Connection: close\r\n\r\n".encode() + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        return
+
+    # Serve on host:port until cancelled, computing the precomputed requests first
+    # :precompute: list - Request bodies to answer before accepting connections
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765, precompute: list = ()) -> None:
+        self.start()
+        try:
+            if precompute:
+                await asyncio.gather(*(self.simulate(body) for body in precompute))
+            server = await asyncio.start_server(self.handle, host, port)
+            async with server:
+                print(f"Serving on http://{host}:{server.sockets[0].getsockname()[1]}", file=sys.stderr)
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def _integer(body: dict, key: str, default, low: int, high: int):
+    value = body.get(key, default)
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or value < low or (high is not None and value > high):
+        raise ValueError(f"{key} must be an integer from {low}" + (f" to {high}" if high is not None else ""))
+    return value
+
+
+def _integers(body: dict, key: str, default: list, low: int, high: int) -> list:
+    values = body.get(key, default)
+    if isinstance(values, int) and not isinstance(values, bool):
+        values = [values]
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"{key} must be a non-empty list of integers from {low} to {high}")
+    return [_integer({key: value}, key, None, low, high) for value in values]
+
+
+def _number(body: dict, key: str):
+    value = body.get(key)
+    if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+        raise ValueError(f"{key} must be a positive number")
+    return value
+
+
+def _flag(body: dict, key: str) -> bool:
+    value = body.get(key, False)
+    if not isinstance(value, bool):
+        raise ValueError(f"{key} must be true or false")
+    return value
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve simulation results over HTTP/JSON on localhost.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, help="worker processes, default one per CPU")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help="answers kept in memory")
+    parser.add_argument('--cache', metavar='DIR', help="also serve and extend results from an on-disk cache in DIR")
+    parser.add_argument('--precompute', metavar='FILE', help="JSON list of request bodies to answer at startup")
+    args = parser.parse_args(argv)
+
+    precompute = []
+    if args.precompute:
+        with open(args.precompute) as f:
+            precompute = json.load(f)
+    service = Service(args.workers, args.cache_size, args.cache)
+    try:
+        asyncio.run(service.serve(args.host, args.port, precompute))
+    except KeyboardInterrupt:
+        pass
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import math
+import numpy as np
+
+# Two-sided 95% normal quantile
+Z_95 = 1.959964
+
+# Percentiles reported next to the averages by the simulators
+PERCENTILES = (10, 50, 90, 99)
+
+# Samples buffered by a Distribution before they are folded into its sketch and histogram
+DISTRIBUTION_BUFFER = 4096
+
+
+# Bounded-memory approximation of a distribution's quantiles (a merging t-digest)
+# Samples are grouped into weighted centroids, small near the tails and larger in the middle,
+# so extreme quantiles stay accurate with at most about compression / 2 centroids
+# :compression: int - Larger keeps more centroids and gives more accurate quantiles
+class QuantileSketch:
+    def __init__(self, compression: int = 200) -> None:
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+        return
+
+    # Add many samples at once, with optional weights
+    def extend(self, values, weights=None) -> None:
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+        weights = np.ones(values.size) if weights is None else np.asarray(weights, dtype=float)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate((self.means, values)), np.concatenate((self.weights, weights)))
+        return
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if other.count == 0:
+            return
+        self.extend(other.means, other.weights)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return
+
+    # Regroup sorted centroids into buckets spanning less than one unit of the arcsine scale function
+    def _compress(self, means: np.ndarray, weights: np.ndarray) -> None:
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        mid = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * math.pi) * np.arcsin(2 * mid - 1)
+        bucket = np.floor(k - k[0]).astype(np.intp)
+        starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+        self.count = int(round(total))
+        return
+
+    # Approximate q-quantile, 0 <= q <= 1, interpolating between centroid centers
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate(([0.0], centers, [self.count]))
+        values = np.concatenate(([self.min], self.means, [self.max]))
+        return float(np.interp(q * self.count, positions, values))
+
+
+# Counts over fixed, geometrically spaced bins, identical for every histogram so that
+# histograms filled separately merge by adding counts
+# Bin 0 holds samples below LOW and the last bin samples at or above HIGH
+class Histogram:
+    LOW = 1.0
+    HIGH = 1e7
+    BINS_PER_DECADE = 50
+
+    def __init__(self) -> None:
+        decades = math.log10(self.HIGH / self.LOW)
+        self.counts = np.zeros(int(round(decades * self.BINS_PER_DECADE)) + 2, dtype=np.int64)
+
+        return
+
+    # Bin edges, the outer two bins being open ended
+    @classmethod
+    def edges(cls) -> np.ndarray:
+        decades = math.log10(cls.HIGH / cls.LOW)
+        return cls.LOW * np.logspace(0, decades, int(round(decades * cls.BINS_PER_DECADE)) + 1)
+
+    def extend(self, values) -> None:
+        values = np.asarray(values, dtype=float).ravel()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = np.floor(np.log10(values / self.LOW) * self.BINS_PER_DECADE).astype(np.int64) + 1
+        index = np.where(values < self.LOW, 0, np.clip(index, 1, len(self.counts) - 1))
+        self.counts += np.bincount(index, minlength=len(self.counts))
+        return
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts += other.counts
+        return
+
+
+# Quantile sketch and histogram of one metric, filled through a small buffer so
+# that adding a single sample only appends to a list
+class Distribution:
+    def __init__(self) -> None:
+        self.sketch = QuantileSketch()
+        self.histogram = Histogram()
+        self.pending = []
+
+        return
+
+    def add(self, x: float) -> None:
+        self.pending.append(x)
+        if len(self.pending) >= DISTRIBUTION_BUFFER:
+            self.flush()
+        return
+
+    def extend(self, values) -> None:
+        self.flush()
+        self.sketch.extend(values)
+        self.histogram.extend(values)
+        return
+
+    def merge(self, other: "Distribution") -> None:
+        self.flush()
+        other.flush()
+        self.sketch.merge(other.sketch)
+        self.histogram.merge(other.histogram)
+        return
+
+    def flush(self) -> None:
+        if self.pending:
+            pending, self.pending = self.pending, []
+            self.sketch.extend(pending)
+            self.histogram.extend(pending)
+        return
+
+    def quantile(self, q: float) -> float:
+        self.flush()
+        return self.sketch.quantile(q)
+
+
+# Streaming mean, variance, min and max of one metric in O(1) memory (Welford's algorithm),
+# with its Distribution for quantiles and histograms in bounded memory
+# Accumulators filled separately, e.g. by different workers, can be combined with merge
+class RunningStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.distribution = Distribution()
+
+        return
+
+    # Add a single sample
+    def add(self, x: float) -> None:
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        self.distribution.add(x)
+        return
+
+    # Add many samples at once, e.g. one batch of trials
+    def extend(self, values) -> None:
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        batch = RunningStats()
+        batch.count = values.size
+        batch.mean = float(values.mean())
+        batch.m2 = float(((values - batch.mean) ** 2).sum())
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        self._merge_moments(batch)
+        self.distribution.extend(values)
+        return
+
+    # Fold another accumulator into this one (Chan et al. pairwise update)
+    def merge(self, other: "RunningStats") -> None:
+        self._merge_moments(other)
+        self.distribution.merge(other.distribution)
+        return
+
+    def _merge_moments(self, other: "RunningStats") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return
+
+    # Sample variance
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    # Standard error of the mean
+    @property
+    def sem(self) -> float:
+        return math.sqrt(self.variance / self.count) if self.count > 0 else 0.0
+
+    # Half-width of the normal confidence interval around the mean
+    def half_width(self, z: float = Z_95) -> float:
+        return z * self.sem
+
+    # Approximate p-th percentile, 0 <= p <= 100
+    def percentile(self, p: float) -> float:
+        return self.distribution.quantile(p / 100)
+
+    # {p: percentile} for the PERCENTILES reported by the simulators
+    def percentiles(self, ps: tuple = PERCENTILES) -> dict:
+        return {p: self.percentile(p) for p in ps}
+
+    def __repr__(self) -> str:
+        return f"RunningStats(count={self.count}, mean={self.mean}, std={self.std}, min={self.min}, max={self.max})"
+
+
+# Fold the accumulators of one run into another, metric by metric
+# Dict-valued metrics (e.g. 'total', keyed by echo cost) are merged key by key
+def merge_metrics(metrics: dict, other: dict) -> None:
+    for key, acc in other.items():
+        if isinstance(acc, dict):
+            merge_metrics(metrics[key], acc)
+        else:
+            metrics[key].merge(acc)
+    return
+
+
+# Histogram densities of one metric per threshold, for plotting
+# :results: dict - A simulation's results, {threshold: {metric: RunningStats}}
+# Returns {threshold: (bin edges, fraction of trials per bin)} over the bins in use
+def histogram_series(results: dict, metric: str) -> dict:
+    edges = Histogram.edges()
+    series = {}
+    for threshold, metrics in sorted(results.items()):
+        distribution = metrics[metric].distribution
+        distribution.flush()
+        counts = distribution.histogram.counts[1:-1]
+        used = np.flatnonzero(counts)
+        if used.size == 0:
+            continue
+        lo, hi = used[0], used[-1] + 1
+        series[threshold] = (edges[lo:hi + 1], counts[lo:hi] / counts.sum())
+    return series
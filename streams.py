@@ -0,0 +1,38 @@
+import hashlib
+
+import numpy as np
+
+import parallel
+
+# Trials whose seeds are generated per Philox call when walking a stream
+BLOCK = 4096
+
+
+# Philox key of the trials of one scenario and threshold under a root seed
+# The scenario enters through its repr, so equal scenarios share streams across simulation classes
+# :seed: int | np.random.SeedSequence - Root seed of the run
+# :scenario: engine.Scenario - The scenario being simulated
+# :threshold: int - The threshold being simulated
+def stream_key(seed, scenario, threshold: int) -> np.ndarray:
+    root = parallel.seed_sequence(seed)
+    tag = int.from_bytes(hashlib.blake2b(repr(scenario).encode(), digest_size=8).digest(), 'little')
+    return np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + (tag, threshold)).generate_state(2, np.uint64)
+
+
+# Seeds of the random module for the trials first, first + 1, ... of the stream keyed by key
+# Philox is counter based: block i of its output is a function of the key and i alone, so trial i
+# is seeded from block i however the trials are split between workers, rounds or calls.
+# :key: np.ndarray - Philox key from stream_key
+# :first: int - Index of the first trial
+# :n: int - Number of trials
+def trial_seeds(key: np.ndarray, first: int, n: int):
+    for start in range(first, first + n, BLOCK):
+        count = min(BLOCK, first + n - start)
+        blocks = np.random.Philox(key=key, counter=start).random_raw(4 * count).reshape(count, 4)
+        for words in blocks.tolist():
+            yield words[0] | words[1] << 64 | words[2] << 128 | words[3] << 192
+
+
+# Seed of a single trial, without generating the ones before it
+def trial_seed(key: np.ndarray, trial: int) -> int:
+    return next(trial_seeds(key, trial, 1))
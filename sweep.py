@@ -0,0 +1,148 @@
+from echo import Echo
+from tacet import TacetField, RUNS_PER_BLOCK
+import itertools
+import numpy as np
+import parallel
+import sampling
+import sys
+import time
+
+
+# One grid point of a sweep
+# :acceptable: dict - Acceptable mainstats per cost, like TacetField.acceptable
+# :cost_filter: tuple - The echo costs being farmed
+# :usable: int - Usable double crit echoes needed of each farmed cost
+# :sets: dict - Set probabilities, like TacetField.sets
+# :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+class Cell:
+    def __init__(self, acceptable: dict, cost_filter: tuple, usable: int, sets: dict, threshold: int) -> None:
+        self.acceptable = acceptable
+        self.cost_filter = cost_filter
+        self.usable = usable
+        self.sets = sets
+        self.threshold = threshold
+        self.targets = {cost: usable for cost in cost_filter}
+        self.correct_chance = sets['Correct'] / sum(sets.values())
+        self.lookup = TacetField._build_accept_lookup(acceptable, TacetField.mainstats, sets)[1]
+        self.trials = TacetField._new_trials(self.targets, tuple(TacetField.costs))
+        self.state = TacetField._new_trial(self.targets, tuple(TacetField.costs))
+
+        return
+
+    # Mask of the drops in a block this cell rolls for a cost
+    # :set_roll: np.ndarray - Shared uniform draw per drop, the drop is of the correct set below correct_chance
+    def accept_mask(self, block: np.ndarray, set_roll: np.ndarray, cost: int) -> np.ndarray:
+        mask = (block['cost'] == cost) & (set_roll < self.correct_chance)
+        candidates = np.flatnonzero(mask)
+        mask[candidates] = self.lookup[cost][block['mainstat'][candidates]]
+        return mask
+
+    # Parameter columns of this cell's row in the sweep table
+    def columns(self) -> dict:
+        return {
+            'acceptable': ";".join(f"{cost}:{'|'.join(names)}" for cost, names in sorted(self.acceptable.items())),
+            'cost_filter': "+".join(str(cost) for cost in self.cost_filter),
+            'usable': self.usable,
+            'correct_chance': self.correct_chance,
+            'threshold': self.threshold,
+        }
+
+
+# Evaluate every point of a parameter grid against one shared stream of tacet drops and
+# substat draws. Each drop carries one set roll and one full five-substat draw, and every
+# cell reads them through its own acceptable mainstats, costs and set probability, so
+# differences between cells come from the parameters rather than from sampling noise.
+# :iterations: int - Number of trials per cell
+# :acceptable: list - Values of TacetField.acceptable to try
+# :cost_filter: list - Echo costs to farm, each an int or a tuple of costs farmed together
+# :usable: list - Usable echoes needed per farmed cost, 2 in indiv_cost_sim
+# :sets: list - Values of TacetField.sets to try
+# :thresholds: tuple - The thresholds to simulate for every grid point
+# :seed: int - Seed for a reproducible sweep
+# Returns one row per cell and threshold with the parameters followed by the averages
+def sweep(iterations: int, acceptable: list = None, cost_filter: list = (1, 3), usable: list = (2,),
+          sets: list = None, thresholds: tuple = (1, 2, 3, 4, 5), seed: int = None) -> list:
+    sampling.refresh()
+    acceptable = acceptable or [TacetField.acceptable]
+    sets = sets or [TacetField.sets]
+    cost_filter = [costs if isinstance(costs, tuple) else (costs,) for costs in cost_filter]
+    cells = [
+        Cell(*params) for params in itertools.product(acceptable, cost_filter, usable, sets, thresholds)
+    ]
+
+    rng = parallel.seed_streams(seed)
+    t = TacetField(iterations=0)
+    pending = list(cells)
+    while pending:
+        block = t.drop_block(RUNS_PER_BLOCK, rng)
+        set_roll = rng.random(len(block))
+        dropped = t.dropped_counts(block, RUNS_PER_BLOCK)
+
+        # Draw substats once for every drop that any cell still running would roll
+        masks = {
+            (id(cell), cost): cell.accept_mask(block, set_roll, cost)
+            for cell in pending for cost in cell.cost_filter
+        }
+        drawn = np.flatnonzero(np.logical_or.reduce(list(masks.values())))
+        row = np.full(len(block), -1)
+        row[drawn] = np.arange(len(drawn))
+        substats, tiers = Echo.draw_substats_batch(len(drawn), rng)
+        scored = {
+            threshold: Echo.score_batch(substats, tiers, threshold)
+            for threshold in {cell.threshold for cell in pending}
+        }
+
+        for cell in pending:
+            batch = scored[cell.threshold]
+            rolls = {}
+            for cost in cell.cost_filter:
+                accepted = np.flatnonzero(masks[(id(cell), cost)])
+                rolls[cost] = t.cumulative_rolls(block['run'][accepted], batch._make(
+                    field[row[accepted]] for field in batch
+                ))
+            cell.state = t.walk_block(dropped, rolls, cell.targets, cell.state, cell.trials, iterations)
+        pending = [cell for cell in pending if len(cell.trials['xp']) < iterations]
+
+    return [dict(cell.columns(), **summarize(cell.trials)) for cell in cells]
+
+
+# Averages of a cell's trials, with the same waveplate costs as indiv_cost_sim
+def summarize(trials: dict) -> dict:
+    xp_waveplates = 12.4136 * np.asarray(trials['xp'])
+    tuners_waveplates = 3 * np.asarray(trials['tuners'])
+    echo_waveplates = 60 * np.asarray(trials['tacet_runs'])
+    waveplates = np.maximum.reduce([xp_waveplates, tuners_waveplates, echo_waveplates])
+
+    averages = {
+        'xp': np.mean(trials['xp']),
+        'tuners': np.mean(trials['tuners']),
+        'rolled': np.mean(np.sum(list(trials['rolled'].values()), axis=0)),
+        'tacet_runs': np.mean(trials['tacet_runs']),
+    }
+    for cost, totals in trials['total'].items():
+        averages[f"total_{cost}"] = np.mean(totals)
+    averages['echo_waveplates'] = echo_waveplates.mean()
+    averages['xp_waveplates'] = xp_waveplates.mean()
+    averages['tuners_waveplates'] = tuners_waveplates.mean()
+    averages['waveplates'] = waveplates.mean()
+    averages['waveplates_sem'] = waveplates.std(ddof=1) / np.sqrt(len(waveplates)) if len(waveplates) > 1 else 0.0
+    averages['iterations'] = len(waveplates)
+    return {key: float(value) if key != 'iterations' else value for key, value in averages.items()}
+
+
+if __name__ == "__main__":
+    import csv
+
+    start_time = time.perf_counter()
+    rows = sweep(
+        5000,
+        acceptable=[TacetField.acceptable, {1: ['HP%', 'ATK%'], 3: ['Aero%', 'ATK%']}],
+        cost_filter=[1, 3, (1, 3)],
+        usable=[1, 2],
+        sets=[TacetField.sets, {'Correct': 0.7, 'Incorrect': 0.3}],
+        seed=0,
+    )
+    writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    print(f"Finished in {time.perf_counter() - start_time}s", file=sys.stderr)
@@ -1,7 +1,23 @@
 import random
 from echo import Echo
+from sampling import AliasSampler
+import numpy as np
+import sampling
+
+# One row per dropped echo in a block from TacetField.drop_block
+# :run: Index of the tacet run within the block that dropped the echo
+# :cost: Echo cost, a key of TacetField.costs
+# :mainstat: Index of the mainstat in TacetField.mainstats[cost]
+# :set: Index of the set in TacetField.sets
+DROP_DTYPE = np.dtype([('run', np.int64), ('cost', np.int8), ('mainstat', np.int8), ('set', np.int8)])
+
+# Number of tacet runs generated per block by TacetField.farm_trials
+RUNS_PER_BLOCK = 16384
 
 class TacetField:
+    # Chance that a tacet run drops 5 echoes instead of 4
+    five_drop_chance = 0.3
+
     acceptable = {
         1: ['HP%'],
         3: ['Aero%']
@@ -40,25 +56,205 @@ class TacetField:
 
     def run(self) -> None:
         self.drops = []
-        if random.random() <= 0.3:
+        samplers = self._samplers()
+        if random.random() <= self.five_drop_chance:
             for _ in range(5):
-                e = self.drop_one()
+                e = self.drop_one(samplers)
                 self.drops.append(e)
 
         else:
             for _ in range(4):
-                e = self.drop_one()
+                e = self.drop_one(samplers)
                 self.drops.append(e)
 
         return
         
-    def drop_one(self) -> Echo:
-        cost = random.choices(list(self.costs.keys()), weights=list(self.costs.values()), k=1)[0]
-        mainstat = random.choices(self.mainstats[cost], weights=self.mainstat_probs[cost], k=1)[0]
-        set = random.choices(list(self.sets.keys()), weights=list(self.sets.values()), k=1)[0]
+    # :samplers: tuple - Compiled samplers from _samplers, looked up if omitted
+    def drop_one(self, samplers: tuple = None) -> Echo:
+        costs, cost_sampler, mainstat_samplers, sets, set_sampler = samplers or self._samplers()
+        cost = costs[cost_sampler.sample()]
+        mainstat = self.mainstats[cost][mainstat_samplers[cost].sample()]
+        set = sets[set_sampler.sample()]
         self.total_echoes_generated[cost] += 1
         return Echo(mainstat=mainstat, cost=cost, set=set)
 
+    # Generate many tacet runs at once as a structured array with DROP_DTYPE, in drop order
+    # :runs: int - The number of tacet runs to simulate
+    # :rng: np.random.Generator - Source of randomness
+    def drop_block(self, runs: int, rng: np.random.Generator) -> np.ndarray:
+        costs, cost_sampler, mainstat_samplers, sets, set_sampler = self._samplers()
+        per_run = np.where(rng.random(runs) <= self.five_drop_chance, 5, 4)
+        n = int(per_run.sum())
+
+        block = np.empty(n, dtype=DROP_DTYPE)
+        block['run'] = np.repeat(np.arange(runs), per_run)
+        cost_ids = cost_sampler.sample_array(n, rng)
+        block['cost'] = np.asarray(costs)[cost_ids]
+        for i, cost in enumerate(costs):
+            dropped = cost_ids == i
+            block['mainstat'][dropped] = mainstat_samplers[cost].sample_array(int(dropped.sum()), rng)
+            self.total_echoes_generated[cost] = self.total_echoes_generated.get(cost, 0) + int(dropped.sum())
+        block['set'] = set_sampler.sample_array(n, rng)
+        return block
+
+    # Mask of the drops in a block worth rolling for a cost: correct set and an acceptable mainstat
+    def accept_mask(self, block: np.ndarray, cost: int) -> np.ndarray:
+        correct, acceptable = self._accept_lookup()
+        mask = (block['cost'] == cost) & (block['set'] == correct)
+        # Mainstat ids index into mainstats[cost], so only look them up for drops of this cost
+        candidates = np.flatnonzero(mask)
+        mask[candidates] = acceptable[cost][block['mainstat'][candidates]]
+        return mask
+
+    # Run trials of farming until each cost in targets has enough usable double crit echoes,
+    # from blocks of drops instead of one Echo at a time. Matches the scalar loop in the
+    # simulators: a cost stops rolling once it has its usable echoes, and a trial ends with
+    # the tacet run in which its last cost finished.
+    # :iterations: int - The number of trials
+    # :targets: dict - Usable echoes needed per cost, e.g. {1: 2, 3: 2}
+    # :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+    # :rng: np.random.Generator - Source of randomness
+    # :policy: Policy - Tuning policy to roll with, the crit threshold rule if omitted
+    # Returns per-trial arrays: 'xp', 'tuners', 'tacet_runs', and dicts by cost of 'rolled' and 'total'
+    def farm_trials(self, iterations: int, targets: dict, threshold: int, rng: np.random.Generator,
+                    policy=None) -> dict:
+        costs = tuple(self.costs.keys())
+        trials = self._new_trials(targets, costs)
+        state = self._new_trial(targets, costs)
+
+        while len(trials['xp']) < iterations:
+            block = self.drop_block(RUNS_PER_BLOCK, rng)
+            # Roll every accepted drop up front; cumulative sums give any range of them in O(1)
+            rolls = {}
+            for cost in targets:
+                accepted = np.flatnonzero(self.accept_mask(block, cost))
+                batch = Echo.roll_substats_batch(
+                    len(accepted), threshold, rng, policy, block['mainstat'][accepted], tuple(self.mainstats[cost]),
+                )
+                rolls[cost] = self.cumulative_rolls(block['run'][accepted], batch)
+            state = self.walk_block(self.dropped_counts(block, RUNS_PER_BLOCK), rolls, targets, state, trials, iterations)
+
+        return trials
+
+    # Cumulative sums of rolled echoes, in the form walk_block expects
+    # :runs: np.ndarray - The tacet run of each rolled echo, in drop order
+    # :batch: RollBatch - Their outcomes
+    @staticmethod
+    def cumulative_rolls(runs: np.ndarray, batch) -> tuple:
+        return (
+            runs,
+            np.concatenate(([0], np.cumsum(batch.dbl_crit))),
+            np.concatenate(([0.0], np.cumsum(batch.xp))),
+            np.concatenate(([0.0], np.cumsum(batch.tuners))),
+        )
+
+    # dropped[cost][r] is the number of echoes of that cost dropped in runs before r
+    def dropped_counts(self, block: np.ndarray, runs: int) -> dict:
+        return {
+            cost: np.concatenate(([0], np.cumsum(np.bincount(block['run'][block['cost'] == cost], minlength=runs))))
+            for cost in self.costs
+        }
+
+    # Advance trials through one block of tacet runs, appending each one that finishes
+    # :dropped: dict - From dropped_counts
+    # :rolls: dict - From cumulative_rolls, per cost in targets
+    # :state: dict - The unfinished trial carried over from the previous block
+    # :trials: dict - Finished trials, appended to until it holds iterations of them
+    # Returns the unfinished trial to carry into the next block
+    @staticmethod
+    def walk_block(dropped: dict, rolls: dict, targets: dict, state: dict, trials: dict, iterations: int) -> dict:
+        runs_per_block = len(next(iter(dropped.values()))) - 1
+        start = 0
+        while start < runs_per_block and len(trials['xp']) < iterations:
+            # Find where each unfinished cost gets its last usable echo, if it does in this block
+            stops = {}
+            for cost in state['pending']:
+                runs, usable, _, _ = rolls[cost]
+                first = np.searchsorted(runs, start)
+                last = np.searchsorted(usable, usable[first] + targets[cost] - state['usable'][cost])
+                stops[cost] = (first, last)
+            finished = [cost for cost, (_, last) in stops.items() if last <= len(rolls[cost][0])]
+            if len(finished) == len(stops):
+                end = max(rolls[cost][0][stops[cost][1] - 1] for cost in finished)
+            else:
+                end = runs_per_block - 1
+
+            for cost, (first, last) in stops.items():
+                runs, usable, xp, tuners = rolls[cost]
+                last = min(last, len(runs))
+                state['xp'] += xp[last] - xp[first]
+                state['tuners'] += tuners[last] - tuners[first]
+                state['rolled'][cost] += int(last - first)
+                state['usable'][cost] += int(usable[last] - usable[first])
+                if cost in finished:
+                    state['pending'].remove(cost)
+            state['tacet_runs'] += end - start + 1
+            for cost in dropped:
+                state['total'][cost] += int(dropped[cost][end + 1] - dropped[cost][start])
+
+            if not state['pending']:
+                trials['xp'].append(state['xp'])
+                trials['tuners'].append(state['tuners'])
+                trials['tacet_runs'].append(state['tacet_runs'])
+                for cost in targets:
+                    trials['rolled'][cost].append(state['rolled'][cost])
+                for cost in dropped:
+                    trials['total'][cost].append(state['total'][cost])
+                state = TacetField._new_trial(targets, tuple(dropped))
+            start = end + 1
+
+        return state
+
+    @staticmethod
+    def _new_trials(targets: dict, costs: tuple) -> dict:
+        return {
+            'xp': [], 'tuners': [], 'tacet_runs': [],
+            'rolled': {cost: [] for cost in targets},
+            'total': {cost: [] for cost in costs},
+        }
+
+    @staticmethod
+    def _new_trial(targets: dict, costs: tuple) -> dict:
+        return {
+            'xp': 0.0, 'tuners': 0.0, 'tacet_runs': 0,
+            'pending': list(targets),
+            'usable': {cost: 0 for cost in targets},
+            'rolled': {cost: 0 for cost in targets},
+            'total': {cost: 0 for cost in costs},
+        }
+
+    # Id of the 'Correct' set and, per cost, which mainstat ids are acceptable
+    def _accept_lookup(self) -> tuple:
+        return sampling.compiled(
+            type(self), 'accept', self._build_accept_lookup,
+            self.acceptable, self.mainstats, self.sets,
+        )
+
+    @staticmethod
+    def _build_accept_lookup(acceptable: dict, mainstats: dict, sets: dict) -> tuple:
+        correct = list(sets.keys()).index('Correct')
+        lookup = {
+            cost: np.array([mainstat in acceptable.get(cost, []) for mainstat in names], dtype=bool)
+            for cost, names in mainstats.items()
+        }
+        return correct, lookup
+
+    # Alias samplers for the cost, mainstat and set tables
+    # Compiled once from the class-level tables and rebuilt if they change
+    def _samplers(self) -> tuple:
+        return sampling.compiled(
+            type(self), 'drop', self._build_samplers,
+            self.costs, self.mainstat_probs, self.sets,
+        )
+
+    @staticmethod
+    def _build_samplers(costs: dict, mainstat_probs: dict, sets: dict) -> tuple:
+        mainstat_samplers = {cost: AliasSampler(probs) for cost, probs in mainstat_probs.items()}
+        return (
+            tuple(costs.keys()), AliasSampler(list(costs.values())), mainstat_samplers,
+            tuple(sets.keys()), AliasSampler(list(sets.values())),
+        )
+
     def __str__(self) -> str:
         rep = ""
         for e in self.drops:
@@ -0,0 +1,32 @@
+import cache
+import cost_agnostic_sim
+import indiv_cost_sim
+import policy
+from cache import ResultCache
+
+
+def test_code_version_covers_imported_modules():
+    names = {module.__name__ for module in cache.code_modules(cost_agnostic_sim.Simulation)}
+    assert {'echo', 'engine', 'tacet', 'sampling', 'stats', 'markov', 'policy', 'variance', 'streams',
+            'checkpoint', 'trialstore', 'cost_agnostic_sim'} <= names
+    assert 'cli' not in names and 'numpy' not in names
+
+
+def test_code_version_covers_policy_modules():
+    names = {module.__name__ for module in cache.code_modules(indiv_cost_sim.BaseSimulation, policy.Policy)}
+    assert 'policy' in names
+    plain = cache.scenario_key(indiv_cost_sim.BaseSimulation, 1, 1, {'cost_filter': 1})
+    with_policy = cache.scenario_key(indiv_cost_sim.BaseSimulation, 1, 1, {'cost_filter': 1, 'policy': policy.Policy()})
+    assert plain != with_policy
+
+
+def test_cold_cache_matches_uncached_run_and_extends(tmp_path):
+    results = ResultCache(str(tmp_path))
+    cached = results.run(cost_agnostic_sim.Simulation, 2000, seed=3, thresholds=(2,))
+    plain = cost_agnostic_sim.Simulation(2000, seed=3, thresholds=(2,))
+    assert cached.results[2]['waveplates'].mean == plain.results[2]['waveplates'].mean
+
+    extended = results.run(cost_agnostic_sim.Simulation, 3000, seed=3, thresholds=(2,))
+    assert extended.results[2]['waveplates'].count == 3000
+    served = results.run(cost_agnostic_sim.Simulation, 3000, seed=3, thresholds=(2,))
+    assert served.results[2]['waveplates'].mean == extended.results[2]['waveplates'].mean
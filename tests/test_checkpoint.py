@@ -0,0 +1,74 @@
+import pytest
+
+import checkpoint
+import cost_agnostic_sim
+import indiv_cost_sim
+import trialstore
+
+
+class Interrupted(Exception):
+    pass
+
+
+# Make checkpoint.save raise instead of saving from its `after`-th call on, as if the run were killed there
+def interrupt(monkeypatch, after: int) -> None:
+    save = checkpoint.save
+    calls = []
+
+    def failing(path, state):
+        calls.append(path)
+        if len(calls) >= after:
+            raise Interrupted
+        save(path, state)
+
+    monkeypatch.setattr(checkpoint, 'save', failing)
+    return
+
+
+def averages(sim) -> dict:
+    sim.compute_averages()
+    return sim.averages
+
+
+@pytest.mark.parametrize('options', [{'batched': True}, {'keyed': True}])
+def test_resumed_run_matches_uninterrupted_run(tmp_path, monkeypatch, options):
+    run = {'seed': 4, 'thresholds': (1, 3), 'checkpoint_every': 300, **options}
+    whole = cost_agnostic_sim.Simulation(1000, checkpoint=str(tmp_path / 'whole.ckpt'), **run)
+
+    path = str(tmp_path / 'cut.ckpt')
+    with monkeypatch.context() as patch:
+        interrupt(patch, 4)
+        with pytest.raises(Interrupted):
+            cost_agnostic_sim.Simulation(1000, checkpoint=path, **run)
+    assert checkpoint.load(path)['rounds'] == 2
+
+    resumed = cost_agnostic_sim.Simulation(1000, checkpoint=path, resume=True, **run)
+    assert averages(resumed) == averages(whole)
+
+
+def test_keyed_checkpointed_run_matches_uncheckpointed_run(tmp_path):
+    run = {'seed': 5, 'thresholds': (2,), 'keyed': True}
+    plain = cost_agnostic_sim.Simulation(500, **run)
+    checkpointed = cost_agnostic_sim.Simulation(500, checkpoint=str(tmp_path / 'run.ckpt'), checkpoint_every=200, **run)
+    # Same trials, summed in a different order
+    for name, acc in plain.results[2].items():
+        assert checkpointed.results[2][name].count == acc.count
+        assert checkpointed.results[2][name].mean == pytest.approx(acc.mean)
+
+
+def test_resumed_trial_store_holds_the_trials_of_the_results(tmp_path, monkeypatch):
+    store = str(tmp_path / 'trials')
+    run = {'seed': 6, 'thresholds': (2, 4), 'checkpoint_every': 150, 'trials': store}
+    path = str(tmp_path / 'run.ckpt')
+    with monkeypatch.context() as patch:
+        # The third round is stored, but killed before its snapshot
+        interrupt(patch, 4)
+        with pytest.raises(Interrupted):
+            indiv_cost_sim.BaseSimulation(500, 3, checkpoint=path, **run)
+    assert len(trialstore.TrialStore(store)) == 3 * 150 * 2
+
+    sim = indiv_cost_sim.BaseSimulation(500, 3, checkpoint=path, resume=True, **run)
+    trials = trialstore.TrialStore(store)
+    assert len(trials) == sum(sim.results[threshold]['waveplates'].count for threshold in sim.thresholds) == 1000
+    waveplates = sum(acc.mean * acc.count for acc in (sim.results[t]['echo_waveplates'] for t in sim.thresholds))
+    assert trials.read('tacet_runs').sum() * 60 == pytest.approx(waveplates)
@@ -0,0 +1,52 @@
+import pytest
+
+import indiv_cost_sim
+import instrument
+
+
+@pytest.fixture
+def counting():
+    with instrument.enabled():
+        yield
+    instrument.reset()
+
+
+# Tacet runs per trial as the trials recorded them, from their echo waveplates
+def recorded_runs(sim) -> float:
+    metrics = [sim.results[threshold]['echo_waveplates'] for threshold in sim.thresholds]
+    return sum(acc.mean * acc.count for acc in metrics) / 60
+
+
+@pytest.mark.parametrize('options', [{'batched': True}, {'skip': True}])
+def test_tacet_runs_are_the_ones_trials_used(counting, options):
+    sim = indiv_cost_sim.BaseSimulation(200, 3, seed=1, thresholds=(2, 5), **options)
+    report = instrument.report(sim)
+    assert report['tacet_runs'] == pytest.approx(recorded_runs(sim))
+    assert report['tacet_runs_per_trial'] == pytest.approx(recorded_runs(sim) / 400)
+
+
+@pytest.mark.parametrize('options', [{'batched': False}, {'keyed': True}])
+def test_scalar_rolls_with_policy_are_counted(counting, options):
+    import cost_agnostic_sim
+    import policy
+
+    sim = cost_agnostic_sim.Simulation(20, seed=2, thresholds=(3,), policy=policy.MinCritRoll({'Crit Rate': 7.5}),
+                                       **options)
+    report = instrument.report(sim)
+    assert report['echoes_rolled'] == sim.results[3]['rolled'].mean * 20
+    assert report['substat_picks'] >= report['echoes_rolled']
+
+
+# Blocks run past the last trial, drops and rolls only count up to it
+def test_drops_and_rolls_are_the_ones_trials_used(counting):
+    sim = indiv_cost_sim.BaseSimulation(300, 3, seed=1, thresholds=(3,), batched=True)
+    batched = instrument.report(sim)
+    assert batched['echoes_dropped'] / batched['tacet_runs'] <= 5
+    assert batched['echoes_dropped'] == pytest.approx(sum(acc.mean * acc.count for acc in sim.results[3]['total'].values()))
+    assert batched['echoes_rolled'] == pytest.approx(sim.results[3]['rolled'].mean * 300)
+
+    instrument.reset()
+    sim = indiv_cost_sim.BaseSimulation(300, 3, seed=1, thresholds=(3,), batched=False)
+    scalar = instrument.report(sim)
+    rolled = sim.results[3]['rolled']
+    assert batched['echoes_rolled'] / 300 == pytest.approx(scalar['echoes_rolled'] / 300, abs=4 * rolled.std / 300 ** 0.5)
@@ -0,0 +1,25 @@
+import pytest
+
+import cost_agnostic_sim
+import indiv_cost_sim
+import trialstore
+
+
+def test_keyed_results_do_not_depend_on_workers():
+    run = {'seed': 7, 'thresholds': (1, 4), 'keyed': True}
+    one = cost_agnostic_sim.Simulation(300, workers=1, **run)
+    two = cost_agnostic_sim.Simulation(300, workers=2, **run)
+    for threshold in run['thresholds']:
+        for name, acc in one.results[threshold].items():
+            assert two.results[threshold][name].count == acc.count
+            assert two.results[threshold][name].mean == pytest.approx(acc.mean)
+
+
+def test_replay_reproduces_stored_trials(tmp_path):
+    store = str(tmp_path / 'trials')
+    sim = indiv_cost_sim.BaseSimulation(6, 1, seed=8, thresholds=(3,), keyed=True, trials=store)
+    trials = trialstore.TrialStore(store)
+    for trial, (xp, runs) in enumerate(zip(trials.read('xp'), trials.read('tacet_runs'))):
+        replayed = sim.replay(3, trial)
+        assert replayed['xp'] == pytest.approx(xp)
+        assert replayed['tacet_runs'] == runs
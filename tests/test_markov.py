@@ -0,0 +1,38 @@
+import pytest
+
+import cost_agnostic_sim
+import markov
+
+METRICS = ('xp', 'tuners', 'rolled', 'waveplates')
+
+
+# Each sampled mean within 5 standard errors of the exact expectation
+def assert_agrees(sim, threshold: int) -> None:
+    expected = markov.solve(threshold)
+    for metric in METRICS:
+        acc = sim.results[threshold][metric]
+        assert abs(acc.mean - expected[metric]) <= 5 * acc.std / acc.count ** 0.5, metric
+
+
+def test_outcomes_sum_to_one():
+    for threshold in range(1, 6):
+        outcomes = markov.solve(threshold)['outcomes']
+        assert sum(outcomes.values()) == pytest.approx(1)
+
+
+@pytest.mark.parametrize('options,iterations', [
+    ({'batched': False}, 1500),
+    ({'batched': True}, 20000),
+    ({'crn': True}, 20000),
+    ({'skip': True}, 20000),
+])
+def test_sampling_modes_agree_with_markov(options, iterations):
+    sim = cost_agnostic_sim.Simulation(iterations, seed=7, thresholds=(1, 5), **options)
+    for threshold in (1, 5):
+        assert_agrees(sim, threshold)
+
+
+def test_exact_mode_is_markov():
+    sim = cost_agnostic_sim.Simulation(0, exact=True, thresholds=(2,))
+    sim.compute_averages()
+    assert sim.averages[2]['waveplates'] == pytest.approx(markov.solve(2)['waveplates'])
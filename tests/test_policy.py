@@ -0,0 +1,43 @@
+import pytest
+
+import cost_agnostic_sim
+import markov
+import policy
+from echo import Echo, roll_echo
+
+POLICIES = [
+    policy.Policy(),
+    policy.MinCritRoll({'Crit Rate': 7.5}),
+    policy.WithSubstats(('ATK%',)),
+    policy.PerMainstat({'ATK%': policy.MinCritRoll({'Crit Damage': 15.0})}),
+]
+
+
+@pytest.mark.parametrize('rule', POLICIES, ids=repr)
+def test_scalar_and_batched_agree_with_policy_outcomes(rule):
+    expected = markov.expectations(markov.outcome_probabilities(3, rule))
+    for options, iterations in (({'batched': False}, 300), ({'batched': True}, 5000)):
+        sim = cost_agnostic_sim.Simulation(iterations, seed=4, thresholds=(3,), policy=rule, **options)
+        acc = sim.results[3]['rolled']
+        assert abs(acc.mean - expected['rolled']) <= 5 * acc.std / acc.count ** 0.5
+
+
+def test_base_policy_rolls_like_the_threshold_rule():
+    import random
+
+    tables = policy.Policy().scalar_tables(2)
+    for seed in range(200):
+        random.seed(seed)
+        plain = roll_echo(Echo(), 2)
+        random.seed(seed)
+        assert roll_echo(Echo(), 2, tables=tables) == plain
+        random.seed(seed)
+        assert roll_echo(Echo(), 2, policy=policy.Policy()) == plain
+
+
+def test_scalar_tables_resolve_each_mainstat_once():
+    rule = policy.PerMainstat({'ATK%': policy.MinCritRoll({'Crit Damage': 15.0})})
+    tables = rule.scalar_tables(3)
+    assert tables['ATK%'] is tables['ATK%']
+    assert tables['ATK%'] == rule.scalar_table(3, 'ATK%')
+    assert tables['ATK%'] != tables['HP%']
@@ -0,0 +1,43 @@
+import pytest
+
+from roster import Character, Planner
+from tacet import TacetField
+import tacet_field_sim
+
+
+# A one-character roster is the tacet field simulation
+def test_one_character_matches_tacet_field_sim():
+    thresholds = (2, 4)
+    planner = Planner(3000, [Character('Solo')], seed=11, thresholds=thresholds)
+    sim = tacet_field_sim.Simulation(3000, seed=12, thresholds=thresholds)
+    for threshold in thresholds:
+        for metric in ('waveplates', 'echo_waveplates', 'xp', 'tuners'):
+            planned, simulated = planner.results[threshold][metric], sim.results[threshold][metric]
+            tolerance = 1.5 * (planned.half_width() ** 2 + simulated.half_width() ** 2) ** 0.5
+            assert planned.mean == pytest.approx(simulated.mean, abs=tolerance)
+
+
+# Two characters wanting the same echoes share the drops one at a time, so together they farm
+# exactly what one character needing both echoes does
+def test_each_drop_goes_to_one_character():
+    first = Character('First', needs={3: 1}, four_cost=None)
+    second = Character('Second', needs={3: 1}, four_cost=None)
+    both = Character('Both', needs={3: 2}, four_cost=None)
+    pair = Planner(500, [first, second], seed=13, thresholds=(3,))
+    solo = Planner(500, [both], seed=13, thresholds=(3,))
+
+    shared, alone = pair.results[3], solo.results[3]
+    for metric in ('xp', 'tuners', 'echo_waveplates'):
+        assert shared[metric].mean == pytest.approx(alone[metric].mean)
+    assert shared['rolled']['First'].mean + shared['rolled']['Second'].mean == pytest.approx(alone['rolled']['Both'].mean)
+    assert shared['done_runs']['First'].mean <= shared['done_runs']['Second'].mean
+
+
+def test_drops_go_to_the_rarest_need_first():
+    broad = Character('Broad', needs={3: 1}, acceptable={3: ['Aero%', 'Havoc%']})
+    narrow = Character('Narrow', needs={3: 1}, acceptable={3: ['Aero%']})
+    planner = Planner(1, [broad, narrow], seed=14, thresholds=(3,))
+    aero = (3, list(TacetField.sets).index('Correct'), TacetField.mainstats[3].index('Aero%'))
+    havoc = (3, list(TacetField.sets).index('Correct'), TacetField.mainstats[3].index('Havoc%'))
+    assert [planner.slots[slot][0] for slot in planner.routes[aero]] == [1, 0]
+    assert [planner.slots[slot][0] for slot in planner.routes[havoc]] == [0]
@@ -0,0 +1,68 @@
+import random
+
+import numpy as np
+
+import sampling
+from sampling import AliasSampler
+from tacet import TacetField
+
+
+# Observed frequencies within 5 standard errors of the normalized weights
+def assert_matches(counts: np.ndarray, weights: list) -> None:
+    n = counts.sum()
+    p = np.asarray(weights) / sum(weights)
+    assert np.all(np.abs(counts / n - p) <= 5 * np.sqrt(p * (1 - p) / n) + 1e-12)
+
+
+def test_sample_array_matches_weights():
+    weights = [12.66, 12.66, 6.0, 0.5, 30.0, 0.0]
+    draws = AliasSampler(weights).sample_array(400000, np.random.default_rng(1))
+    assert_matches(np.bincount(draws, minlength=len(weights)), weights)
+    assert not np.any(draws == 5)
+
+
+def test_sample_matches_weights():
+    weights = [1, 2, 3, 4]
+    random.seed(2)
+    sampler = AliasSampler(weights)
+    draws = [sampler.sample() for _ in range(200000)]
+    assert_matches(np.bincount(draws, minlength=len(weights)), weights)
+
+
+def test_compiled_builds_once_until_tables_change():
+    builds = []
+    tables = {'a': [1, 2]}
+
+    def build(t):
+        builds.append(dict(t))
+        return len(builds)
+
+    sampling.refresh()
+    assert sampling.compiled(test_compiled_builds_once_until_tables_change, 'x', build, tables) == 1
+    assert sampling.compiled(test_compiled_builds_once_until_tables_change, 'x', build, tables) == 1
+    # Equal tables in other objects reuse the artifact, different ones rebuild it
+    assert sampling.compiled(test_compiled_builds_once_until_tables_change, 'x', build, {'a': [1, 2]}) == 1
+    assert sampling.compiled(test_compiled_builds_once_until_tables_change, 'x', build, {'a': [3]}) == 2
+
+    # Edits in place are picked up at the next refresh
+    tables['a'].append(3)
+    assert sampling.compiled(test_compiled_builds_once_until_tables_change, 'x', build, tables) == 3
+    tables['a'].append(4)
+    sampling.refresh()
+    assert sampling.compiled(test_compiled_builds_once_until_tables_change, 'x', build, tables) == 4
+    assert builds[-1] == {'a': [1, 2, 3, 4]}
+
+
+def test_simulation_start_picks_up_table_edits():
+    import cost_agnostic_sim
+
+    original = TacetField.mainstat_probs[1]
+    try:
+        TacetField.mainstat_probs[1] = [1.0, 0.0, 0.0]
+        cost_agnostic_sim.Simulation(0)
+        mainstat_sampler = TacetField()._samplers()[2][1]
+        assert mainstat_sampler.sample_array(1000, np.random.default_rng(0)).max() == 0
+    finally:
+        TacetField.mainstat_probs[1] = original
+        sampling.refresh()
+
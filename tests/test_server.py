@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+import cost_agnostic_sim
+import server
+
+
+def test_equal_requests_normalize_equal():
+    first = server.normalize({'scenario': 'indiv_cost', 'thresholds': [3, 1, 3], 'cost_filter': 3,
+                              'acceptable': {'3': ['Aero%', 'ATK%', 'Aero%']}})
+    second = server.normalize({'scenario': 'indiv_cost', 'thresholds': [1, 3], 'cost_filter': [3],
+                               'acceptable': {3: ['ATK%', 'Aero%']}, 'relative': True})
+    assert first == second
+    assert first['thresholds'] == [1, 3] and first['relative'] is False
+
+
+@pytest.mark.parametrize('body, message', [
+    ({'scenario': 'cost_agnostic', 'acceptable': {'1': ['HP%']}}, "acceptable is not supported"),
+    ({'scenario': 'tacet_field', 'exact': True}, "exact is only supported"),
+    ({'scenario': 'tacet_field', 'acceptable': {'3': ['Crit Rate']}}, "acceptable mainstats for cost 3"),
+    ({'scenario': 'cost_agnostic', 'keyed': True}, "keyed needs a seed"),
+    ({'scenario': 'cost_agnostic', 'iterations': 0}, "iterations must be"),
+    ({'scenario': 'cost_agnostic', 'verbose': True}, "unknown fields: verbose"),
+])
+def test_invalid_requests_are_rejected(body, message):
+    with pytest.raises(ValueError, match=message):
+        server.normalize(body)
+
+
+def test_compute_matches_a_direct_run():
+    request = server.normalize({'scenario': 'cost_agnostic', 'iterations': 200, 'thresholds': [2], 'seed': 9})
+    answer = server.compute(request)
+    sim = cost_agnostic_sim.Simulation(200, seed=9, thresholds=(2,))
+    sim.compute_averages()
+    averages = answer['runs'][0]['averages']['2']
+    assert averages['iterations'] == 200
+    assert averages['waveplates'] == pytest.approx(sim.averages[2]['waveplates'])
+
+
+def test_service_serves_repeats_from_its_cache():
+    service = server.Service(workers=1)
+    body = {'scenario': 'cost_agnostic', 'iterations': 50, 'thresholds': [1], 'seed': 3}
+
+    async def ask():
+        try:
+            return [await service.simulate(body), await service.simulate({**body, 'thresholds': 1})]
+        finally:
+            service.close()
+
+    (first, served), (second, again) = asyncio.run(ask())
+    assert (served, again) == ('computed', 'cache')
+    assert first is second
+    assert service.counts['computed'] == 1 and service.counts['cache_hits'] == 1
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from sweep import sweep
+from tacet import TacetField
+import indiv_cost_sim
+
+
+# farm_trials from a seed, as before the sweep split it into dropped_counts, cumulative_rolls and walk_block
+def test_seeded_farm_trials_is_pinned():
+    trials = TacetField(iterations=0).farm_trials(4, {1: 2, 3: 2}, 3, np.random.default_rng(7))
+    assert trials['tacet_runs'] == [109, 217, 136, 13]
+    assert trials['rolled'] == {1: [23, 21, 23, 2], 3: [17, 54, 4, 2]}
+    assert trials['total'] == {1: [97, 194, 117, 8], 3: [370, 735, 466, 45]}
+    assert trials['tuners'] == [1138.0, 2013.0, 809.0, 200.0]
+    assert trials['xp'] == pytest.approx([279.956, 424.916, 224.348, 114.08])
+
+
+# A single-cell sweep is the matching indiv_cost_sim run
+@pytest.mark.parametrize('cost', [1, 3])
+def test_single_cell_matches_indiv_cost_sim(cost):
+    row, = sweep(2000, cost_filter=[cost], thresholds=(3,), seed=15)
+    sim = indiv_cost_sim.BaseSimulation(2000, cost, seed=16, thresholds=(3,))
+    metrics = sim.results[3]
+    assert row['iterations'] == metrics['waveplates'].count
+    # Within 1.5 times the half-width of the difference, about three standard errors
+    for key, acc, scale in (('waveplates', metrics['waveplates'], 1), ('xp', metrics['xp'], 1),
+                            ('rolled', metrics['rolled'], 1), ('tacet_runs', metrics['echo_waveplates'], 60)):
+        tolerance = 1.5 * 1.96 * 2 ** 0.5 * acc.sem
+        assert row[key] * scale == pytest.approx(acc.mean, abs=tolerance)
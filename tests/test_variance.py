@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from echo import Echo
+import markov
+import variance
+
+
+@pytest.mark.parametrize('estimator', variance.ESTIMATORS)
+@pytest.mark.parametrize('threshold', [1, 4])
+def test_interval_contains_the_exact_result(estimator, threshold):
+    estimate = variance.estimate(threshold, 32768, estimator, np.random.default_rng(17))
+    exact = markov.solve(threshold)
+    for metric in ('waveplates', 'xp', 'tuners', 'rolled'):
+        assert abs(estimate[metric] - exact[metric]) <= estimate['half_width'][metric]
+
+
+# Likelihood ratios of an unbiased tilt average to 1 under the tilted draw, for every prefix
+def test_importance_weights_average_to_one():
+    tracked = variance.tracked_ids()
+    type_weights = np.ones(len(Echo._batch_tables()[0]))
+    type_weights[tracked] = 5.0
+    _, _, weights = variance.draw_tilted(200000, type_weights, np.random.default_rng(18))
+    sem = weights.std(axis=0) / np.sqrt(len(weights))
+    assert np.all(np.abs(weights.mean(axis=0) - 1) <= 4 * sem)
@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Rows buffered in memory before a writer appends them to disk in one go
+BUFFER_ROWS = 1 << 16
+# Rows per chunk file, one file per column and chunk
+CHUNK_ROWS = 1 << 22
+MANIFEST = 'manifest.json'
+
+
+# Appends per-trial records to a store directory as raw column files, for TrialStore to read back
+# Every writer owns one part of the store, a subdirectory named by its creation time and process,
+# so the workers of a parallel run each write their own without coordinating. A part holds one
+# file per column and chunk of CHUNK_ROWS rows, plus a manifest of the columns and the rows in each
+# chunk; rows only count once the manifest, replaced atomically after every flush, says so.
+# Nothing is created until the first flush, so a writer that records no trials leaves no part.
+# :directory: str - The store directory, created if needed
+# :columns: dict - dtype of each column, by name
+class TrialWriter:
+    def __init__(self, directory: str, columns: dict) -> None:
+        self.directory = directory
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self.part = None
+        self.chunks = []
+        self.pending = {name: [] for name in self.columns}
+        self.buffered = 0
+
+        return
+
+    # Buffer one or many trials, flushing once BUFFER_ROWS are waiting
+    # :values: dict - Scalar or array per column; scalars are repeated to the length of the arrays
+    def append(self, values: dict) -> None:
+        rows = max(np.size(value) for value in values.values())
+        for name, dtype in self.columns.items():
+            value = np.asarray(values[name], dtype=dtype)
+            self.pending[name].append(np.broadcast_to(value, (rows,)) if value.ndim == 0 else value)
+        self.buffered += rows
+        if self.buffered >= BUFFER_ROWS:
+            self.flush()
+        return
+
+    # Write the buffered rows to the chunk files, then publish them in the manifest
+    def flush(self) -> None:
+        if not self.buffered:
+            return
+        if self.part is None:
+            self.part = os.path.join(self.directory, f"part-{time.time_ns():020d}-{os.getpid()}")
+            os.makedirs(self.part)
+        columns = {name: np.concatenate(arrays) for name, arrays in self.pending.items()}
+        written = 0
+        while written < self.buffered:
+            if not self.chunks or self.chunks[-1] == CHUNK_ROWS:
+                self.chunks.append(0)
+            take = min(CHUNK_ROWS - self.chunks[-1], self.buffered - written)
+            for name, values in columns.items():
+                with open(self._chunk_path(self.part, name, len(self.chunks) - 1), 'ab') as f:
+                    f.write(values[written:written + take].tobytes())
+            self.chunks[-1] += take
+            written += take
+
+        manifest = {'columns': {name: dtype.str for name, dtype in self.columns.items()}, 'chunks': self.chunks}
+        fd, tmp = tempfile.mkstemp(dir=self.part, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(self.part, MANIFEST))
+
+        self.pending = {name: [] for name in self.columns}
+        self.buffered = 0
+        return
+
+    def close(self) -> None:
+        self.flush()
+        return
+
+    @staticmethod
+    def _chunk_path(part: str, name: str, chunk: int) -> str:
+        return os.path.join(part, f"{name}.{chunk:06d}.bin")
+
+
+# Read-only view of a store written by TrialWriters, memory-mapping one chunk at a time
+# Parts are read in the order they were created, and only as far as their manifests go, so a store
+# can be opened while a run is still appending to it. Nothing is loaded until it is asked for:
+# chunks() maps the chunk files as they are reached, and read() copies a single range.
+# :directory: str - The store directory
+class TrialStore:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.parts = []
+        self.columns = {}
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name, MANIFEST)
+            if not name.startswith('part-') or not os.path.exists(path):
+                continue
+            with open(path) as f:
+                manifest = json.load(f)
+            columns = {column: np.dtype(dtype) for column, dtype in manifest['columns'].items()}
+            assert not self.columns or columns == self.columns, f"{name} has different columns from the other parts"
+            self.columns = columns
+            self.parts.append((os.path.join(directory, name), manifest['chunks']))
+
+        return
+
+    def __len__(self) -> int:
+        return sum(sum(chunks) for _, chunks in self.parts)
+
+    # Iterate over the chunks in order, as dicts of read-only memory-mapped arrays
+    # :columns: list - Columns to map, all of them if omitted
+    def chunks(self, columns: list = None):
+        for part, chunks in self.parts:
+            for chunk, rows in enumerate(chunks):
+                if rows:
+                    yield {
+                        name: np.memmap(TrialWriter._chunk_path(part, name, chunk), dtype=self.columns[name],
+                                        mode='r', shape=(rows,))
+                        for name in (columns or self.columns)
+                    }
+
+    # Copy the rows start:stop of one column into memory
+    def read(self, name: str, start: int = 0, stop: int = None) -> np.ndarray:
+        stop = len(self) if stop is None else min(stop, len(self))
+        pieces = []
+        offset = 0
+        for chunk in self.chunks([name]):
+            values = chunk[name]
+            lo, hi = max(start - offset, 0), min(stop - offset, len(values))
+            if lo < hi:
+                pieces.append(np.array(values[lo:hi]))
+            offset += len(values)
+            if offset >= stop:
+                break
+        return np.concatenate(pieces) if pieces else np.empty(0, dtype=self.columns[name])
+
+
+# Names of the parts of a store with published rows, in the order they were created, none if the store
+# does not exist yet
+# :directory: str - The store directory
+def part_names(directory: str) -> list:
+    if not os.path.isdir(directory):
+        return []
+    return [
+        name for name in sorted(os.listdir(directory))
+        if name.startswith('part-') and os.path.exists(os.path.join(directory, name, MANIFEST))
+    ]
+
+
+# Delete every part of a store but the ones to keep, published or not, e.g. to roll a store back to the
+# parts a checkpoint recorded
+# :directory: str - The store directory
+# :keep: list - Names of the parts to keep, as from part_names
+def drop_parts(directory: str, keep: list) -> None:
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith('part-') and name not in keep:
+            shutil.rmtree(os.path.join(directory, name))
+    return
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    store = TrialStore(sys.argv[1])
+    print(f"{len(store)} trials in {len(store.parts)} parts, columns: {', '.join(store.columns)}")
+
+    # Per-threshold means, streamed one chunk at a time
+    counts, sums = {}, {}
+    for chunk in store.chunks():
+        thresholds = chunk['threshold']
+        for threshold in np.unique(thresholds):
+            rows = thresholds == threshold
+            counts[threshold] = counts.get(threshold, 0) + int(rows.sum())
+            for name, values in chunk.items():
+                sums.setdefault(threshold, {}).setdefault(name, 0.0)
+                sums[threshold][name] += float(values[rows].sum())
+    for threshold in sorted(counts):
+        means = ", ".join(f"{name} {total / counts[threshold]:.2f}"
+                          for name, total in sums[threshold].items() if name != 'threshold')
+        print(f"Threshold {threshold}: {counts[threshold]} trials, {means}")
+
+    end_time = time.perf_counter()
+    print(f"Finished in {end_time - start_time:.6f}s")
@@ -0,0 +1,264 @@
+from echo import Echo
+from policy import Policy
+import markov
+import numpy as np
+import parallel
+import sampling
+import stats
+import time
+
+# Echoes drawn per round of an estimate when no budget is given
+BATCH_SIZE = 65536
+# Echoes per stratum in the pilot round that sets the stratified allocation
+PILOT_SIZE = 4096
+# Smallest share of a round any stratum gets, so one that looked quiet in the pilot is still checked
+MIN_SHARE = 0.05
+# Every way a single echo can end up, as (num_substats, dbl_crit)
+OUTCOMES = tuple((num_substats, False) for num_substats in range(1, 6)) + ((5, True),)
+# Metrics estimated for a trial, with the same keys as cost_agnostic_sim.Simulation.averages
+METRICS = ('xp', 'tuners', 'rolled', 'xp_waveplates', 'tuners_waveplates', 'waveplates')
+ESTIMATORS = ('importance', 'stratified')
+
+
+# Weighted counts of how the echoes drawn in one stratum ended up
+class OutcomeTally:
+    def __init__(self) -> None:
+        self.count = 0
+        self.weights = np.zeros(len(OUTCOMES))
+        self.squares = np.zeros(len(OUTCOMES))
+
+    # :outcome_ids: (n,) array - Index of each echo's outcome in OUTCOMES
+    # :weights: (n,) array - Likelihood ratio of each echo, ones for unweighted draws
+    def add(self, outcome_ids: np.ndarray, weights: np.ndarray) -> None:
+        self.count += len(outcome_ids)
+        self.weights += np.bincount(outcome_ids, weights, len(OUTCOMES))
+        self.squares += np.bincount(outcome_ids, weights ** 2, len(OUTCOMES))
+        return
+
+    # Estimated probability of each outcome
+    def mean(self) -> np.ndarray:
+        return self.weights / self.count
+
+    # Sample covariance of one echo's weighted outcome indicators, the outcomes being exclusive
+    def covariance(self) -> np.ndarray:
+        mean = self.mean()
+        return (np.diag(self.squares / self.count) - np.outer(mean, mean)) * self.count / (self.count - 1)
+
+    # Kish effective sample size of the weights
+    def kish(self) -> float:
+        return self.weights.sum() ** 2 / self.squares.sum()
+
+
+# Estimate the cost agnostic results for one threshold with fewer echoes than plain sampling
+# A trial is a run of independent echoes ending at the usable-th double crit, so all of its
+# expected costs follow from how a single echo ends up (markov.expectations). The estimators
+# only need that outcome distribution, and sample it where plain trials are least informative:
+# - importance: tilts the substat draw toward the policy's tracked substats, Crit Rate and
+#   Crit Damage by default, and weights each echo by the likelihood ratio of the substats it
+#   actually rolled, so the rare double crits make up a large share of the draws
+# - stratified: splits echoes by whether their first substat is tracked, which has a known
+#   probability and largely decides the outcome at low thresholds, then allocates draws between
+#   the two groups by the spread of the waveplate cost they show (Neyman allocation)
+# Confidence intervals come from the covariance of the outcome estimates by the delta method.
+# :threshold: int - The number of substats to roll before checking for the presence of a crit stat
+# :echoes: int - Echoes drawn per round
+# :estimator: str - 'importance' or 'stratified'
+# :rng: np.random.Generator - Source of randomness, a fresh unseeded generator if omitted
+# :policy: policy.Policy - Tuning policy to roll with instead of the plain crit threshold rule
+# :usable: int - The number of double crit echoes needed
+# :precision: float - Keep drawing rounds until the 95% CI half-width of the waveplate cost is this small
+# :relative: bool - Whether precision is a fraction of the estimated waveplate cost
+# :max_echoes: int - Upper limit on the echoes drawn when precision is set
+# :tilt: float - Weight of a tracked substat relative to the others when importance sampling,
+#   by default enough to make the first substat tracked a third of the time, which pays off at
+#   every threshold where heavier tilts only help the lowest ones
+# Returns a dict with the metric keys of markov.solve plus 'half_width' (95% CI of each metric),
+# 'echoes' drawn, 'ess' (plain echoes that would give the same waveplate variance) and
+# 'ess_trials' (the same in trials), and 'weight_ess' (Kish) when importance sampling
+def estimate(threshold: int, echoes: int = BATCH_SIZE, estimator: str = 'importance', rng: np.random.Generator = None,
+             policy: Policy = None, usable: int = 5, precision: float = None, relative: bool = False,
+             max_echoes: int = None, tilt: float = None) -> dict:
+    assert estimator in ESTIMATORS, f"estimator must be one of {ESTIMATORS}"
+    if rng is None:
+        rng = np.random.default_rng()
+    sampling.refresh()
+    num_types = len(Echo._batch_tables()[0])
+    tracked = tracked_ids(policy)
+    untracked = np.setdiff1d(np.arange(num_types), tracked)
+
+    if estimator == 'importance':
+        if tilt is None:
+            tilt = len(untracked) / (2 * len(tracked))
+        type_weights = np.ones(num_types)
+        type_weights[tracked] = tilt
+        strata = [(1.0, lambda n: draw_tilted(n, type_weights, rng))]
+    else:
+        strata = [
+            (len(first) / num_types, lambda n, first=first: draw_stratum(n, first, rng))
+            for first in (tracked, untracked) if len(first)
+        ]
+    tallies = [OutcomeTally() for _ in strata]
+
+    def draw_round(sizes: list) -> None:
+        for (_, draw), tally, size in zip(strata, tallies, sizes):
+            substats, tiers, weights = draw(size)
+            batch = Echo.score_batch(substats, tiers, threshold, policy)
+            outcome_ids = batch.num_substats.astype(np.intp) - 1 + batch.dbl_crit
+            tally.add(outcome_ids, weights[np.arange(size), batch.num_substats - 1])
+        return
+
+    drawn = 0
+    while True:
+        budget = echoes
+        if estimator == 'stratified' and drawn == 0:
+            # Pilot split evenly to learn how much each stratum varies, the rest of the round by allocate
+            pilot = [max(min(PILOT_SIZE, echoes // (2 * len(strata))), 2)] * len(strata)
+            draw_round(pilot)
+            budget = max(echoes - sum(pilot), 0)
+            drawn += sum(pilot)
+        if estimator == 'importance':
+            sizes = [budget]
+        elif combine(strata, tallies)[0][-1] > 0:
+            sizes = allocate(strata, tallies, budget, usable)
+        else:
+            sizes = [budget // len(strata)] * len(strata)
+        draw_round(sizes)
+        drawn += sum(sizes)
+
+        probs, covariance = combine(strata, tallies)
+        if probs[-1] == 0:
+            assert max_echoes is None or drawn < max_echoes, "no usable echo drawn, raise the echo budget"
+            continue
+        result = summarize(probs, covariance, usable)
+        if precision is None or (max_echoes is not None and drawn >= max_echoes):
+            break
+        target = precision * abs(result['waveplates']) if relative else precision
+        if result['half_width']['waveplates'] <= target:
+            break
+
+    result['echoes'] = drawn
+    result['ess_trials'] = result['ess'] / result['rolled']
+    if estimator == 'importance':
+        result['weight_ess'] = tallies[0].kish()
+    return result
+
+
+# Substat ids of the substats a policy looks at, Crit Rate and Crit Damage without one
+def tracked_ids(policy: Policy = None) -> np.ndarray:
+    names = Echo._roll_tables()[0]
+    tracked = (policy or Policy).tracked
+    return np.array([names.index(name) for name in tracked])
+
+
+# Draw the substats of n echoes with each type weighted by type_weights instead of uniformly
+# Weighted sampling without replacement orders the types by exponential keys scaled by
+# their weights. Tiers are drawn as usual.
+# Returns substats and tiers as in Echo.draw_substats_batch, and an (n, 5) array whose column k
+# is the likelihood ratio of the first k + 1 substats under the uniform draw against this one
+def draw_tilted(n: int, type_weights: np.ndarray, rng: np.random.Generator) -> tuple:
+    tier_lookup = Echo._batch_tables()[0]
+    num_types = len(type_weights)
+    substats = (rng.exponential(size=(n, num_types)) / type_weights).argsort(axis=1)[:, :5]
+    tiers = tier_lookup[substats, rng.integers(0, 100, size=(n, 5))]
+
+    picked = type_weights[substats]
+    remaining = type_weights.sum() - np.cumsum(picked, axis=1) + picked
+    uniform = 1 / (num_types - np.arange(5))
+    weights = np.exp(np.cumsum(np.log(uniform * remaining / picked), axis=1))
+    return substats.astype(np.int8), tiers, weights
+
+
+# Draw the substats of n echoes whose first substat is uniform over first_ids, the rest as usual
+# Returns substats, tiers and unit weights in the shape of draw_tilted
+def draw_stratum(n: int, first_ids: np.ndarray, rng: np.random.Generator) -> tuple:
+    tier_lookup = Echo._batch_tables()[0]
+    keys = rng.random((n, tier_lookup.shape[0]))
+    keys[np.arange(n), rng.choice(first_ids, n)] = -1
+    substats = keys.argsort(axis=1)[:, :5]
+    tiers = tier_lookup[substats, rng.integers(0, 100, size=(n, 5))]
+    return substats.astype(np.int8), tiers, np.ones((n, 5))
+
+
+# Outcome probabilities and their covariance from the tallies of each (probability, draw) stratum
+def combine(strata: list, tallies: list) -> tuple:
+    probs = sum(share * tally.mean() for (share, _), tally in zip(strata, tallies))
+    covariance = sum(share ** 2 * tally.covariance() / tally.count for (share, _), tally in zip(strata, tallies))
+    return probs, covariance
+
+
+# Split a round's echoes between strata in proportion to share times the spread of each stratum's
+# contribution to the waveplate cost, keeping at least MIN_SHARE of the round for each
+def allocate(strata: list, tallies: list, echoes: int, usable: int) -> list:
+    probs, _ = combine(strata, tallies)
+    gradient = gradients(probs, usable)[METRICS.index('waveplates')]
+    spreads = np.array([
+        share * np.sqrt(max(gradient @ tally.covariance() @ gradient, 0))
+        for (share, _), tally in zip(strata, tallies)
+    ])
+    shares = spreads / spreads.sum() if spreads.sum() > 0 else np.full(len(strata), 1 / len(strata))
+    shares = np.maximum(shares, MIN_SHARE)
+    sizes = [max(int(echoes * share / shares.sum()), 2) for share in shares]
+    sizes[-1] += max(echoes - sum(sizes), 0)
+    return sizes
+
+
+# Expected trial metrics, in METRICS order, for an estimate of the outcome probabilities
+def trial_metrics(probs: np.ndarray, usable: int) -> np.ndarray:
+    probs = np.clip(probs, 0, None)
+    outcomes = dict(zip(OUTCOMES, probs / probs.sum()))
+    result = markov.expectations(outcomes, usable)
+    return np.array([result[metric] for metric in METRICS])
+
+
+# Jacobian of trial_metrics by forward differences, with one column per outcome
+# Outcomes never seen have no variance, so their columns are left at zero
+# :values: np.ndarray - trial_metrics(probs, usable), computed here if omitted
+def gradients(probs: np.ndarray, usable: int, values: np.ndarray = None, step: float = 1e-3) -> np.ndarray:
+    if values is None:
+        values = trial_metrics(probs, usable)
+    jacobian = np.zeros((len(METRICS), len(OUTCOMES)))
+    for i in np.flatnonzero(probs > 0):
+        h = step * probs[i]
+        shifted = probs.copy()
+        shifted[i] += h
+        jacobian[:, i] = (trial_metrics(shifted, usable) - values) / h
+    return jacobian
+
+
+# Trial metrics with delta method confidence intervals, and the plain echoes worth as much
+def summarize(probs: np.ndarray, covariance: np.ndarray, usable: int) -> dict:
+    values = trial_metrics(probs, usable)
+    jacobian = gradients(probs, usable, values)
+    variances = np.maximum(np.einsum('mi,ij,mj->m', jacobian, covariance, jacobian), 0)
+
+    # One plain echo's outcome is a multinomial draw
+    normalized = np.clip(probs, 0, None) / np.clip(probs, 0, None).sum()
+    plain = np.diag(normalized) - np.outer(normalized, normalized)
+    wave = jacobian[METRICS.index('waveplates')]
+    wave_variance = variances[METRICS.index('waveplates')]
+
+    result = dict(zip(METRICS, values.tolist()))
+    result['p_dbl_crit'] = float(normalized[-1])
+    result['outcomes'] = dict(zip(OUTCOMES, normalized.tolist()))
+    result['half_width'] = dict(zip(METRICS, (stats.Z_95 * np.sqrt(variances)).tolist()))
+    result['ess'] = float(wave @ plain @ wave / wave_variance) if wave_variance > 0 else float('inf')
+    return result
+
+
+if __name__ == "__main__":
+    start_time = time.perf_counter()
+
+    rng = parallel.seed_streams(0)
+    print("Estimated costs to roll 5 double crit echoes from 65536 echoes per threshold:")
+    for estimator in ESTIMATORS:
+        for threshold in range(1, 6):
+            data = estimate(threshold, estimator=estimator, rng=rng)
+            exact = markov.solve(threshold)['waveplates']
+            print(
+                f"{estimator} threshold {threshold}: "
+                f"{data['waveplates']:.1f} +- {data['half_width']['waveplates']:.1f} waveplates "
+                f"(exact {exact:.1f}), worth {data['ess_trials']:.0f} plain trials"
+            )
+
+    end_time = time.perf_counter()
+    print(f"Finished in {end_time - start_time:.6f}s")